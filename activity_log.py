@@ -0,0 +1,128 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+INSERT_ACTIVITY = '''INSERT INTO activity_log (timestamp, action, details, athlete_id)
+                     VALUES (?, ?, ?, ?)'''
+
+_STOP = object()
+
+class ActivityLogWriter:
+    """
+    Write-behind queue for activity_log rows.
+
+    Requests hand entries to submit() and return immediately; a single
+    background thread inserts them in batches, one transaction per batch,
+    whenever batch_size entries are waiting or flush_interval seconds have
+    passed since the first entry of the batch. A batch that fails (e.g. the
+    database stays locked past busy_timeout) is retried with backoff; if it
+    still fails its entries are written one by one, so only an entry the
+    database keeps refusing is lost.
+
+    Args:
+        connect (callable): Returns a new sqlite3 connection; called once,
+            from the writer thread
+        batch_size (int): Maximum entries per transaction
+        flush_interval (float): Maximum seconds an entry waits to be written
+        retries (int): Extra attempts for a failed batch
+        retry_delay (float): Seconds before the first retry, doubled each time
+    """
+
+    def __init__(self, connect, batch_size=200, flush_interval=0.25, retries=4, retry_delay=0.5):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, entry):
+        """Queue a (timestamp, action, details, athlete_id) tuple."""
+        self._ensure_started()
+        self._queue.put(entry)
+
+    def flush(self):
+        """Block until every entry submitted so far has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Write the remaining entries and stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = self.connect()
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._next_batch()
+                if batch:
+                    self._write(conn, batch)
+        finally:
+            conn.close()
+
+    def _next_batch(self):
+        """Collect entries until the batch is full, its deadline passes or close() is called."""
+        first = self._queue.get()
+        if first is _STOP:
+            self._queue.task_done()
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                self._queue.task_done()
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _write(self, conn, batch):
+        try:
+            delay = self.retry_delay
+            for attempt in range(self.retries + 1):
+                try:
+                    with conn:
+                        conn.executemany(INSERT_ACTIVITY, batch)
+                    return
+                except sqlite3.Error as e:
+                    logger.warning(f"Writing {len(batch)} activity log entries failed "
+                                   f"(attempt {attempt + 1}): {e}")
+                    if attempt < self.retries:
+                        time.sleep(delay)
+                        delay *= 2
+            # Still failing: keep every entry the database accepts
+            for entry in batch:
+                try:
+                    with conn:
+                        conn.execute(INSERT_ACTIVITY, entry)
+                except sqlite3.Error as e:
+                    logger.error(f"Dropped activity log entry {entry!r}: {e}")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
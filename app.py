@@ -1,17 +1,52 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g, has_app_context, Response, jsonify, abort
+import os
 import sqlite3
+import threading
 from datetime import datetime, timedelta
 import random
-from functools import wraps
+from functools import wraps, lru_cache
 import hashlib
+import base64
+import binascii
+import io
+import json
 from datetime import datetime
 from time import sleep
 import jdatetime
-from sms import welcome_msg
+import atexit
+import click
+from sms import SmsDispatcher, init_outbox, queue_welcome_msg, queue_welcome_msgs
+from attendance_summary import init_attendance_daily, record_checkout, rebuild_attendance_daily, get_daily_summary
+from activity_log import ActivityLogWriter, INSERT_ACTIVITY
+from live_events import EventBroker
+from exports import csv_stream, xlsx_stream, XLSX_MIMETYPE
+from athlete_import import parse_athletes_csv
+from athlete_ids import init_athlete_ids, allocate_athlete_ids
+from archive import (init_archive, archive_old_rows, archived_before, archive_years,
+                     archive_schema, attached_archives, reclaim_space)
 
 app = Flask(__name__)
 app.secret_key = 'gymsecret'  # Change this to a secure secret key
+app.config['DATABASE'] = os.getenv('DB_PATH', 'database.db')
+app.config['ATHLETES_PAGE_SIZE'] = 30
+# Write activity_log rows from a background batch writer instead of the
+# request; set False to insert synchronously (tests, benchmarks, scripts)
+app.config['ACTIVITY_LOG_WRITE_BEHIND'] = True
+# SMS worker threads draining sms_outbox; set SMS_DISPATCH False to only
+# queue messages (tests, benchmarks)
+app.config['SMS_WORKERS'] = 2
+app.config['SMS_DISPATCH'] = True
+# activity_log/attendance rows older than this many days are moved to
+# per-year files in ARCHIVE_DIR by `flask archive-old-rows`
+app.config['ARCHIVE_DIR'] = 'archive'
+app.config['ARCHIVE_AFTER_DAYS'] = 365
 
+# Distinct dates seen by the app are few (a few thousand days), so the
+# converters below are memoized. Failed conversions are not cached and
+# raise exactly as before.
+DATE_CACHE_SIZE = 8192
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
 def convert_persian_to_gregorian(persian_date_str):
     """
     Convert Persian (Solar Hijri) date string to Gregorian date string.
@@ -41,6 +76,7 @@ def convert_persian_to_gregorian(persian_date_str):
     except Exception as e:
         raise Exception(f"Conversion error: {e}")
 
+@lru_cache(maxsize=DATE_CACHE_SIZE)
 def convert_gregorian_to_persian(gregorian_date_str):
     """
     Convert Gregorian date string to Persian (Solar Hijri) date string.
@@ -74,46 +110,232 @@ def convert_gregorian_to_persian(gregorian_date_str):
     except Exception as e:
         raise Exception(f"Conversion error: {e}")
 
+@app.template_filter('shamsi')
+def shamsi_filter(gregorian_date_str):
+    """
+    Jinja filter: {{ athlete.end_date|shamsi }} -> '1404/05/28'.
+    
+    Accepts a date ('YYYY-MM-DD') or timestamp ('YYYY-MM-DD HH:MM:SS');
+    only the date part is converted. Empty values render as ''.
+    """
+    if not gregorian_date_str:
+        return ''
+    return convert_gregorian_to_persian(gregorian_date_str[:10])
+
+# Persian text normalization for search: Arabic yeh/kaf variants, ZWNJ and
+# Persian/Arabic-Indic digits, so "علي" finds "علی" and "۰۹۱۲" finds "0912"
+PERSIAN_NORMALIZATION = {
+    '\u064a': '\u06cc',  # Arabic yeh -> Persian yeh
+    '\u0649': '\u06cc',  # Alef maksura -> Persian yeh
+    '\u0643': '\u06a9',  # Arabic kaf -> Persian kaf
+    '\u200c': ' ',        # Zero-width non-joiner
+}
+PERSIAN_NORMALIZATION.update({chr(0x06f0 + digit): str(digit) for digit in range(10)})
+PERSIAN_NORMALIZATION.update({chr(0x0660 + digit): str(digit) for digit in range(10)})
+_PERSIAN_TRANSLATION = str.maketrans(PERSIAN_NORMALIZATION)
+
+def normalize_persian(text):
+    """Apply PERSIAN_NORMALIZATION to a Python string."""
+    return text.translate(_PERSIAN_TRANSLATION)
+
+def normalize_persian_sql(expression):
+    """
+    The same normalization as an SQL expression.
+    
+    Plain replace() calls rather than a Python UDF, so the FTS triggers
+    keep working for any client that writes to the database.
+    """
+    for source, target in PERSIAN_NORMALIZATION.items():
+        expression = f"replace({expression}, char({ord(source)}), '{target}')"
+    return expression
+
+def fts_match_query(search_query):
+    """
+    FTS5 MATCH expression for free-text search: every word must match as
+    a prefix. Returns None when the input has no searchable words.
+    """
+    words = normalize_persian(search_query).split()
+    if not words:
+        return None
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+# Membership end date, derived from start_date + original_days by SQLite itself
+# so register/renew can never leave it stale. VIRTUAL (not STORED) because
+# SQLite can only add virtual generated columns with ALTER TABLE.
+END_DATE_COLUMN = '''end_date TEXT GENERATED ALWAYS AS
+                    (date(start_date, '+' || original_days || ' days')) VIRTUAL'''
+# 'MM-DD' of the Gregorian birth_date, indexed with gender for the birthday
+# reminder (which maps Jalali birthdays onto it, see birthday_month_days)
+BIRTH_MONTH_DAY_COLUMN = '''birth_month_day TEXT GENERATED ALWAYS AS
+                    (substr(birth_date, 6, 5)) VIRTUAL'''
+
+def active_end_date_floor():
+    """
+    Smallest end_date that still counts as an active membership.
+    
+    An athlete is active while (end_date - now).days > 0, i.e. while the
+    membership ends on or after the day after tomorrow.
+    
+    Returns:
+        str: Gregorian date in format 'YYYY-MM-DD'
+    """
+    return (datetime.now() + timedelta(days=2)).strftime('%Y-%m-%d')
+
+def days_remaining(end_date_str):
+    """Whole days left until end_date ('YYYY-MM-DD'), never negative."""
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    return max(0, (end_date - datetime.now()).days)
+
 # Database Helper Functions
-def get_db_connection():
-    conn = sqlite3.connect('database.db', timeout=30) 
+
+# Applied once when a connection is opened, not on every request
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA busy_timeout=30000',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',     # 16 MB page cache
+    'PRAGMA mmap_size=134217728',   # 128 MB memory-mapped I/O
+    'PRAGMA temp_store=MEMORY',
+)
+
+_pool = threading.local()
+
+class DbConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that holds write-behind activity entries until commit.
+    
+    log_activity() parks entries on the connection; commit() hands them to
+    the batch writer and rollback() drops them, so an action that was rolled
+    back (and maybe retried by the client) is never logged.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending_activity = []
+    
+    def commit(self):
+        super().commit()
+        entries, self.pending_activity = self.pending_activity, []
+        for entry in entries:
+            activity_writer.submit(entry)
+    
+    def rollback(self):
+        self.pending_activity = []
+        super().rollback()
+
+def open_db_connection(database=None):
+    """
+    Open a new, fully configured connection to the database.
+    
+    URI filenames are enabled so archives can be attached read-only
+    (file:...?mode=ro); plain paths behave as before.
+    """
+    conn = sqlite3.connect(database or app.config['DATABASE'], timeout=30, uri=True,
+                           factory=DbConnection)
     conn.row_factory = sqlite3.Row
-    conn.execute('PRAGMA journal_mode=WAL')
-    conn.execute('PRAGMA busy_timeout=30000')  
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+def get_pooled_connection():
+    """
+    Return this worker thread's connection, opening it on first use.
+    
+    Connections are kept per thread (sqlite3 connections must not be shared
+    across threads) and per database path, and live as long as the thread.
+    """
+    database = app.config['DATABASE']
+    connections = getattr(_pool, 'connections', None)
+    if connections is None:
+        connections = _pool.connections = {}
+    conn = connections.get(database)
+    if conn is None:
+        conn = connections[database] = open_db_connection(database)
+    return conn
+
+def get_db_connection():
+    """
+    Connection for the current app context.
+    
+    Inside a request every caller (routes, log_activity, allocate_athlete_ids)
+    shares one pooled connection, committed or rolled back once by
+    release_db_connection when the context ends. Outside an app context
+    (init_db, scripts) a fresh connection is returned and the caller
+    closes it.
+    """
+    if not has_app_context():
+        return open_db_connection()
+    if 'db' not in g:
+        g.db = get_pooled_connection()
+    return g.db
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    if exception is None:
+        conn.commit()
+    else:
+        conn.rollback()
+
 def execute_with_retry(conn, query, params, max_retries=3):
     for attempt in range(max_retries):
         try:
             return conn.execute(query, params)
         except sqlite3.OperationalError as e:
             if "database is locked" in str(e) and attempt < max_retries - 1:
-                sleep(0.1 + random() * 0.1)  
+                sleep(0.1 + random.random() * 0.1)  
                 continue
             raise
 
-def generate_unique_id():
-    conn = get_db_connection()
-    while True:
-        athlete_id = random.randint(1000, 9999)
-        athlete = conn.execute('SELECT 1 FROM athletes WHERE id = ?', (athlete_id,)).fetchone()
-        if not athlete:
-            conn.close()
-            return athlete_id
+activity_writer = ActivityLogWriter(open_db_connection)
+atexit.register(activity_writer.close)
+
+sms_dispatcher = SmsDispatcher(open_db_connection, workers=app.config['SMS_WORKERS'])
+atexit.register(sms_dispatcher.stop, 5)
+
+@app.before_request
+def start_sms_dispatcher():
+    """
+    Start the SMS workers with the first request after the app boots, so
+    messages left pending by a restart or queued by import-athletes are sent
+    without waiting for the next registration.
+    """
+    if app.config['SMS_DISPATCH']:
+        sms_dispatcher.start()
+
+# Live attendance board: one channel per gender
+attendance_events = EventBroker()
 
 def log_activity(action, details, athlete_id=None):
+    """
+    Record an activity.
+    
+    With ACTIVITY_LOG_WRITE_BEHIND the entry goes to the batch writer once
+    the current request's transaction commits (right away outside a
+    request); otherwise it is inserted in that transaction.
+    """
+    entry = (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), action, details, athlete_id)
+    if app.config['ACTIVITY_LOG_WRITE_BEHIND']:
+        if has_app_context():
+            get_db_connection().pending_activity.append(entry)
+        else:
+            activity_writer.submit(entry)
+        return
+    
     conn = get_db_connection()
-    conn.execute('INSERT INTO activity_log (timestamp, action, details, athlete_id) VALUES (?, ?, ?, ?)',
-                (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), action, details, athlete_id))
-    conn.commit()
-    conn.close()
+    conn.execute(INSERT_ACTIVITY, entry)
+    if not has_app_context():
+        conn.commit()
+        conn.close()
 
 def init_db():
     conn = get_db_connection()
     
     try:
         # Athletes table
-        conn.execute('''CREATE TABLE IF NOT EXISTS athletes
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS athletes
                     (id INTEGER PRIMARY KEY,
                     first_name TEXT NOT NULL,
                     last_name TEXT NOT NULL,
@@ -124,7 +346,75 @@ def init_db():
                     birth_date TEXT,
                     registration_date TEXT NOT NULL,
                     start_date TEXT NOT NULL,
-                    original_days INTEGER NOT NULL)''')
+                    original_days INTEGER NOT NULL,
+                    card_code TEXT,
+                    {END_DATE_COLUMN},
+                    {BIRTH_MONTH_DAY_COLUMN})''')
+        
+        # Migrate databases created before end_date existed
+        columns = [row['name'] for row in conn.execute('PRAGMA table_xinfo(athletes)')]
+        if 'end_date' not in columns:
+            conn.execute(f'ALTER TABLE athletes ADD COLUMN {END_DATE_COLUMN}')
+        if 'card_code' not in columns:
+            conn.execute('ALTER TABLE athletes ADD COLUMN card_code TEXT')
+        if 'birth_month_day' not in columns:
+            conn.execute(f'ALTER TABLE athletes ADD COLUMN {BIRTH_MONTH_DAY_COLUMN}')
+        
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_athletes_gender_end_date 
+            ON athletes(gender, end_date)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_athletes_gender_registration 
+            ON athletes(gender, registration_date)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_athletes_gender_start_date 
+            ON athletes(gender, start_date)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_athletes_gender_name 
+            ON athletes(gender, first_name, last_name)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_athletes_gender_birth_month_day 
+            ON athletes(gender, birth_month_day)
+        ''')
+        # Membership card (barcode) codes are optional but unique
+        conn.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_athletes_card_code 
+            ON athletes(card_code) WHERE card_code IS NOT NULL
+        ''')
+        
+        # Full-text index over names and phone numbers, rowid = athlete id
+        fts_exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'athletes_fts'").fetchone()
+        conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS athletes_fts
+                     USING fts5(name, phone, tokenize='unicode61 remove_diacritics 2')''')
+        
+        fts_name = normalize_persian_sql("new.first_name || ' ' || new.last_name")
+        fts_phone = normalize_persian_sql("new.phone || ' ' || coalesce(new.emergency_phone, '')")
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS athletes_fts_insert
+                     AFTER INSERT ON athletes BEGIN
+                         INSERT INTO athletes_fts(rowid, name, phone)
+                         VALUES (new.id, {fts_name}, {fts_phone});
+                     END''')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS athletes_fts_update
+                     AFTER UPDATE OF first_name, last_name, phone, emergency_phone ON athletes BEGIN
+                         DELETE FROM athletes_fts WHERE rowid = old.id;
+                         INSERT INTO athletes_fts(rowid, name, phone)
+                         VALUES (new.id, {fts_name}, {fts_phone});
+                     END''')
+        conn.execute('''CREATE TRIGGER IF NOT EXISTS athletes_fts_delete
+                     AFTER DELETE ON athletes BEGIN
+                         DELETE FROM athletes_fts WHERE rowid = old.id;
+                     END''')
+        
+        # Index members that existed before the search table
+        if not fts_exists:
+            conn.execute(f'''INSERT INTO athletes_fts(rowid, name, phone)
+                         SELECT id, {fts_name.replace('new.', '')}, {fts_phone.replace('new.', '')}
+                         FROM athletes''')
         
         # Activity log table
         conn.execute('''CREATE TABLE IF NOT EXISTS activity_log
@@ -135,6 +425,49 @@ def init_db():
                     athlete_id INTEGER,
                     FOREIGN KEY(athlete_id) REFERENCES athletes(id))''')
         
+        # Newest-first history pages walk one of these from the top; the
+        # rowid (id) is the last key of each, which breaks timestamp ties
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_activity_log_timestamp 
+            ON activity_log(timestamp)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_activity_log_action_timestamp 
+            ON activity_log(action, timestamp)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_activity_log_athlete_timestamp 
+            ON activity_log(athlete_id, timestamp)
+        ''')
+        
+        # Full-text index over details, rowid = activity_log id. Contentless:
+        # the log already stores the text, the index only needs its tokens.
+        log_fts_exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'activity_log_fts'").fetchone()
+        conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS activity_log_fts
+                     USING fts5(details, content='', tokenize='unicode61 remove_diacritics 2')''')
+        fts_details = normalize_persian_sql('new.details')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS activity_log_fts_insert
+                     AFTER INSERT ON activity_log BEGIN
+                         INSERT INTO activity_log_fts(rowid, details) VALUES (new.id, {fts_details});
+                     END''')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS activity_log_fts_delete
+                     AFTER DELETE ON activity_log BEGIN
+                         INSERT INTO activity_log_fts(activity_log_fts, rowid, details)
+                         VALUES ('delete', old.id, {fts_details.replace('new.', 'old.')});
+                     END''')
+        if not log_fts_exists:
+            conn.execute(f'''INSERT INTO activity_log_fts(rowid, details)
+                         SELECT id, {fts_details.replace('new.', '')} FROM activity_log''')
+        
+        # Per gender/day attendance summary
+        init_attendance_daily(conn)
+        
+        # Outbound SMS queue
+        init_outbox(conn)
+        init_athlete_ids(conn)
+        init_archive(conn)
+        
         # Attendance table
         conn.execute('''CREATE TABLE IF NOT EXISTS attendance
                      (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -153,170 +486,310 @@ def init_db():
             CREATE INDEX IF NOT EXISTS idx_attendance_check_out 
             ON attendance(check_out_time)
         ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_attendance_date_athlete 
+            ON attendance(date, athlete_id, check_out_time)
+        ''')
         
         conn.commit()
     finally:
         conn.close()
 
-def get_today_attendance_stats(gender, date_filter):
+@app.template_filter('duration')
+def format_duration(seconds):
+    """'1h 25m' for a session length in seconds."""
+    hours, remainder = divmod(seconds % 86400, 3600)
+    minutes, _ = divmod(remainder, 60)
+    return f"{hours}h {minutes}m"
+
+def get_attendance_snapshot(gender, date_filter, search_query=None, schema='main'):
+    """
+    Everything the attendance page shows, from one query.
+    
+    A single statement reads a consistent snapshot: active athletes come
+    from the (gender, end_date) index and each one's visits on date_filter
+    from the (date, athlete_id) index, so there is no per-athlete parameter
+    list and no Python-side expiry math.
+    
+    Args:
+        gender (str): Gender of the logged-in admin
+        date_filter (str): Gregorian date 'YYYY-MM-DD'
+        search_query (str): Optional ID or name filter for the records table
+        schema (str): Database holding date_filter's attendance, e.g. an
+            attached archive year
+    
+    Returns:
+        tuple: (stats, attendance_data, active_athletes)
+    """
     conn = get_db_connection()
-    try:
-        # Get all active athletes first
-        athletes = execute_with_retry(conn, '''
-            SELECT id, start_date, original_days 
-            FROM athletes 
-            WHERE gender = ?
-        ''', (gender,)).fetchall()
-        
-        # Filter active athletes in Python
-        active_athletes = []
-        for athlete in athletes:
-            start_date = datetime.strptime(athlete['start_date'], '%Y-%m-%d')
-            end_date = start_date + timedelta(days=athlete['original_days'])
-            remaining_days = (end_date - datetime.now()).days 
-            remaining_days = remaining_days if remaining_days >= 0 else 0
-            
-            if remaining_days > 0:
-                active_athletes.append(athlete['id'])
-        
-        total_active = len(active_athletes)
-        
-        if not active_athletes:
-            return {
-                'present': 0,
-                'active': 0,
-                'absent': 0
-            }
-        
-        # Number of attendees on selected date (only active athletes)
-        present = execute_with_retry(conn, '''
-            SELECT COUNT(DISTINCT a.id) 
-            FROM attendance att
-            JOIN athletes a ON att.athlete_id = a.id
-            WHERE att.date = ? AND a.gender = ? AND a.id IN ({})
-        '''.format(','.join('?' * len(active_athletes))), 
-        [date_filter, gender] + active_athletes).fetchone()[0]
-        
-        # Active sessions (checked in but not checked out) - only active athletes
-        active = execute_with_retry(conn, '''
-            SELECT COUNT(DISTINCT a.id) 
-            FROM attendance att
-            JOIN athletes a ON att.athlete_id = a.id
-            WHERE att.date = ? AND a.gender = ? AND att.check_out_time IS NULL AND a.id IN ({})
-        '''.format(','.join('?' * len(active_athletes))), 
-        [date_filter, gender] + active_athletes).fetchone()[0]
-        
-        absent = total_active - present
-        
-        return {
-            'present': present,
-            'active': active,
-            'absent': absent
-        }
-    finally:
-        conn.close()
+    
+    if search_query:
+        match_sql = '''(a.id = :search OR
+                        a.id IN (SELECT rowid FROM athletes_fts WHERE athletes_fts MATCH :match))'''
+    else:
+        match_sql = '1'
+    
+    rows = execute_with_retry(conn, f'''
+        WITH active AS (
+            SELECT id, first_name, last_name
+            FROM athletes
+            WHERE gender = :gender AND end_date >= :active_from
+        ),
+        visits AS (
+            SELECT athlete_id,
+                   MAX(id) AS latest_id,
+                   SUM(check_out_time IS NULL) AS open_sessions
+            FROM {schema}.attendance
+            WHERE date = :date AND athlete_id IN (SELECT id FROM active)
+            GROUP BY athlete_id
+        )
+        SELECT a.id,
+               a.first_name,
+               a.last_name,
+               att.check_in_time,
+               att.check_out_time,
+               CAST(ROUND((julianday(att.check_out_time) - julianday(att.check_in_time)) * 86400)
+                    AS INTEGER) AS duration_seconds,
+               COALESCE(visits.open_sessions, 0) AS open_sessions,
+               {match_sql} AS matches
+        FROM active a
+        LEFT JOIN visits ON visits.athlete_id = a.id
+        LEFT JOIN {schema}.attendance att ON att.id = visits.latest_id
+        ORDER BY a.first_name, a.last_name, a.id
+    ''', {
+        'gender': gender,
+        'active_from': active_end_date_floor(),
+        'date': date_filter,
+        'search': search_query,
+        'match': fts_match_query(search_query or '') or '""',
+    }).fetchall()
+    
+    stats = {'present': 0, 'active': 0, 'absent': 0}
+    attendance_data = []
+    for record in rows:
+        if record['check_in_time']:
+            stats['present'] += 1
+        if record['open_sessions']:
+            stats['active'] += 1
+        
+        if not record['matches']:
+            continue
+        
+        status = "absent"
+        duration = None
+        
+        if record['check_in_time']:
+            if record['check_out_time']:
+                status = "present"
+                duration = format_duration(record['duration_seconds'])
+            else:
+                status = "active"
+        
+        attendance_data.append({
+            'athlete_id': record['id'],
+            'name': f"{record['first_name']} {record['last_name']}",
+            'check_in': record['check_in_time'],
+            'check_out': record['check_out_time'],
+            'duration': duration,
+            'status': status
+        })
+    stats['absent'] = len(rows) - stats['present']
+    
+    return stats, attendance_data, rows
 
-def get_attendance_records(gender, date_filter, search_query=None):
+def get_active_athletes(gender):
+    """Active athletes for the check-in form, from the (gender, end_date) index."""
+    return execute_with_retry(get_db_connection(), '''
+        SELECT id, first_name, last_name
+        FROM athletes
+        WHERE gender = ? AND end_date >= ?
+        ORDER BY first_name, last_name, id
+    ''', (gender, active_end_date_floor())).fetchall()
+
+# The dashboard lists at most this many members expiring within 48 hours
+EXPIRING_48H_LIMIT = 50
+
+def get_dashboard_stats(gender):
+    """
+    Home page statistics for one gender.
+    
+    Counts come from a single query of index range counts over
+    (gender, end_date) and (gender, registration_date); the 48-hour list
+    is a bounded index scan. The active, expiring-soon and recent counts
+    cost as much as the members they count. The total and the expired
+    (48-hour) count walk every index entry of the gender, which grows with
+    total membership. That walk is an index-only scan, without table reads.
+    
+    Args:
+        gender (str): Gender of the logged-in admin
+    
+    Returns:
+        dict: Template context for home.html
+    """
     conn = get_db_connection()
+    now = datetime.now()
+    active_from = active_end_date_floor()
+    # remaining days < 7 and <= 2 respectively, see active_end_date_floor()
+    expiring_soon_before = (now + timedelta(days=8)).strftime('%Y-%m-%d')
+    expiring_48h_before = (now + timedelta(days=4)).strftime('%Y-%m-%d')
+    seven_days_ago = (now - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    counts = execute_with_retry(conn, '''
+        SELECT
+            (SELECT COUNT(*) FROM athletes WHERE gender = :gender) AS total_athletes,
+            (SELECT COUNT(*) FROM athletes
+             WHERE gender = :gender AND end_date >= :active_from) AS active_athletes,
+            (SELECT COUNT(*) FROM athletes
+             WHERE gender = :gender AND end_date >= :active_from
+               AND end_date < :expiring_soon_before) AS expiring_soon,
+            (SELECT COUNT(*) FROM athletes
+             WHERE gender = :gender AND end_date < :expiring_48h_before) AS expiring_48h_count,
+            (SELECT COUNT(*) FROM athletes
+             WHERE gender = :gender AND registration_date > :seven_days_ago) AS recent_registrations
+    ''', {
+        'gender': gender,
+        'active_from': active_from,
+        'expiring_soon_before': expiring_soon_before,
+        'expiring_48h_before': expiring_48h_before,
+        'seven_days_ago': seven_days_ago,
+    }).fetchone()
+    
+    # Expiring in less than 48 hours (or already expired), most recent first
+    expiring_rows = execute_with_retry(conn, '''
+        SELECT first_name, last_name, start_date, original_days, end_date
+        FROM athletes
+        WHERE gender = ? AND end_date < ?
+        ORDER BY end_date DESC
+        LIMIT ?
+    ''', (gender, expiring_48h_before, EXPIRING_48H_LIMIT)).fetchall()
+    
+    expiring_48h = []
+    for athlete in expiring_rows:
+        expiring_48h.append({
+            'first_name': athlete['first_name'],
+            'last_name': athlete['last_name'],
+            'start_date': athlete['start_date'],
+            'end_date': athlete['end_date'],
+            'days_remaining': days_remaining(athlete['end_date']),
+            'original_days': athlete['original_days']
+        })
+    
+    return {
+        'total_athletes': counts['total_athletes'],
+        'active_athletes': counts['active_athletes'],
+        'expiring_soon': counts['expiring_soon'],
+        'recent_registrations': counts['recent_registrations'],
+        'expiring_48h': expiring_48h,
+        'expiring_48h_count': counts['expiring_48h_count']
+    }
+
+# Sort keys for the athletes list: key columns (ending with id so every
+# position is unique) and direction. Each is served by a (gender, ...) index.
+ATHLETE_SORTS = {
+    'start_date': (('start_date', 'id'), 'DESC'),
+    'end_date': (('end_date', 'id'), 'DESC'),
+    'days_remaining': (('end_date', 'id'), 'ASC'),
+    'name': (('first_name', 'last_name', 'id'), 'ASC'),
+}
+
+def encode_cursor(values):
+    """Opaque, URL-safe cursor for a row's sort key values."""
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+def decode_cursor(cursor, size):
+    """Key values from encode_cursor(), or None if the cursor is invalid."""
     try:
-        query = '''
-            SELECT 
-                a.id as athlete_id,
-                a.first_name,
-                a.last_name,
-                a.start_date,
-                a.original_days,
-                att.check_in_time,
-                att.check_out_time,
-                att.date
-            FROM athletes a
-            LEFT JOIN (
-                SELECT athlete_id, MAX(id) as max_id
-                FROM attendance
-                WHERE date = ?
-                GROUP BY athlete_id
-            ) latest ON a.id = latest.athlete_id
-            LEFT JOIN attendance att ON att.id = latest.max_id
-            WHERE a.gender = ?
-        '''
-        
-        params = [date_filter, gender]
-        
-        if search_query:
-            query += '''
-                AND (a.first_name LIKE ? OR 
-                     a.last_name LIKE ? OR 
-                     a.id = ?)
-            '''
-            search_param = f"%{search_query}%"
-            params.extend([search_param, search_param, search_query])
-        
-        query += ' ORDER BY a.first_name, a.last_name'
-        
-        records = execute_with_retry(conn, query, params).fetchall()
-        
-        attendance_data = []
-        for record in records:
-            start_date = datetime.strptime(record['start_date'], '%Y-%m-%d')
-            end_date = start_date + timedelta(days=record['original_days'])
-            remaining_days = (end_date - datetime.now()).days 
-            remaining_days = remaining_days if remaining_days >= 0 else 0
-            
-            if remaining_days > 0:
-                status = "absent"
-                duration = None
-                
-                if record['check_in_time']:
-                    if record['check_out_time']:
-                        status = "present"
-                        # Calculate duration
-                        check_in = datetime.strptime(record['check_in_time'], '%Y-%m-%d %H:%M:%S')
-                        check_out = datetime.strptime(record['check_out_time'], '%Y-%m-%d %H:%M:%S')
-                        delta = check_out - check_in
-                        hours, remainder = divmod(delta.seconds, 3600)
-                        minutes, _ = divmod(remainder, 60)
-                        duration = f"{hours}h {minutes}m"
-                    else:
-                        status = "active"
-                
-                attendance_data.append({
-                    'athlete_id': record['athlete_id'],
-                    'name': f"{record['first_name']} {record['last_name']}",
-                    'check_in': record['check_in_time'],
-                    'check_out': record['check_out_time'],
-                    'duration': duration,
-                    'status': status
-                })
-        
-        return attendance_data
-    finally:
-        conn.close()
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    # Only values SQLite can bind; a crafted cursor could hold lists or objects
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        return None
+    return values
 
-from datetime import datetime, timedelta
+def athlete_filters(gender, search_query=None):
+    """
+    WHERE clauses and parameters for the athletes list and its export.
+    
+    Returns:
+        tuple: (list of SQL conditions to AND together, params list)
+    """
+    where = ['gender = ?']
+    params = [gender]
+    
+    if search_query:
+        # Let the full-text match drive the lookup: the unary + keeps the
+        # planner from walking the whole (gender, ...) index in sort order
+        where[0] = '+gender = ?'
+        where.append('''(id = ? OR
+                          id IN (SELECT rowid FROM athletes_fts WHERE athletes_fts MATCH ?))''')
+        params.extend([search_query, fts_match_query(search_query) or '""'])
+    return where, params
 
-def get_active_athletes(gender):
+def get_athletes_page(gender, sort='start_date', search_query=None, after=None, before=None, page_size=None):
+    """
+    One page of athletes using keyset pagination.
+    
+    Rows are located by seeking past the cursor's sort key in the index
+    instead of OFFSET, so every page costs the same however deep it is.
+    
+    Args:
+        gender (str): Gender of the logged-in admin
+        sort (str): Key of ATHLETE_SORTS
+        search_query (str): Optional ID or name filter
+        after (str): Cursor of the last row of the previous page
+        before (str): Cursor of the first row of the next page
+        page_size (int): Rows per page, defaults to ATHLETES_PAGE_SIZE
+    
+    Returns:
+        tuple: (rows, prev_cursor, next_cursor); cursors are None at the ends
+    """
+    columns, direction = ATHLETE_SORTS.get(sort, ATHLETE_SORTS['start_date'])
+    page_size = page_size or app.config['ATHLETES_PAGE_SIZE']
     conn = get_db_connection()
-    try:
-        athletes = execute_with_retry(conn, '''
-            SELECT id, first_name, last_name, start_date, original_days 
-            FROM athletes 
-            WHERE gender = ?
-            ORDER BY first_name, last_name
-        ''', (gender,)).fetchall()
-        
-        active_athletes = []
-        for athlete in athletes:
-            start_date = datetime.strptime(athlete['start_date'], '%Y-%m-%d')
-            end_date = start_date + timedelta(days=athlete['original_days'])
-            remaining_days = (end_date - datetime.now()).days 
-            
-            if remaining_days > 0:
-                active_athletes.append(athlete) 
-        
-        return active_athletes
-        
-    finally:
-        conn.close()
+    where, params = athlete_filters(gender, search_query)
+    
+    backwards = False
+    cursor = None
+    if before:
+        cursor = decode_cursor(before, len(columns))
+        backwards = cursor is not None
+    elif after:
+        cursor = decode_cursor(after, len(columns))
+    
+    # Walking backwards flips both the seek comparison and the scan order
+    descending = (direction == 'DESC') != backwards
+    if cursor is not None:
+        placeholders = ', '.join('?' * len(columns))
+        where.append(f"({', '.join(columns)}) {'<' if descending else '>'} ({placeholders})")
+        params.extend(cursor)
+    
+    order = ', '.join(f"{column} {'DESC' if descending else 'ASC'}" for column in columns)
+    rows = execute_with_retry(conn, f'''
+        SELECT * FROM athletes
+        WHERE {' AND '.join(where)}
+        ORDER BY {order}
+        LIMIT ?
+    ''', params + [page_size + 1]).fetchall()
+    
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+    
+    prev_cursor = None
+    next_cursor = None
+    if rows and has_prev:
+        prev_cursor = encode_cursor(rows[0][column] for column in columns)
+    if rows and has_next:
+        next_cursor = encode_cursor(rows[-1][column] for column in columns)
+    
+    return rows, prev_cursor, next_cursor
 
 def login_required(f):
     @wraps(f)
@@ -327,6 +800,15 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def api_login_required(f):
+    """login_required for JSON endpoints: answers 401 instead of redirecting."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'logged_in' not in session:
+            return jsonify(ok=False, error='Please log in first'), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
 # Initialize the database
 init_db()
 
@@ -343,7 +825,6 @@ def login():
         
         conn = get_db_connection()
         user = conn.execute('SELECT * FROM admins WHERE username = ?', (username,)).fetchone()
-        conn.close()
         
         if user:
             user_dict = dict(user)
@@ -365,72 +846,14 @@ def login():
 @app.route('/')
 @login_required
 def home():
-    conn = get_db_connection()
     gender = session['gender']
-    
-    # Get all athletes for this gender
-    athletes = conn.execute(
-        "SELECT id, first_name, last_name, start_date, original_days, registration_date FROM athletes WHERE gender = ?",
-        (gender,)
-    ).fetchall()
-    
-    # Process athletes to calculate actual remaining days
-    active_athletes = []
-    expiring_48h = []
-    expiring_soon_count = 0
-    recent_registrations_count = 0
-    
-    # Calculate 7 days ago for recent registrations
-    seven_days_ago = datetime.now() - timedelta(days=7)
-    
-    for athlete in athletes:
-        start_date = datetime.strptime(athlete['start_date'], '%Y-%m-%d')
-        end_date = start_date + timedelta(days=athlete['original_days'])
-        remaining_days = (end_date - datetime.now()).days 
-        remaining_days = remaining_days if remaining_days >= 0 else 0
-            
-            # Check if expiring in less than 48 hours
-        if remaining_days <= 2:
-                expiring_48h.append({
-                    'first_name': athlete['first_name'],
-                    'last_name': athlete['last_name'],
-                    'start_date': athlete['start_date'],
-                    'end_date': end_date.strftime('%Y-%m-%d'),
-                    'start_date_shamsi': convert_gregorian_to_persian(athlete['start_date']),
-                    'end_date_shamsi': convert_gregorian_to_persian(end_date.strftime('%Y-%m-%d')),
-                    'days_remaining': remaining_days,
-                    'original_days': athlete['original_days']
-                })
-        # Check if athlete is active
-        if remaining_days > 0:
-            active_athletes.append(athlete)            
-            # Count expiring soon (less than 7 days)
-            if remaining_days < 7:
-                expiring_soon_count += 1
-        
-        # Count recent registrations (last 7 days)
-        if athlete['registration_date']:
-            registration_date = datetime.strptime(athlete['registration_date'], '%Y-%m-%d %H:%M:%S')
-            if registration_date > seven_days_ago:
-                recent_registrations_count += 1
-    
-    stats = {
-        'total_athletes': len(athletes),
-        'active_athletes': len(active_athletes),
-        'expiring_soon': expiring_soon_count,
-        'recent_registrations': recent_registrations_count,
-        'expiring_48h': expiring_48h,
-        'expiring_48h_count': len(expiring_48h)
-    }
-    
-    conn.close()
+    stats = get_dashboard_stats(gender)
     return render_template('home.html', **stats)
 
 @app.route('/register', methods=['GET', 'POST'])
 @login_required
 def register():
     if request.method == 'POST':
-        athlete_id = generate_unique_id()
         first_name = request.form['first_name']
         last_name = request.form['last_name']
         phone = request.form['phone']
@@ -441,60 +864,168 @@ def register():
         days = int(request.form['days'])
         start_date_shamsi = request.form.get('start_date')# or datetime.now().strftime('%Y-%m-%d')
         start_date = convert_persian_to_gregorian(start_date_shamsi)
+        card_code = request.form.get('card_code', '').strip() or None
         gender = session['gender']
         
         registration_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
         conn = get_db_connection()
-        conn.execute('''INSERT INTO athletes 
-                      (id, first_name, last_name, phone, emergency_phone, father_name, 
-                       birth_date, registration_date, start_date, original_days, gender)
-                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (athlete_id, first_name, last_name, phone, emergency_phone, father_name,
-                     birth_date, registration_date, start_date, days, gender))
-        conn.commit()
-        conn.close()
+        if card_code is not None and card_code in taken_card_codes(conn, [card_code]):
+            flash('This membership card is already assigned to another athlete!', 'danger')
+            return redirect(url_for('register'))
+        while True:
+            athlete_id = allocate_athlete_ids(conn)[0]
+            try:
+                conn.execute('''INSERT INTO athletes 
+                              (id, first_name, last_name, phone, emergency_phone, father_name, 
+                               birth_date, registration_date, start_date, original_days, gender, card_code)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                            (athlete_id, first_name, last_name, phone, emergency_phone, father_name,
+                             birth_date, registration_date, start_date, days, gender, card_code))
+                break
+            except sqlite3.IntegrityError as e:
+                if unique_violation(e, 'athletes.id'):
+                    # Taken outside the pool; keep its slot consumed and draw again
+                    continue
+                conn.rollback()  # returns the allocated ID to the pool
+                if unique_violation(e, 'athletes.card_code'):
+                    flash('This membership card is already assigned to another athlete!', 'danger')
+                else:
+                    flash('Could not register the athlete: the data conflicts with an existing record', 'danger')
+                    app.logger.error(f"Integrity error in register: {str(e)}")
+                return redirect(url_for('register'))
         
         log_activity(
             action="REGISTRATION",
             details=f"Registered new athlete: {first_name} {last_name} (ID: {athlete_id}) for {days} days",
             athlete_id=athlete_id
         )
+        queue_welcome_msg(conn, phone, str(first_name))
+        conn.commit()
+        if app.config['SMS_DISPATCH']:
+            sms_dispatcher.wake()
         
         flash('Athlete registered successfully!', 'success')
-        welcome_msg(phone, str(first_name))
 
         return redirect(url_for('athletes'))
     today = jdatetime.date.today()
 
     return render_template('register.html', default_start=today.strftime("%Y/%m/%d"))
 
+def import_athletes(conn, athletes, gender):
+    """
+    Insert parsed athletes in the caller's transaction.
+    
+    IDs are allocated for the whole batch at once; athletes, their
+    REGISTRATION log entries and queued welcome messages are each written
+    with a single executemany.
+    
+    Args:
+        athletes (list): Dicts from athlete_import.parse_athletes_csv
+        gender (str): Gender of the importing admin
+    
+    Returns:
+        list: The new athlete IDs, in file order
+    """
+    ids = allocate_athlete_ids(conn, len(athletes))
+    registration_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    conn.executemany('''INSERT INTO athletes 
+                        (id, first_name, last_name, phone, emergency_phone, father_name, 
+                         birth_date, registration_date, start_date, original_days, gender, card_code)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     [(athlete_id, a['first_name'], a['last_name'], a['phone'], a['emergency_phone'],
+                       a['father_name'], a['birth_date'], registration_date, a['start_date'],
+                       a['original_days'], gender, a['card_code'])
+                      for athlete_id, a in zip(ids, athletes)])
+    conn.executemany(INSERT_ACTIVITY,
+                     [(registration_date, "REGISTRATION",
+                       f"Imported new athlete: {a['first_name']} {a['last_name']} (ID: {athlete_id}) "
+                       f"for {a['original_days']} days", athlete_id)
+                      for athlete_id, a in zip(ids, athletes)])
+    queue_welcome_msgs(conn, [(a['phone'], a['first_name']) for a in athletes])
+    return ids
+
+def taken_card_codes(conn, card_codes=None):
+    """Card codes already assigned to athletes, optionally only among card_codes."""
+    if card_codes is None:
+        return {row[0] for row in conn.execute('SELECT card_code FROM athletes WHERE card_code IS NOT NULL')}
+    return {row[0] for row in conn.execute('''SELECT card_code FROM athletes
+                                               WHERE card_code IN (SELECT value FROM json_each(?))''',
+                                           (json.dumps(list(card_codes)),))}
+
+def unique_violation(error, column):
+    """Whether an IntegrityError is a UNIQUE failure on column ('table.column')."""
+    return f'UNIQUE constraint failed: {column}' in str(error)
+
+@app.route('/athletes/import', methods=['GET', 'POST'])
+@login_required
+def import_athletes_page():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Please choose a CSV file to import', 'warning')
+            return redirect(url_for('import_athletes_page'))
+        
+        conn = get_db_connection()
+        try:
+            parsed, errors = parse_athletes_csv(io.TextIOWrapper(upload.stream, encoding='utf-8-sig'),
+                                                taken_card_codes=taken_card_codes(conn))
+        except UnicodeDecodeError:
+            flash('The file is not UTF-8 encoded CSV', 'danger')
+            return redirect(url_for('import_athletes_page'))
+        
+        if errors:
+            return render_template('import_athletes.html', errors=errors)
+        if not parsed:
+            flash('The file has no athletes to import', 'warning')
+            return redirect(url_for('import_athletes_page'))
+        
+        ids = import_athletes(conn, parsed, session['gender'])
+        conn.commit()
+        if app.config['SMS_DISPATCH']:
+            sms_dispatcher.wake()
+        
+        flash(f'Imported {len(ids)} athletes successfully!', 'success')
+        return redirect(url_for('athletes'))
+    
+    return render_template('import_athletes.html', errors=None)
+
+@app.cli.command('import-athletes')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--gender', type=click.Choice(['male', 'female']), required=True,
+              help="Gender section the athletes belong to")
+def import_athletes_command(path, gender):
+    """Import athletes from a CSV file with Jalali dates."""
+    conn = get_db_connection()
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        parsed, errors = parse_athletes_csv(file, taken_card_codes=taken_card_codes(conn))
+    if errors:
+        for line, message in errors:
+            click.echo(f"line {line}: {message}", err=True)
+        raise SystemExit(1)
+    
+    ids = import_athletes(conn, parsed, gender)
+    conn.commit()
+    click.echo(f"Imported {len(ids)} athletes; welcome messages are queued in sms_outbox "
+               f"and sent by the web app or the scheduler's sms-outbox job")
+
 @app.route('/athletes')
 @login_required
 def athletes():
     search_query = request.args.get('search', '').strip()
+    sort = request.args.get('sort', 'start_date')
+    if sort not in ATHLETE_SORTS:
+        sort = 'start_date'
     
-    conn = get_db_connection()
     gender = session['gender']
-    if search_query:
-        query = '''SELECT * FROM athletes 
-                 WHERE gender = ? AND id = ? OR 
-                       first_name LIKE ? OR 
-                       last_name LIKE ? OR
-                       first_name || ' ' || last_name LIKE ?
-                 ORDER BY start_date DESC'''
-        search_param = f"%{search_query}%"
-        athletes_data = conn.execute(query, (gender, search_query, search_param, search_param, search_param)).fetchall()
-    else:
-        athletes_data = conn.execute('SELECT * FROM athletes WHERE gender = ? ORDER BY start_date DESC', (gender, )).fetchall()
+    athletes_data, prev_cursor, next_cursor = get_athletes_page(
+        gender, sort, search_query,
+        after=request.args.get('after'),
+        before=request.args.get('before'))
     
     athletes = []
     for athlete in athletes_data:
-        start_date = datetime.strptime(athlete['start_date'], '%Y-%m-%d')
-        end_date = start_date + timedelta(days=athlete['original_days'])
-        remaining_days = (end_date - datetime.now()).days
-        remaining_days = max(0, remaining_days)
-        
         athletes.append({
             'id': athlete['id'],
             'first_name': athlete['first_name'],
@@ -502,34 +1033,28 @@ def athletes():
             'phone': athlete['phone'],
             'registration_date': athlete['registration_date'],
             'start_date': athlete['start_date'],
-            'registration_date_shamsi' : convert_gregorian_to_persian(athlete['registration_date'].split(' ')[0]),
-            'end_date': end_date.strftime('%Y-%m-%d'), 
-            'end_date_shamsi': convert_gregorian_to_persian((datetime.strptime(athlete['start_date'], '%Y-%m-%d') + timedelta(days=athlete['original_days'])).strftime('%Y-%m-%d')),
-            'days_remaining': remaining_days,
+            'end_date': athlete['end_date'], 
+            'days_remaining': days_remaining(athlete['end_date']),
             'original_days': athlete['original_days']
         })
     
-    conn.close()
     return render_template('athletes.html', 
                          athletes=athletes, 
                          search_query=search_query,
-                         datetime=datetime,  
-                         timedelta=timedelta) 
+                         sort=sort,
+                         prev_cursor=prev_cursor,
+                         next_cursor=next_cursor) 
 
 @app.route('/athlete/<int:athlete_id>')
 @login_required
 def view_athlete(athlete_id):
     conn = get_db_connection()
     athlete = conn.execute('SELECT * FROM athletes WHERE id = ?', (athlete_id,)).fetchone()
-    conn.close()
     
     if not athlete:
         flash('Athlete not found!', 'danger')
         return redirect(url_for('athletes'))
     
-    start_date = datetime.strptime(athlete['start_date'], '%Y-%m-%d')
-    end_date = start_date + timedelta(days=athlete['original_days'])
-    
     athlete_data = {
         'id': athlete['id'],
         'first_name': athlete['first_name'],
@@ -543,9 +1068,9 @@ def view_athlete(athlete_id):
         'registration_date_shamsi': convert_gregorian_to_persian(athlete['registration_date'].split(' ')[0]),
         'start_date': athlete['start_date'],
         'start_date_shamsi': convert_gregorian_to_persian(athlete['start_date']),
-        'end_date': end_date.strftime('%Y-%m-%d'),  
-        'end_date_shamsi': convert_gregorian_to_persian(end_date.strftime('%Y-%m-%d')),
-        'days_remaining': max(0, (end_date - datetime.now()).days),
+        'end_date': athlete['end_date'],  
+        'end_date_shamsi': convert_gregorian_to_persian(athlete['end_date']),
+        'days_remaining': days_remaining(athlete['end_date']),
         'original_days': athlete['original_days']
     }
     
@@ -563,21 +1088,30 @@ def edit_athlete(athlete_id):
         emergency_phone = request.form.get('emergency_phone')
         father_name = request.form.get('father_name')
         birth_date = convert_persian_to_gregorian(request.form.get('birth_date'))
+        card_code = request.form.get('card_code', '').strip() or None
         
-        conn.execute('''UPDATE athletes SET
-                      first_name = ?, last_name = ?, phone = ?,
-                      emergency_phone = ?, father_name = ?, birth_date = ?
-                      WHERE id = ?''',
-                    (first_name, last_name, phone, emergency_phone, 
-                     father_name, birth_date, athlete_id))
-        conn.commit()
-        conn.close()
+        try:
+            conn.execute('''UPDATE athletes SET
+                          first_name = ?, last_name = ?, phone = ?,
+                          emergency_phone = ?, father_name = ?, birth_date = ?, card_code = ?
+                          WHERE id = ?''',
+                        (first_name, last_name, phone, emergency_phone, 
+                         father_name, birth_date, card_code, athlete_id))
+        except sqlite3.IntegrityError as e:
+            conn.rollback()
+            if unique_violation(e, 'athletes.card_code'):
+                flash('This membership card is already assigned to another athlete!', 'danger')
+            else:
+                flash('Could not update the athlete: the data conflicts with an existing record', 'danger')
+                app.logger.error(f"Integrity error in edit_athlete: {str(e)}")
+            return redirect(url_for('edit_athlete', athlete_id=athlete_id))
         
         log_activity(
             action="UPDATE",
             details=f"Updated athlete details: {first_name} {last_name} (ID: {athlete_id})",
             athlete_id=athlete_id
         )
+        conn.commit()
         
         flash('Athlete updated successfully!', 'success')
         return redirect(url_for('view_athlete', athlete_id=athlete_id))
@@ -586,7 +1120,6 @@ def edit_athlete(athlete_id):
     athlete = dict(athlete)
     athlete['birth_date_shamsi'] = convert_gregorian_to_persian(athlete['birth_date'])
     athlete['registration_date_shamsi'] = convert_gregorian_to_persian(athlete['registration_date'][0:10])
-    conn.close()
     
     if not athlete:
         flash('Athlete not found!', 'danger')
@@ -610,10 +1143,7 @@ def renew_athlete(athlete_id):
             return redirect(url_for('athletes'))
         
         # FIXED: Calculate remaining days based on current date, not original start date
-        start_date = datetime.strptime(athlete['start_date'], '%Y-%m-%d')
-        end_date = start_date + timedelta(days=athlete['original_days'])
-        remaining_days = (end_date - datetime.now()).days
-        remaining_days = max(0, remaining_days)
+        remaining_days = days_remaining(athlete['end_date'])
         
         # If membership has expired (negative days), reset start date to today
         if remaining_days <= 0:
@@ -625,13 +1155,11 @@ def renew_athlete(athlete_id):
             new_start_date = athlete['start_date']
             new_days_remaining = athlete['original_days'] + additional_days
         
-        # Update database with new values
+        # Update database with new values (end_date follows automatically)
         conn.execute('''UPDATE athletes SET 
                       original_days = ?, start_date = ?
                       WHERE id = ?''',
                     (new_days_remaining, new_start_date, athlete_id))
-        conn.commit()
-        conn.close()
         
         # Log activity
         log_activity(
@@ -639,30 +1167,27 @@ def renew_athlete(athlete_id):
             details=f"Renewed membership for {athlete['first_name']} {athlete['last_name']} (ID: {athlete_id}) for {additional_days} days. New total: {new_days_remaining} days",
             athlete_id=athlete_id
         )
+        conn.commit()
         
         flash(f'Membership renewed successfully for {additional_days} days! Total days now: {new_days_remaining}', 'success')
         return redirect(url_for('view_athlete', athlete_id=athlete_id))
     
     # GET request - show form
     athlete = conn.execute('SELECT * FROM athletes WHERE id = ?', (athlete_id,)).fetchone()
-    conn.close()
     
     if not athlete:
         flash('Athlete not found!', 'danger')
         return redirect(url_for('athletes'))
     
-    # Calculate end date based on current status
-    start_date = datetime.strptime(athlete['start_date'], '%Y-%m-%d')
-    end_date = (start_date + timedelta(days=athlete['original_days']))
-    remaining_days = max(0, (end_date - datetime.now()).days)
+    remaining_days = days_remaining(athlete['end_date'])
 
     athlete_data = {
         'id': athlete['id'],
         'first_name': athlete['first_name'],
         'last_name': athlete['last_name'],
         'days_remaining': remaining_days,
-        'end_date': end_date,
-        'end_date_shamsi' : convert_gregorian_to_persian(str(end_date).split(' ')[0])+" "+str(end_date).split(' ')[1],
+        'end_date': athlete['end_date'],
+        'end_date_shamsi' : convert_gregorian_to_persian(athlete['end_date'])+" 00:00:00",
         'original_days': athlete['original_days'],
         'is_expired': remaining_days <= 0  # Add flag for expired status
     }
@@ -680,53 +1205,421 @@ def delete_athlete(athlete_id):
     
     if athlete:
         conn.execute('DELETE FROM athletes WHERE id = ?', (athlete_id,))
-        conn.commit()
         
         log_activity(
             action="DELETION",
             details=f"Deleted athlete: {athlete['first_name']} {athlete['last_name']} (ID: {athlete_id})",
             athlete_id=athlete_id
         )
+        conn.commit()
         
         flash('Athlete deleted successfully!', 'success')
     else:
         flash('Athlete not found!', 'danger')
     
-    conn.close()
     return redirect(url_for('athletes'))
 
-@app.route('/history')
-@login_required
-def history():
-    search_query = request.args.get('search', '')
-    action_type = request.args.get('action_type', '')
+# Activity log entries per history page
+HISTORY_PAGE_SIZE = 50
+
+# Actions offered by the history page's filter
+HISTORY_ACTIONS = ('REGISTRATION', 'UPDATE', 'RENEWAL', 'DELETION', 'CHECK_IN', 'CHECK_OUT', 'LOGIN')
+
+def history_filters(search_query, action_type, date_from=None, date_to=None, schema='main'):
+    """
+    WHERE clause and parameters shared by the history page and its export.
     
-    conn = get_db_connection()
+    Expects activity_log joined with athletes. The search matches words in
+    the details (activity_log_fts), the athlete's name or phone
+    (athletes_fts) or the athlete ID.
     
-    query = '''SELECT activity_log.*, athletes.first_name, athletes.last_name
-             FROM activity_log
-             LEFT JOIN athletes ON activity_log.athlete_id = athletes.id
-             WHERE 1=1'''
+    Args:
+        date_from (str): Gregorian 'YYYY-MM-DD', inclusive
+        date_to (str): Gregorian 'YYYY-MM-DD', inclusive
+        schema (str): Database whose activity_log is filtered, e.g. an
+            attached archive year
     
+    Returns:
+        tuple: (SQL condition, params list)
+    """
+    where = ['1=1']
     params = []
     
     if search_query:
-        query += ' AND (details LIKE ? OR athletes.first_name LIKE ? OR athletes.last_name LIKE ?)'
-        search_param = f"%{search_query}%"
-        params.extend([search_param, search_param, search_param])
+        match = fts_match_query(search_query) or '""'
+        where.append(f'''(activity_log.id IN (SELECT rowid FROM {schema}.activity_log_fts WHERE activity_log_fts MATCH ?)
+                        OR activity_log.athlete_id IN (SELECT rowid FROM athletes_fts WHERE athletes_fts MATCH ?)
+                        OR activity_log.athlete_id = ?)''')
+        params.extend([match, match, search_query])
     
     if action_type:
-        query += ' AND action = ?'
+        where.append('action = ?')
         params.append(action_type)
     
-    query += ' ORDER BY timestamp DESC'
+    if date_from:
+        where.append('timestamp >= ?')
+        params.append(date_from)
+    if date_to:
+        where.append("timestamp < date(?, '+1 day')")
+        params.append(date_to)
+    
+    return ' AND '.join(where), params
+
+def jalali_date_range(args):
+    """
+    Gregorian (date_from, date_to) from the Jalali ?from= and ?to= arguments.
     
-    activities = conn.execute(query, params).fetchall()
-    conn.close()
+    Each is None when absent; a malformed date aborts the request with 400.
+    
+    Returns:
+        tuple: Two 'YYYY-MM-DD' strings or None
+    """
+    dates = []
+    for name in ('from', 'to'):
+        value = args.get(name, '').strip()
+        if not value:
+            dates.append(None)
+            continue
+        try:
+            dates.append(jdatetime.datetime.strptime(value, '%Y/%m/%d').togregorian().date().isoformat())
+        except ValueError:
+            abort(400, description=f'Invalid date: {value}')
+    return tuple(dates)
+
+def history_archive_years(conn, date_from, date_to):
+    """Archived years a history query from date_from to date_to has to read."""
+    cutoff = archived_before(conn)
+    if not cutoff or not date_from or date_from >= cutoff:
+        return []
+    return archive_years(conn, date_from, date_to)
+
+def history_query(columns, schemas, filters, extra_where='', extra_params=()):
+    """
+    activity_log query over the main database and attached archives.
+    
+    Args:
+        columns (str): Select list over activity_log and athletes
+        schemas (list): Attached archive schemas to include besides main
+        filters (tuple): history_filters() arguments before schema
+        extra_where (str): Condition appended to every branch
+        extra_params (tuple): Its parameters
+    
+    Returns:
+        tuple: (SQL of a UNION ALL without ORDER BY, params list)
+    """
+    branches = []
+    params = []
+    for schema in ['main'] + list(schemas):
+        where, branch_params = history_filters(*filters, schema=schema)
+        branches.append(f'''SELECT {columns}
+                           FROM {schema}.activity_log AS activity_log
+                           LEFT JOIN main.athletes AS athletes ON activity_log.athlete_id = athletes.id
+                           WHERE {where}{extra_where}''')
+        params.extend(branch_params)
+        params.extend(extra_params)
+    return '\nUNION ALL\n'.join(branches), params
+
+def get_history_page(search_query=None, action_type=None, date_from=None, date_to=None,
+                     after=None, before=None, page_size=None):
+    """
+    One page of the activity log, newest first, using keyset pagination.
+    
+    Pages seek past the cursor's (timestamp, id) in an activity_log index
+    rather than OFFSET, so the latest page and the thousandth cost the same
+    however many years of log exist. A date_from before the archive
+    horizon also reads the archived years it covers.
+    
+    Args:
+        search_query (str): Optional full-text search
+        action_type (str): Optional action filter
+        date_from (str): Gregorian 'YYYY-MM-DD', inclusive
+        date_to (str): Gregorian 'YYYY-MM-DD', inclusive
+        after (str): Cursor of the last row of the previous page
+        before (str): Cursor of the first row of the next page
+        page_size (int): Rows per page, defaults to HISTORY_PAGE_SIZE
+    
+    Returns:
+        tuple: (rows, prev_cursor, next_cursor); cursors are None at the ends
+    """
+    page_size = page_size or HISTORY_PAGE_SIZE
+    conn = get_db_connection()
+    
+    backwards = False
+    cursor = None
+    if before:
+        cursor = decode_cursor(before, 2)
+        backwards = cursor is not None
+    elif after:
+        cursor = decode_cursor(after, 2)
+    
+    # Newest first; walking backwards flips the comparison and scan order
+    seek = ''
+    if cursor is not None:
+        seek = f" AND (timestamp, activity_log.id) {'>' if backwards else '<'} (?, ?)"
+    order = 'ASC' if backwards else 'DESC'
+    
+    years = history_archive_years(conn, date_from, date_to)
+    with attached_archives(conn, app.config['ARCHIVE_DIR'], years) as schemas:
+        query, params = history_query(
+            "activity_log.*, COALESCE(athletes.first_name || ' ' || athletes.last_name, 'N/A') AS athlete_name",
+            schemas, (search_query, action_type, date_from, date_to), seek, cursor or ())
+        rows = execute_with_retry(conn, f'''
+            {query}
+            ORDER BY timestamp {order}, id {order}
+            LIMIT ?
+        ''', params + [page_size + 1]).fetchall()
+    
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+    
+    prev_cursor = encode_cursor((rows[0]['timestamp'], rows[0]['id'])) if rows and has_prev else None
+    next_cursor = encode_cursor((rows[-1]['timestamp'], rows[-1]['id'])) if rows and has_next else None
+    return rows, prev_cursor, next_cursor
+
+@app.route('/history')
+@login_required
+def history():
+    search_query = request.args.get('search', '').strip()
+    action_type = request.args.get('action_type', '')
+    date_from, date_to = jalali_date_range(request.args)
+    
+    activities, prev_cursor, next_cursor = get_history_page(
+        search_query, action_type, date_from, date_to,
+        after=request.args.get('after'),
+        before=request.args.get('before'))
     
     return render_template('history.html', activities=activities, 
-                         search_query=search_query, action_type=action_type)
+                         search_query=search_query, action_type=action_type,
+                         actions=HISTORY_ACTIONS,
+                         archived_before=archived_before(get_db_connection()),
+                         date_from=request.args.get('from', ''),
+                         date_to=request.args.get('to', ''),
+                         prev_cursor=prev_cursor, next_cursor=next_cursor)
+
+def shamsi_timestamp(timestamp):
+    """'YYYY-MM-DD HH:MM:SS' -> 'YYYY/MM/DD HH:MM:SS' in the Persian calendar."""
+    if not timestamp:
+        return ''
+    return f"{shamsi_filter(timestamp)} {timestamp[11:19]}".rstrip()
+
+def stream_rows(query, params, convert, archive_years=()):
+    """
+    Yield convert(row) for each row of query, one row at a time.
+    
+    Uses its own connection because the response body is produced after
+    the request's teardown; the single SELECT reads one consistent snapshot
+    while check-ins keep being written. archive_years are attached first,
+    under archive_schema(year).
+    """
+    conn = open_db_connection()
+    try:
+        with attached_archives(conn, app.config['ARCHIVE_DIR'], archive_years):
+            for row in conn.execute(query, params):
+                yield convert(row)
+    finally:
+        conn.close()
 
+def export_response(name, fmt, header, rows):
+    """Stream rows as a CSV or XLSX download named after the table and today's date."""
+    if fmt == 'xlsx':
+        body, mimetype = xlsx_stream(header, rows, sheet_name=name.title()), XLSX_MIMETYPE
+    else:
+        body, mimetype = csv_stream(header, rows), 'text/csv; charset=utf-8'
+    filename = f"{name}-{datetime.now().strftime('%Y%m%d')}.{fmt}"
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/export/athletes.<any(csv, xlsx):fmt>')
+@login_required
+def export_athletes(fmt):
+    """Every athlete of the admin's gender, filtered and sorted like the athletes page."""
+    search_query = request.args.get('search', '').strip()
+    sort = request.args.get('sort', 'start_date')
+    columns, direction = ATHLETE_SORTS.get(sort, ATHLETE_SORTS['start_date'])
+    where, params = athlete_filters(session['gender'], search_query)
+    
+    query = f'''SELECT * FROM athletes
+                WHERE {' AND '.join(where)}
+                ORDER BY {', '.join(f"{column} {direction}" for column in columns)}'''
+    header = ['ID', 'First Name', 'Last Name', "Father's Name", 'Phone', 'Emergency Phone',
+              'Birth Date', 'Registration Date', 'Start Date', 'End Date', 'Days',
+              'Days Remaining', 'Card Code']
+    
+    def convert(athlete):
+        return [athlete['id'], athlete['first_name'], athlete['last_name'], athlete['father_name'],
+                athlete['phone'], athlete['emergency_phone'], shamsi_filter(athlete['birth_date']),
+                shamsi_timestamp(athlete['registration_date']), shamsi_filter(athlete['start_date']),
+                shamsi_filter(athlete['end_date']), athlete['original_days'],
+                days_remaining(athlete['end_date']), athlete['card_code']]
+    
+    return export_response('athletes', fmt, header, stream_rows(query, params, convert))
+
+@app.route('/export/attendance.<any(csv, xlsx):fmt>')
+@login_required
+def export_attendance(fmt):
+    """
+    Attendance of the admin's gender between ?from= and ?to= (Jalali
+    'YYYY/MM/DD', both optional and inclusive), oldest first, including
+    archived years in that range.
+    """
+    date_from, date_to = jalali_date_range(request.args)
+    where = ['a.gender = ?']
+    params = [session['gender']]
+    if date_from:
+        where.append('att.date >= ?')
+        params.append(date_from)
+    if date_to:
+        where.append('att.date <= ?')
+        params.append(date_to)
+    
+    conn = get_db_connection()
+    cutoff = archived_before(conn)
+    years = archive_years(conn, date_from, date_to) if cutoff and (date_from or '') < cutoff else []
+    branches = [f'''SELECT att.athlete_id, a.first_name, a.last_name, att.date,
+                             att.check_in_time, att.check_out_time,
+                             CAST(ROUND((julianday(att.check_out_time) - julianday(att.check_in_time)) * 86400)
+                                  AS INTEGER) AS duration_seconds
+                      FROM {schema}.attendance att
+                      JOIN main.athletes a ON a.id = att.athlete_id
+                      WHERE {' AND '.join(where)}'''
+                for schema in ['main'] + [archive_schema(year) for year in years]]
+    query = '\nUNION ALL\n'.join(branches) + '\nORDER BY date, check_in_time, athlete_id'
+    params = params * len(branches)
+    header = ['Athlete ID', 'First Name', 'Last Name', 'Date', 'Check-In', 'Check-Out', 'Duration']
+    
+    def convert(record):
+        duration = record['duration_seconds']
+        return [record['athlete_id'], record['first_name'], record['last_name'],
+                shamsi_filter(record['date']), shamsi_timestamp(record['check_in_time']),
+                shamsi_timestamp(record['check_out_time']),
+                format_duration(duration) if duration is not None else '']
+    
+    return export_response('attendance', fmt, header, stream_rows(query, params, convert, years))
+
+@app.route('/export/history.<any(csv, xlsx):fmt>')
+@login_required
+def export_history(fmt):
+    """The activity log with the history page's search and action_type filters."""
+    date_from, date_to = jalali_date_range(request.args)
+    years = history_archive_years(get_db_connection(), date_from, date_to)
+    query, params = history_query(
+        '''activity_log.id AS id, activity_log.timestamp AS timestamp, activity_log.action AS action,
+           activity_log.details AS details, activity_log.athlete_id AS athlete_id,
+           athletes.first_name AS first_name, athletes.last_name AS last_name''',
+        [archive_schema(year) for year in years],
+        (request.args.get('search', '').strip(), request.args.get('action_type', ''), date_from, date_to))
+    query += '\nORDER BY timestamp DESC, id DESC'
+    header = ['Time', 'Action', 'Details', 'Athlete ID', 'Athlete']
+    
+    def convert(activity):
+        name = f"{activity['first_name']} {activity['last_name']}" if activity['first_name'] else ''
+        return [shamsi_timestamp(activity['timestamp']), activity['action'], activity['details'],
+                activity['athlete_id'], name]
+    
+    return export_response('history', fmt, header, stream_rows(query, params, convert, years))
+
+class AttendanceError(Exception):
+    """A check-in/check-out the attendance rules refuse; message is user-facing."""
+    
+    def __init__(self, message, category='warning', status=409):
+        super().__init__(message)
+        self.message = message
+        self.category = category
+        self.status = status
+
+def record_attendance(conn, gender, action, athlete_id=None, card_code=None):
+    """
+    Check an athlete in or out today, in the caller's transaction.
+    
+    One indexed lookup (by ID or membership card code) returns the athlete,
+    whether the membership is active and today's open session, then one
+    write records the change. The caller commits and afterwards passes the
+    result to publish_attendance().
+    
+    Args:
+        gender (str): Gender of the logged-in admin; other athletes are not found
+        action (str): 'check_in' or 'check_out'
+        athlete_id (int): Athlete to look up, or
+        card_code (str): Membership card code to look up instead
+    
+    Returns:
+        dict: action, athlete_id, name, check_in and, for check-outs,
+            check_out and duration
+    
+    Raises:
+        AttendanceError: Unknown action, athlete not found or inactive,
+            already checked in, or no open session to check out
+    """
+    if action not in ('check_in', 'check_out'):
+        raise AttendanceError('Invalid request', 'danger', 400)
+    
+    today = datetime.now().strftime('%Y-%m-%d')
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    lookup_column = 'card_code' if card_code is not None else 'id'
+    athlete = execute_with_retry(conn, f'''
+        SELECT a.id, a.first_name, a.last_name,
+               a.end_date >= :active_from AS active,
+               open.id AS open_id,
+               open.check_in_time AS open_check_in,
+               EXISTS (SELECT 1 FROM attendance
+                       WHERE athlete_id = a.id AND date = :today) AS visited_today
+        FROM athletes a
+        LEFT JOIN (SELECT id, athlete_id, check_in_time FROM attendance
+                   WHERE date = :today AND check_out_time IS NULL) open
+               ON open.athlete_id = a.id
+        WHERE a.{lookup_column} = :key AND a.gender = :gender
+        ORDER BY open.check_in_time DESC
+        LIMIT 1
+    ''', {
+        'active_from': active_end_date_floor(),
+        'today': today,
+        'key': card_code if card_code is not None else athlete_id,
+        'gender': gender,
+    }).fetchone()
+    
+    if not athlete or not athlete['active']:
+        raise AttendanceError('Athlete not found or inactive!', 'danger', 404)
+    
+    result = {
+        'action': action,
+        'athlete_id': athlete['id'],
+        'name': f"{athlete['first_name']} {athlete['last_name']}",
+    }
+    
+    if action == 'check_in':
+        if athlete['open_id']:
+            raise AttendanceError('Athlete is already checked in today!')
+        execute_with_retry(conn, '''
+            INSERT INTO attendance (athlete_id, check_in_time, date)
+            VALUES (?, ?, ?)
+        ''', (athlete['id'], current_time, today))
+        log_activity("CHECK_IN", f"Athlete {athlete['id']} checked in", athlete['id'])
+        result.update(check_in=current_time, first_visit=not athlete['visited_today'])
+    else:
+        if not athlete['open_id']:
+            raise AttendanceError('No active check-in found for this athlete today!')
+        execute_with_retry(conn, '''
+            UPDATE attendance 
+            SET check_out_time = ? 
+            WHERE id = ?
+        ''', (current_time, athlete['open_id']))
+        record_checkout(conn, gender, athlete['id'], today, athlete['open_check_in'], current_time)
+        log_activity("CHECK_OUT", f"Athlete {athlete['id']} checked out", athlete['id'])
+        duration = datetime.strptime(current_time, '%Y-%m-%d %H:%M:%S') \
+            - datetime.strptime(athlete['open_check_in'], '%Y-%m-%d %H:%M:%S')
+        result.update(check_in=athlete['open_check_in'], check_out=current_time,
+                      duration=format_duration(int(duration.total_seconds())))
+    return result
+
+def publish_attendance(gender, result):
+    """Push a committed record_attendance() result to the live attendance board."""
+    event = {key: value for key, value in result.items() if key != 'action'}
+    attendance_events.publish(gender, result['action'], event)
 
 @app.route('/attendance', methods=['GET', 'POST'])
 @login_required
@@ -745,66 +1638,18 @@ def attendance():
         conn = None
         try:
             conn = get_db_connection()
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            # Checking the existence of the athlete and whether she is active
-            athlete = execute_with_retry(conn, '''
-                            SELECT id, start_date, original_days FROM athletes 
-                            WHERE id = ? AND gender = ?
-                            LIMIT 1
-                        ''', (athlete_id, gender)).fetchone()
-
-            if athlete:
-                start_date = datetime.strptime(athlete['start_date'], '%Y-%m-%d')
-                end_date = start_date + timedelta(days=athlete['original_days'])
-                remaining_days = (end_date - datetime.now()).days 
-                remaining_days = remaining_days if remaining_days >= 0 else 0
-                
-                if remaining_days <= 0:
-                    athlete = None  
-            
-            if not athlete:
-                flash('Athlete not found or inactive!', 'danger')
-                return redirect(url_for('attendance'))
-
+            result = record_attendance(conn, gender, action, athlete_id=athlete_id)
+            conn.commit()
+            publish_attendance(gender, result)
             if action == 'check_in':
-                # Check if the athlete has already checked in today
-                existing = execute_with_retry(conn, '''
-                    SELECT 1 FROM attendance 
-                    WHERE athlete_id = ? AND date = ? AND check_out_time IS NULL
-                    LIMIT 1
-                ''', (athlete_id, today)).fetchone()
-                
-                if existing:
-                    flash('Athlete is already checked in today!', 'warning')
-                else:
-                    execute_with_retry(conn, '''
-                        INSERT INTO attendance (athlete_id, check_in_time, date)
-                        VALUES (?, ?, ?)
-                    ''', (athlete_id, current_time, today))
-                    conn.commit()
-                    flash('Check-in recorded successfully!', 'success')
-                    log_activity("CHECK_IN", f"Athlete {athlete_id} checked in", athlete_id)
-
-            elif action == 'check_out':
-                # Find the last check-in without checking out
-                record = execute_with_retry(conn, '''
-                    SELECT id FROM attendance 
-                    WHERE athlete_id = ? AND date = ? AND check_out_time IS NULL
-                    ORDER BY check_in_time DESC LIMIT 1
-                ''', (athlete_id, today)).fetchone()
-                
-                if not record:
-                    flash('No active check-in found for this athlete today!', 'warning')
-                else:
-                    execute_with_retry(conn, '''
-                        UPDATE attendance 
-                        SET check_out_time = ? 
-                        WHERE id = ?
-                    ''', (current_time, record['id']))
-                    conn.commit()
-                    flash('Check-out recorded successfully!', 'success')
-                    log_activity("CHECK_OUT", f"Athlete {athlete_id} checked out", athlete_id)
-
+                flash('Check-in recorded successfully!', 'success')
+            else:
+                flash('Check-out recorded successfully!', 'success')
+        
+        except AttendanceError as e:
+            flash(e.message, e.category)
+            conn.rollback()
+        
         except sqlite3.OperationalError as e:
             if "database is locked" in str(e):
                 flash('System is busy. Please try again in a moment.', 'warning')
@@ -820,30 +1665,201 @@ def attendance():
             if conn:
                 conn.rollback()
         
-        finally:
-            if conn:
-                conn.close()
-        
         return redirect(url_for('attendance'))
     
     # GET request handling
     date_filter = request.args.get('date', today)
+    try:
+        day = datetime.strptime(date_filter, '%Y-%m-%d').date()
+    except ValueError:
+        abort(400, description=f'Invalid date: {date_filter}')
+    date_filter = day.isoformat()
     search_query = request.args.get('search', '').strip() or None
     
-    stats = get_today_attendance_stats(gender, date_filter)
-    
-    records = get_attendance_records(gender, date_filter, search_query)
+    conn = get_db_connection()
+    # Past days are closed: their totals come from the summary table, and
+    # raw attendance rows are read only when the per-athlete list is asked for
+    past = date_filter < today
+    day_summary = get_daily_summary(conn, gender, date_filter) if past else None
+    records = None
+    if not past or search_query or request.args.get('records'):
+        cutoff = archived_before(conn)
+        if cutoff and date_filter < cutoff:
+            # An archived day: read its visits from that year's archive file
+            with attached_archives(conn, app.config['ARCHIVE_DIR'], [day.year]) as schemas:
+                stats, records, active_athletes = get_attendance_snapshot(
+                    gender, date_filter, search_query, schemas[0] if schemas else 'main')
+        else:
+            stats, records, active_athletes = get_attendance_snapshot(gender, date_filter, search_query)
+    else:
+        active_athletes = get_active_athletes(gender)
     
-    active_athletes = get_active_athletes(gender)
+    if past:
+        present = day_summary['visitors'] if day_summary else 0
+        stats = {'present': present, 'active': 0, 'absent': max(0, len(active_athletes) - present)}
     
     return render_template('attendance.html',
                          stats=stats,
+                         day_summary=day_summary,
                          attendance_data=records,
                          active_athletes=active_athletes,
                          date_filter=date_filter,
                          search_query=search_query or '',
-                         datetime=datetime,
-                         now=datetime.now())
+                         today=today)
+
+# Largest batch accepted by /api/attendance/batch
+ATTENDANCE_BATCH_LIMIT = 500
+
+def _attendance_item(item, default_action=None):
+    """Split one JSON request item into record_attendance() arguments."""
+    if not isinstance(item, dict):
+        raise AttendanceError('Invalid request', 'danger', 400)
+    action = item.get('action', default_action)
+    athlete_id = item.get('athlete_id')
+    card_code = item.get('card_code')
+    if (athlete_id is None) == (card_code is None):
+        raise AttendanceError('Send either athlete_id or card_code', 'danger', 400)
+    if athlete_id is not None and not str(athlete_id).isdigit():
+        raise AttendanceError('Invalid athlete_id', 'danger', 400)
+    return action, athlete_id, None if card_code is None else str(card_code).strip()
+
+@app.route('/api/attendance', methods=['POST'])
+@api_login_required
+def api_attendance():
+    """
+    Check one athlete in or out for kiosks and barcode scanners.
+    
+    Body: {"action": "check_in" | "check_out", "athlete_id": 1234} or
+    {"action": ..., "card_code": "..."}. Answers the record_attendance()
+    result with ok=true, or ok=false and the error with 400/404/409.
+    """
+    gender = session['gender']
+    conn = get_db_connection()
+    try:
+        action, athlete_id, card_code = _attendance_item(request.get_json(silent=True))
+        result = record_attendance(conn, gender, action, athlete_id, card_code)
+        conn.commit()
+    except AttendanceError as e:
+        conn.rollback()
+        return jsonify(ok=False, error=e.message), e.status
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        app.logger.error(f"Database error in attendance API: {str(e)}")
+        return jsonify(ok=False, error='System is busy. Please try again in a moment.'), 503
+    
+    publish_attendance(gender, result)
+    return jsonify(ok=True, **result)
+
+@app.route('/api/attendance/batch', methods=['POST'])
+@api_login_required
+def api_attendance_batch():
+    """
+    Several check-ins/check-outs in one transaction, e.g. a scanner catching up.
+    
+    Body: {"action": "check_in", "items": [{"athlete_id": 1234},
+    {"card_code": "...", "action": "check_out"}, ...]}; an item's own action
+    overrides the default. Items are applied in order and each gets its own
+    result, so one refused item does not fail the others.
+    """
+    gender = session['gender']
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('items') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify(ok=False, error='Send a non-empty items list'), 400
+    if len(items) > ATTENDANCE_BATCH_LIMIT:
+        return jsonify(ok=False, error=f'At most {ATTENDANCE_BATCH_LIMIT} items per batch'), 400
+    
+    conn = get_db_connection()
+    results = []
+    try:
+        for item in items:
+            try:
+                action, athlete_id, card_code = _attendance_item(item, payload.get('action'))
+                results.append(dict(ok=True, **record_attendance(conn, gender, action, athlete_id, card_code)))
+            except AttendanceError as e:
+                results.append({'ok': False, 'error': e.message, 'status': e.status})
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        app.logger.error(f"Database error in attendance batch API: {str(e)}")
+        return jsonify(ok=False, error='System is busy. Please try again in a moment.'), 503
+    
+    for result in results:
+        if result['ok']:
+            publish_attendance(gender, {key: value for key, value in result.items() if key != 'ok'})
+    return jsonify(ok=all(result['ok'] for result in results), results=results)
+
+@app.route('/attendance/stream')
+@login_required
+def attendance_stream():
+    """
+    Server-Sent Events feed of today's check-ins and check-outs.
+
+    Events are published by the attendance POST handler after commit, so
+    each open page applies the change instead of reloading. Each client
+    holds a worker thread for as long as the page is open; run the app with
+    a threaded server.
+    """
+    return Response(attendance_events.stream(session['gender']),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def refresh_attendance_daily(since=None):
+    """
+    Recompute attendance_daily from raw attendance rows on or after since.
+    
+    Archived days have no raw rows left, so their summaries are kept. Used
+    by the rebuild-attendance-daily command and the scheduler; needs an app
+    context.
+    
+    Returns:
+        int: Number of daily summaries rebuilt
+    """
+    conn = get_db_connection()
+    cutoff = archived_before(conn)
+    if cutoff and (since or '') < cutoff:
+        since = cutoff
+    count = rebuild_attendance_daily(conn, since)
+    conn.commit()
+    return count
+
+def archive_old_data(days=None, full_vacuum=False):
+    """
+    Archive activity_log/attendance rows older than days and reclaim the space.
+    
+    Used by the archive-old-rows command and the scheduler; needs an app
+    context.
+    
+    Args:
+        days (int): Age in days, ARCHIVE_AFTER_DAYS by default
+        full_vacuum (bool): Run a full VACUUM instead of incremental_vacuum
+    
+    Returns:
+        tuple: (rows moved per table, cutoff date 'YYYY-MM-DD')
+    """
+    days = days if days is not None else app.config['ARCHIVE_AFTER_DAYS']
+    before = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    conn = get_db_connection()
+    moved = archive_old_rows(conn, app.config['ARCHIVE_DIR'], before,
+                             normalize_persian_sql('details'))
+    reclaim_space(conn, full=full_vacuum)
+    return moved, before
+
+@app.cli.command('rebuild-attendance-daily')
+@click.option('--since', help="Only rebuild dates on or after YYYY-MM-DD")
+def rebuild_attendance_daily_command(since):
+    """Recompute the attendance_daily summary from raw attendance rows."""
+    count = refresh_attendance_daily(since)
+    click.echo(f"Rebuilt {count} daily attendance summaries")
+
+@app.cli.command('archive-old-rows')
+@click.option('--days', type=int, help="Archive rows older than this many days (default ARCHIVE_AFTER_DAYS)")
+@click.option('--full-vacuum', is_flag=True, help="Run a full VACUUM instead of incremental_vacuum")
+def archive_old_rows_command(days, full_vacuum):
+    """Move old activity_log/attendance rows to per-year archive files."""
+    moved, before = archive_old_data(days, full_vacuum)
+    click.echo(f"Archived {moved['activity_log']} activity log and {moved['attendance']} "
+               f"attendance rows older than {before} to {app.config['ARCHIVE_DIR']}/")
 
 @app.route('/gift1')
 def lottery_page():
@@ -851,13 +1867,13 @@ def lottery_page():
     return render_template('gift1.html')
 
 @app.route('/gift2')
-def lottery_page():
-    """Render the main lottery page"""
+def lottery_page2():
+    """Render the second lottery page"""
     return render_template('gift2.html')
 
 @app.route('/gift3')
-def lottery_page():
-    """Render the main lottery page"""
+def lottery_page3():
+    """Render the third lottery page"""
     return render_template('gift3.html')
 
 if __name__ == '__main__':
@@ -0,0 +1,177 @@
+import os
+from contextlib import contextmanager
+from datetime import date
+from urllib.parse import quote
+
+# Append-only tables moved out of the main database: the column that decides
+# a row's age, the copied columns and the schema of the archive copy
+ARCHIVED_TABLES = {
+    'activity_log': ('timestamp', 'id, timestamp, action, details, athlete_id',
+                     '''(id INTEGER PRIMARY KEY,
+                         timestamp TEXT NOT NULL,
+                         action TEXT NOT NULL,
+                         details TEXT NOT NULL,
+                         athlete_id INTEGER)'''),
+    'attendance': ('date', 'id, athlete_id, check_in_time, check_out_time, date',
+                   '''(id INTEGER PRIMARY KEY,
+                       athlete_id INTEGER NOT NULL,
+                       check_in_time TEXT NOT NULL,
+                       check_out_time TEXT,
+                       date TEXT NOT NULL)'''),
+}
+
+ARCHIVE_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_activity_log_timestamp ON activity_log(timestamp)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_activity_log_action_timestamp ON activity_log(action, timestamp)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_activity_log_athlete_timestamp ON activity_log(athlete_id, timestamp)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_attendance_date_athlete ON attendance(date, athlete_id, check_out_time)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_attendance_athlete_date ON attendance(athlete_id, date)',
+)
+
+def init_archive(conn):
+    """Create the archive bookkeeping tables on an open connection."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS archive_summary
+                 (table_name TEXT NOT NULL,
+                  year INTEGER NOT NULL,
+                  rows INTEGER NOT NULL,
+                  first TEXT,
+                  last TEXT,
+                  PRIMARY KEY (table_name, year))''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS archive_state
+                 (archived_before TEXT NOT NULL)''')
+
+def archive_path(archive_dir, year):
+    return os.path.join(archive_dir, f'archive-{year}.db')
+
+def archive_schema(year):
+    """Name an archive year is attached under, e.g. archive_2024."""
+    return f'archive_{int(year)}'
+
+def archived_before(conn):
+    """'YYYY-MM-DD' before which rows live in archives, or None if nothing was archived."""
+    row = conn.execute('SELECT archived_before FROM archive_state').fetchone()
+    return row[0] if row else None
+
+def archive_years(conn, date_from=None, date_to=None):
+    """
+    Archived years overlapping [date_from, date_to] (Gregorian 'YYYY-MM-DD',
+    both optional). Raises ValueError for a malformed date; routes validate
+    their arguments first.
+    """
+    first = date.fromisoformat(date_from).year if date_from else 0
+    last = date.fromisoformat(date_to).year if date_to else 9999
+    return [row[0] for row in conn.execute('''SELECT DISTINCT year FROM archive_summary
+                                              WHERE year BETWEEN ? AND ? ORDER BY year''',
+                                           (first, last))]
+
+@contextmanager
+def attached_archives(conn, archive_dir, years):
+    """
+    Attach archive years read-only for the duration of a query.
+
+    Yields the schema names (archive_schema(year)) of the years whose file
+    exists. The connection must be opened with uri=True and must not be
+    inside a transaction, as SQLite cannot ATTACH or DETACH within one.
+    """
+    schemas = []
+    try:
+        for year in years:
+            path = archive_path(archive_dir, year)
+            if not os.path.exists(path):
+                continue
+            conn.execute('ATTACH DATABASE ? AS ' + archive_schema(year),
+                         (f'file:{quote(os.path.abspath(path))}?mode=ro',))
+            schemas.append(archive_schema(year))
+        yield schemas
+    finally:
+        for schema in schemas:
+            conn.execute(f'DETACH DATABASE {schema}')
+
+def archive_old_rows(conn, archive_dir, before, details_fts_sql):
+    """
+    Move activity_log and attendance rows older than before to per-year files.
+
+    Rows of each year are copied into archive_dir/archive-YYYY.db (created
+    on first use, same columns and ids, plus an activity_log_fts index),
+    committed there, and only then deleted from the main database. Copies
+    use INSERT OR IGNORE, so a run interrupted between the two steps is
+    finished by the next one. archive_summary is recounted from the files.
+
+    Args:
+        conn: Connection to the main database, opened with uri=True
+        archive_dir (str): Directory for the archive files
+        before (str): Gregorian 'YYYY-MM-DD'; older rows are archived
+        details_fts_sql (str): SQL expression over `details` giving the
+            normalized text the main activity_log_fts index stores
+
+    Returns:
+        dict: Rows moved per table
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    conn.commit()
+
+    years = set()
+    for table, (column, _, _) in ARCHIVED_TABLES.items():
+        years.update(int(row[0]) for row in conn.execute(
+            f'SELECT DISTINCT substr({column}, 1, 4) FROM {table} WHERE {column} < ?', (before,)))
+
+    moved = dict.fromkeys(ARCHIVED_TABLES, 0)
+    for year in sorted(years):
+        schema = archive_schema(year)
+        end = min(before, f'{year + 1}-01-01')
+        conn.execute(f'ATTACH DATABASE ? AS {schema}', (archive_path(archive_dir, year),))
+        try:
+            for table, (_, _, definition) in ARCHIVED_TABLES.items():
+                conn.execute(f'CREATE TABLE IF NOT EXISTS {schema}.{table} {definition}')
+            conn.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.activity_log_fts
+                         USING fts5(details, content='', tokenize='unicode61 remove_diacritics 2')''')
+            for statement in ARCHIVE_INDEXES:
+                conn.execute(statement.format(schema=schema))
+
+            with conn:
+                conn.execute(f'''INSERT INTO {schema}.activity_log_fts(rowid, details)
+                                 SELECT id, {details_fts_sql} FROM main.activity_log
+                                 WHERE timestamp >= ? AND timestamp < ?
+                                   AND id NOT IN (SELECT id FROM {schema}.activity_log)''',
+                             (f'{year}-01-01', end))
+                for table, (column, columns, _) in ARCHIVED_TABLES.items():
+                    conn.execute(f'''INSERT OR IGNORE INTO {schema}.{table} ({columns})
+                                     SELECT {columns} FROM main.{table}
+                                     WHERE {column} >= ? AND {column} < ?''',
+                                 (f'{year}-01-01', end))
+            with conn:
+                for table, (column, _, _) in ARCHIVED_TABLES.items():
+                    moved[table] += conn.execute(f'DELETE FROM main.{table} WHERE {column} >= ? AND {column} < ?',
+                                                 (f'{year}-01-01', end)).rowcount
+                    count, first, last = conn.execute(
+                        f'SELECT COUNT(*), MIN({column}), MAX({column}) FROM {schema}.{table}').fetchone()
+                    conn.execute('''INSERT OR REPLACE INTO archive_summary (table_name, year, rows, first, last)
+                                    VALUES (?, ?, ?, ?, ?)''', (table, year, count, first, last))
+        finally:
+            conn.execute(f'DETACH DATABASE {schema}')
+
+    with conn:
+        current = archived_before(conn)
+        if current is None:
+            conn.execute('INSERT INTO archive_state (archived_before) VALUES (?)', (before,))
+        elif before > current:
+            conn.execute('UPDATE archive_state SET archived_before = ?', (before,))
+    return moved
+
+def reclaim_space(conn, full=False):
+    """
+    Return the pages freed by archiving to the filesystem.
+
+    The first call switches the database to incremental auto-vacuum, which
+    needs one full VACUUM; later calls only run incremental_vacuum unless
+    full is set. Must run outside a transaction.
+    """
+    conn.commit()
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        full = True
+    if full:
+        conn.execute('VACUUM')
+    else:
+        conn.execute('PRAGMA incremental_vacuum').fetchall()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
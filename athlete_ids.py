@@ -0,0 +1,80 @@
+import json
+import random
+
+# First athlete ID; IDs stay four digits until 1000-9999 is used up
+FIRST_ID = 1000
+# Consecutive IDs shuffled into the pool per refill
+BLOCK_SIZE = 10000
+
+def init_athlete_ids(conn):
+    """
+    Create the ID pool tables on an open connection.
+
+    athlete_id_pool holds unissued IDs in random order (slot is the rowid,
+    so the next ID is the first row of the table); athlete_id_sequence
+    remembers where the next block of IDs starts.
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS athlete_id_pool
+                 (slot INTEGER PRIMARY KEY,
+                  id INTEGER NOT NULL UNIQUE)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS athlete_id_sequence
+                 (next_block INTEGER NOT NULL)''')
+    if conn.execute('SELECT 1 FROM athlete_id_sequence').fetchone() is None:
+        conn.execute('INSERT INTO athlete_id_sequence (next_block) VALUES (?)', (FIRST_ID,))
+
+def _block_end(start):
+    """Last ID of the block starting at start; blocks never cross a digit boundary."""
+    return min(start + BLOCK_SIZE, 10 ** len(str(start))) - 1
+
+def _refill(conn, rng):
+    """Shuffle the next block of IDs, minus any already in use, into the pool."""
+    start = conn.execute('SELECT next_block FROM athlete_id_sequence').fetchone()[0]
+    while True:
+        end = _block_end(start)
+        used = {row[0] for row in conn.execute('SELECT id FROM athletes WHERE id BETWEEN ? AND ?',
+                                               (start, end))}
+        block = [athlete_id for athlete_id in range(start, end + 1) if athlete_id not in used]
+        start = end + 1
+        if block:
+            break
+    rng.shuffle(block)
+    conn.executemany('INSERT INTO athlete_id_pool (id) VALUES (?)', [(athlete_id,) for athlete_id in block])
+    conn.execute('UPDATE athlete_id_sequence SET next_block = ?', (start,))
+
+def allocate_athlete_ids(conn, count=1, rng=random):
+    """
+    Take count unissued athlete IDs, in the caller's transaction.
+
+    Each ID is removed from athlete_id_pool by the same transaction that
+    inserts the athlete, so it is issued exactly once: the DELETE takes
+    SQLite's write lock, which serialises concurrent registrations, and a
+    rolled-back registration puts its ID back. Allocation reads the first
+    rows of the pool, so it costs the same however full the ID space is.
+    When the pool runs dry the next block is added, widening IDs to five
+    digits and beyond only after every four-digit ID has been issued.
+    IDs of deleted athletes are not reissued, and a pooled ID that an
+    athlete inserted with an explicit id has taken since the refill is
+    dropped from the pool instead of being issued.
+
+    Args:
+        count (int): Number of IDs wanted
+        rng: random.Random-like object used to shuffle new blocks
+
+    Returns:
+        list: count distinct IDs
+    """
+    ids = []
+    while len(ids) < count:
+        wanted = count - len(ids)
+        taken = [row[0] for row in conn.execute('''
+            DELETE FROM athlete_id_pool
+            WHERE slot IN (SELECT slot FROM athlete_id_pool ORDER BY slot LIMIT ?)
+            RETURNING id
+        ''', (wanted,)).fetchall()]
+        if taken:
+            in_use = {row[0] for row in conn.execute(
+                'SELECT id FROM athletes WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(taken),))}
+            ids += [athlete_id for athlete_id in taken if athlete_id not in in_use]
+        if len(taken) < wanted:
+            _refill(conn, rng)
+    return ids
@@ -0,0 +1,91 @@
+import csv
+import unicodedata
+
+import jdatetime
+
+# Header names accepted in an import file; the first four are required
+REQUIRED_COLUMNS = ('first_name', 'last_name', 'phone', 'days')
+OPTIONAL_COLUMNS = ('emergency_phone', 'father_name', 'birth_date', 'start_date', 'card_code')
+
+# Stop collecting errors after this many, the file needs fixing anyway
+MAX_ERRORS = 50
+
+def _digits(value):
+    """Phone number with Persian/Arabic-Indic digits made ASCII and separators dropped."""
+    value = value.replace(' ', '').replace('-', '')
+    if not value or not all(ch.isdigit() or ch == '+' for ch in value):
+        raise ValueError(f"invalid phone number '{value}'")
+    return ''.join(str(unicodedata.digit(ch)) if ch.isdigit() else ch for ch in value)
+
+def _jalali(value):
+    """'1404/05/28' (or 1404-05-28, Persian digits allowed) -> Gregorian 'YYYY-MM-DD'."""
+    text = ''.join(str(unicodedata.digit(ch)) if ch.isdigit() else ch for ch in value).replace('-', '/')
+    try:
+        return jdatetime.datetime.strptime(text, '%Y/%m/%d').togregorian().strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"invalid Jalali date '{value}', expected YYYY/MM/DD")
+
+def parse_athletes_csv(file, today=None, taken_card_codes=()):
+    """
+    Read and validate an athlete import file.
+
+    The file is UTF-8 CSV with a header row. Required columns are
+    REQUIRED_COLUMNS; dates are Jalali 'YYYY/MM/DD' and start_date defaults
+    to today. Every row is checked before anything is written, so a file is
+    imported completely or not at all.
+
+    Args:
+        file: Text file object (open with encoding='utf-8-sig' to skip a BOM)
+        today (str): Gregorian 'YYYY-MM-DD' used when start_date is empty
+        taken_card_codes (set): Card codes already assigned in the database
+
+    Returns:
+        tuple: (athletes, errors); athletes is a list of dicts with the
+            athletes table's column names, errors a list of
+            (line_number, message)
+    """
+    today = today or jdatetime.date.today().togregorian().strftime('%Y-%m-%d')
+    reader = csv.DictReader(file)
+    columns = [name.strip().lower() for name in reader.fieldnames or []]
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        return [], [(1, f"missing column(s): {', '.join(missing)}")]
+    reader.fieldnames = columns
+
+    athletes = []
+    errors = []
+    card_codes = set(taken_card_codes)
+    for row in reader:
+        line = reader.line_num
+        values = {name: (row.get(name) or '').strip() for name in REQUIRED_COLUMNS + OPTIONAL_COLUMNS}
+        try:
+            for name in REQUIRED_COLUMNS:
+                if not values[name]:
+                    raise ValueError(f"{name} is empty")
+            try:
+                days = int(values['days'])
+            except ValueError:
+                raise ValueError(f"days must be a number, got '{values['days']}'")
+            if days <= 0:
+                raise ValueError(f"days must be positive, got {days}")
+            card_code = values['card_code'] or None
+            if card_code is not None:
+                if card_code in card_codes:
+                    raise ValueError(f"card code '{card_code}' is already in use")
+                card_codes.add(card_code)
+            athletes.append({
+                'first_name': values['first_name'],
+                'last_name': values['last_name'],
+                'phone': _digits(values['phone']),
+                'emergency_phone': _digits(values['emergency_phone']) if values['emergency_phone'] else None,
+                'father_name': values['father_name'] or None,
+                'birth_date': _jalali(values['birth_date']) if values['birth_date'] else None,
+                'start_date': _jalali(values['start_date']) if values['start_date'] else today,
+                'original_days': days,
+                'card_code': card_code,
+            })
+        except ValueError as e:
+            errors.append((line, str(e)))
+            if len(errors) >= MAX_ERRORS:
+                break
+    return athletes, errors
@@ -0,0 +1,112 @@
+import json
+
+HOURS = 24
+
+def init_attendance_daily(conn):
+    """Create the attendance_daily table on an open connection."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS attendance_daily
+                 (gender TEXT NOT NULL,
+                  date TEXT NOT NULL,
+                  visitors INTEGER NOT NULL DEFAULT 0,
+                  sessions INTEGER NOT NULL DEFAULT 0,
+                  total_seconds INTEGER NOT NULL DEFAULT 0,
+                  hourly TEXT NOT NULL,
+                  PRIMARY KEY (gender, date))''')
+
+def record_checkout(conn, gender, athlete_id, date, check_in_time, check_out_time):
+    """
+    Add one completed session to attendance_daily, in the caller's transaction.
+
+    Call after the check-out UPDATE so the session counts as completed.
+    Summaries cover completed sessions only; the hourly histogram buckets
+    sessions by check-in hour.
+    """
+    seconds = conn.execute("SELECT CAST(ROUND((julianday(?) - julianday(?)) * 86400) AS INTEGER)",
+                           (check_out_time, check_in_time)).fetchone()[0]
+    hour = int(check_in_time[11:13])
+    completed_today = conn.execute('''SELECT COUNT(*) FROM attendance
+                                      WHERE athlete_id = ? AND date = ? AND check_out_time IS NOT NULL''',
+                                   (athlete_id, date)).fetchone()[0]
+    new_visitor = 1 if completed_today == 1 else 0
+
+    row = conn.execute('SELECT hourly FROM attendance_daily WHERE gender = ? AND date = ?',
+                       (gender, date)).fetchone()
+    hourly = json.loads(row[0]) if row else [0] * HOURS
+    hourly[hour] += 1
+
+    if row is None:
+        conn.execute('''INSERT INTO attendance_daily (gender, date, visitors, sessions, total_seconds, hourly)
+                        VALUES (?, ?, ?, 1, ?, ?)''',
+                     (gender, date, new_visitor, seconds, json.dumps(hourly)))
+    else:
+        conn.execute('''UPDATE attendance_daily SET
+                        visitors = visitors + ?, sessions = sessions + 1,
+                        total_seconds = total_seconds + ?, hourly = ?
+                        WHERE gender = ? AND date = ?''',
+                     (new_visitor, seconds, json.dumps(hourly), gender, date))
+
+def rebuild_attendance_daily(conn, since=None):
+    """
+    Recompute attendance_daily from the raw attendance rows.
+
+    Args:
+        since (str): Only rebuild dates on or after this 'YYYY-MM-DD'
+
+    Returns:
+        int: Number of (gender, date) rows written
+    """
+    since = since or '0000-00-00'
+    rows = conn.execute('''
+        SELECT a.gender,
+               att.date,
+               COUNT(DISTINCT att.athlete_id) AS visitors,
+               COUNT(*) AS sessions,
+               COALESCE(SUM(CAST(ROUND((julianday(att.check_out_time)
+                                        - julianday(att.check_in_time)) * 86400) AS INTEGER)), 0)
+                   AS total_seconds
+        FROM attendance att
+        JOIN athletes a ON a.id = att.athlete_id
+        WHERE att.date >= ? AND att.check_out_time IS NOT NULL
+        GROUP BY a.gender, att.date
+    ''', (since,)).fetchall()
+
+    histograms = {}
+    for gender, date, hour, count in conn.execute('''
+        SELECT a.gender, att.date, CAST(substr(att.check_in_time, 12, 2) AS INTEGER), COUNT(*)
+        FROM attendance att
+        JOIN athletes a ON a.id = att.athlete_id
+        WHERE att.date >= ? AND att.check_out_time IS NOT NULL
+        GROUP BY a.gender, att.date, 3
+    ''', (since,)):
+        histograms.setdefault((gender, date), [0] * HOURS)[hour] += count
+
+    conn.execute('DELETE FROM attendance_daily WHERE date >= ?', (since,))
+    conn.executemany('''INSERT INTO attendance_daily (gender, date, visitors, sessions, total_seconds, hourly)
+                        VALUES (?, ?, ?, ?, ?, ?)''',
+                     [(gender, date, visitors, sessions, total_seconds,
+                       json.dumps(histograms[(gender, date)]))
+                      for gender, date, visitors, sessions, total_seconds in rows])
+    return len(rows)
+
+def get_daily_summary(conn, gender, date):
+    """
+    Summary of one day, or None when nobody completed a session.
+
+    Returns:
+        dict: visitors, sessions, total_seconds, mean_seconds, hourly
+            (24 counts) and peak_hour
+    """
+    row = conn.execute('''SELECT visitors, sessions, total_seconds, hourly FROM attendance_daily
+                          WHERE gender = ? AND date = ?''', (gender, date)).fetchone()
+    if row is None:
+        return None
+    visitors, sessions, total_seconds, hourly = row
+    hourly = json.loads(hourly)
+    return {
+        'visitors': visitors,
+        'sessions': sessions,
+        'total_seconds': total_seconds,
+        'mean_seconds': total_seconds // sessions if sessions else 0,
+        'hourly': hourly,
+        'peak_hour': max(range(HOURS), key=hourly.__getitem__),
+    }
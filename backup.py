@@ -1,14 +1,20 @@
+import argparse
+import base64
+import gzip
 import smtplib
+import shutil
+import sqlite3
 import datetime
 import os
-import shutil
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email import encoders
+import sys
+import time
+from email.utils import formatdate, make_msgid
 from dotenv import load_dotenv
 import threading 
 from requests import post
+from urllib.parse import quote
+from backup_store import (BackupStoreError, apply_delta, apply_retention, export_delta, last_full_sent,
+                          list_snapshots, mark_full_sent, restore_snapshot, verify_snapshot, write_snapshot)
 
 load_dotenv()
 
@@ -16,8 +22,36 @@ EMAIL_USER = os.getenv('EMAIL_USER')
 EMAIL_PASS = os.getenv('EMAIL_PASS')
 TO_EMAIL = os.getenv('TO_EMAIL')
 TO_EMAIL2 = os.getenv('TO_EMAIL2')
+# Point these at a local debugging server (e.g. SMTP_SERVER=localhost
+# SMTP_PORT=1025 SMTP_STARTTLS=0, no EMAIL_PASS) to try delivery offline
+SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', '1') != '0'
+# Largest attachment per email, before base64; bigger backups are split
+# into numbered parts sent as separate emails (Gmail rejects over 25 MB)
+ATTACHMENT_PART_SIZE = int(float(os.getenv('BACKUP_ATTACHMENT_MB', 18)) * 1024 * 1024)
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 CHAT_ID = os.getenv('CHAT_ID')
+DB_PATH = os.getenv('DB_PATH', 'database.db')
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_STORE = os.getenv('BACKUP_STORE', os.path.join(BACKUP_DIR, 'store'))
+
+# Snapshots kept: the newest of each of the last N days, ISO weeks and months
+KEEP_DAILY = int(os.getenv('BACKUP_KEEP_DAILY', 7))
+KEEP_WEEKLY = int(os.getenv('BACKUP_KEEP_WEEKLY', 4))
+KEEP_MONTHLY = int(os.getenv('BACKUP_KEEP_MONTHLY', 12))
+
+# Emails carry a full copy this often and, in between, only the pages that
+# changed since the last full copy
+FULL_EMAIL_EVERY_DAYS = int(os.getenv('BACKUP_FULL_EVERY_DAYS', 7))
+
+# Pages copied per backup step, and the pause after each step so a backup
+# does not hog the disk while the app is serving
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_PAUSE = 0.01
+
+class BackupError(Exception):
+    """The backup copy could not be made or failed its integrity check."""
 
 def log(text):
     """
@@ -44,86 +78,261 @@ def add(txt):
     except Exception:
         pass
 
+def connect_readonly(database=None):
+    """
+    Open the live database read-only, without copying it.
+    
+    The connection cannot write, and in WAL mode each query reads a
+    consistent snapshot while the app keeps committing check-ins.
+    """
+    database = database or DB_PATH
+    return sqlite3.connect(f'file:{quote(os.path.abspath(database))}?mode=ro', uri=True, timeout=30)
+
+def backup_database(destination, source=None, pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE):
+    """
+    Copy the live database to destination with SQLite's online backup API.
+    
+    The copy is read from one WAL snapshot, so it is consistent and includes
+    commits still in the -wal file, while check-ins keep writing: readers
+    never block writers in WAL mode, and the copy is made pages at a time
+    with a short pause between steps. The result is checked with
+    PRAGMA integrity_check and switched to rollback-journal mode so it is a
+    single self-contained file; it only replaces destination once verified.
+    
+    Args:
+        destination (str): Path of the backup file
+        source (str): Database to copy, DB_PATH by default
+        pages (int): Pages copied per step
+        pause (float): Seconds to sleep between steps
+    
+    Returns:
+        str: destination
+    """
+    source = source or DB_PATH
+    if not os.path.exists(source):
+        raise BackupError(f"database '{source}' not found")
+    partial = destination + '.part'
+    if os.path.exists(partial):
+        os.remove(partial)
+    
+    src = connect_readonly(source)
+    dst = sqlite3.connect(partial)
+    try:
+        # Hold one read transaction so every step sees the same snapshot
+        # and the backup never restarts because of a concurrent write
+        src.execute('BEGIN')
+        src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        src.backup(dst, pages=pages, progress=lambda status, remaining, total: time.sleep(pause))
+        src.rollback()
+        
+        dst.execute('PRAGMA journal_mode = DELETE')
+        problems = [row[0] for row in dst.execute('PRAGMA integrity_check')]
+        if problems != ['ok']:
+            raise BackupError(f"integrity check failed: {'; '.join(problems[:5])}")
+    except Exception as e:
+        dst.close()
+        os.remove(partial)
+        if isinstance(e, sqlite3.Error):
+            raise BackupError(str(e)) from e
+        raise
+    finally:
+        dst.close()
+        src.close()
+    os.replace(partial, destination)
+    return destination
+
+def compress_file(source, destination):
+    """gzip source into destination without reading it into memory."""
+    with open(source, 'rb') as src, gzip.open(destination, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    return destination
+
 def send_db_backup():
-    db_file = "/home/kiaparsg/gym/database.db"
-    backup_dir = "/home/kiaparsg/backups"
+    """
+    Snapshot the database into the backup store and email it.
     
+    The consistent copy made by backup_database is added to BACKUP_STORE,
+    where only pages that changed since earlier snapshots take new space.
+    Every FULL_EMAIL_EVERY_DAYS a gzipped full copy is mailed; on the other
+    days the email carries only the pages that differ from that full copy
+    (export_delta), which `backup.py apply-delta` turns back into the
+    database. Temporary files are removed after. Errors are reported with
+    add(); returns whether the backup succeeded.
+    """
     # create backup folder if not exist
-    os.makedirs(backup_dir, exist_ok=True)
+    os.makedirs(BACKUP_DIR, exist_ok=True)
     
     # creating backup file
-    backup_filename = f"database_backup_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-    backup_path = os.path.join(backup_dir, backup_filename)
+    now = datetime.datetime.now()
+    stamp = now.strftime('%Y%m%d_%H%M%S')
+    backup_path = os.path.join(BACKUP_DIR, 'database_backup.db')
+    attachment_path = None
     
     try:
-        # coping to backup path
-        shutil.copy2(db_file, backup_path)
-        print(f"Backup copied to: {backup_path}")
+        backup_database(backup_path)
+        snapshot = write_snapshot(BACKUP_STORE, backup_path, now)
+        print(f"Snapshot {snapshot['name']}: {snapshot['new_pages']} of {snapshot['pages']} pages new, "
+              f"{snapshot['stored_bytes'] / 1024:.2f} KB stored")
+        
+        base = last_full_sent(BACKUP_STORE)
+        if base is not None and now - datetime.datetime.fromisoformat(base[1]) < \
+                datetime.timedelta(days=FULL_EMAIL_EVERY_DAYS):
+            attachment_path = os.path.join(BACKUP_DIR, f"database_backup_{stamp}.delta.db")
+            try:
+                pages = export_delta(BACKUP_STORE, base[0], snapshot['name'], attachment_path)
+            except BackupStoreError as e:
+                print(f"Sending a full copy instead of a delta: {e}")
+                attachment_path = None
+            else:
+                note = (f"Changes since the full backup of {base[0]} ({pages} pages). Rebuild with: "
+                        f"python backup.py apply-delta <full backup>.db {os.path.basename(attachment_path)} "
+                        f"<output>.db")
+                send_backup_email(attachment_path, [TO_EMAIL, TO_EMAIL2], note)
+                add("BACKUP DB CHANGES SENT TO YOUR EMAIL")
+                return True
         
-        # sending backup file via email
-        send_backup_email(backup_path, TO_EMAIL)
-        send_backup_email(backup_path, TO_EMAIL2)
+        # sending a full backup file via email
+        attachment_path = os.path.join(BACKUP_DIR, f"database_backup_{stamp}.db.gz")
+        compress_file(backup_path, attachment_path)
+        send_backup_email(attachment_path, [TO_EMAIL, TO_EMAIL2],
+                          f"Full backup {snapshot['name']}; the following days' emails carry changes to it.")
+        mark_full_sent(BACKUP_STORE, snapshot['name'])
         add("BACKUP DB SENT TO YOUR EMAIL")
+        return True
         
     except Exception as e:
         add(f"Error in backup process: {e}")
+        return False
+    finally:
+        for path in (backup_path, attachment_path):
+            if path and os.path.exists(path):
+                os.remove(path)
 
-def send_backup_email(backup_file_path, rec_EMAIL):
-    SMTP_SERVER = "smtp.gmail.com"
-    SMTP_PORT = 587
-    
-    msg = MIMEMultipart()
-    msg['From'] = EMAIL_USER
-    msg['To'] = rec_EMAIL
-    msg['Subject'] = f"Database Backup - {datetime.datetime.now().strftime('%Y-%m-%d')}"
-    
+# Bytes of attachment per base64 line group; a multiple of 57 so every
+# line but the last is exactly 76 characters
+_BASE64_BLOCK = 57 * 1024
+
+def _backup_message(backup_file_path, recipients, part, parts, offset, length, now, description=''):
+    """Yield one backup email as CRLF-terminated lines, reading the file as it goes."""
+    filename = os.path.basename(backup_file_path)
+    if parts > 1:
+        subject = f"Database Backup - {now.strftime('%Y-%m-%d')} (part {part} of {parts})"
+        attachment_name = f"{filename}.{part:03d}"
+        note = f"Part {part} of {parts}; join the parts in order to get {filename}."
+    else:
+        subject = f"Database Backup - {now.strftime('%Y-%m-%d')}"
+        attachment_name = filename
+        note = ""
+    boundary = f"backup-{now.strftime('%Y%m%d%H%M%S')}-{part}"
     body = f"""
     Database backup attached.
-    File: {os.path.basename(backup_file_path)}
-    Date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    File: {filename}
+    Date: {now.strftime('%Y-%m-%d %H:%M:%S')}
     Size: {os.path.getsize(backup_file_path) / 1024:.2f} KB
-    Backup Location: {backup_file_path}
+    {description}
+    {note}
     """
-    msg.attach(MIMEText(body, 'plain'))
     
-    try:
-        with open(backup_file_path, "rb") as attachment:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(attachment.read())
-        
-        encoders.encode_base64(part)
-        part.add_header(
-            'Content-Disposition',
-            f'attachment; filename= "{os.path.basename(backup_file_path)}"'
-        )
-        msg.attach(part)
-        
-        # sending email
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASS)
-        server.send_message(msg)
-        server.quit()
-        
-        print(f"Backup sent successfully to {TO_EMAIL}")
-        
-    except Exception as e:
-        print(f"Error sending email: {e}")
+    yield from (f"{line}\r\n".encode('utf-8') for line in [
+        f"From: {EMAIL_USER}",
+        f"To: {', '.join(recipients)}",
+        f"Subject: {subject}",
+        f"Date: {formatdate(localtime=True)}",
+        f"Message-ID: {make_msgid()}",
+        "MIME-Version: 1.0",
+        f'Content-Type: multipart/mixed; boundary="{boundary}"',
+        "",
+        f"--{boundary}",
+        'Content-Type: text/plain; charset="utf-8"',
+        "Content-Transfer-Encoding: 8bit",
+        "",
+        *body.splitlines(),
+        f"--{boundary}",
+        f'Content-Type: application/octet-stream; name="{attachment_name}"',
+        "Content-Transfer-Encoding: base64",
+        f'Content-Disposition: attachment; filename="{attachment_name}"',
+        "",
+    ])
+    with open(backup_file_path, 'rb') as attachment:
+        attachment.seek(offset)
+        while length > 0:
+            data = attachment.read(min(_BASE64_BLOCK, length))
+            if not data:
+                break
+            length -= len(data)
+            yield base64.encodebytes(data).replace(b'\n', b'\r\n')
+    yield f"--{boundary}--\r\n".encode('utf-8')
 
-def cleanup_old_backups(days=7):
-    """deleting older backup (7 days)"""
-    backup_dir = "/home/kiaparsg/backups"
-    if not os.path.exists(backup_dir):
-        return
+def _send_streamed(server, sender, recipients, lines):
+    """Send one message over an open SMTP session without building it in memory."""
+    server.ehlo_or_helo_if_needed()
+    code, response = server.mail(sender)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, response, sender)
+    accepted = [recipient for recipient in recipients if server.rcpt(recipient)[0] in (250, 251)]
+    if not accepted:
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused({recipient: (550, b'refused') for recipient in recipients})
+    code, response = server.docmd('DATA')
+    if code != 354:
+        raise smtplib.SMTPDataError(code, response)
+    for chunk in lines:
+        # Dot-stuffing; base64 lines never start with a dot, header lines might
+        if chunk.startswith(b'.'):
+            chunk = b'.' + chunk
+        server.send(chunk)
+    server.send(b'.\r\n')
+    code, response = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
+    return accepted
+
+def send_backup_email(backup_file_path, recipients, description=''):
+    """
+    Email a backup file to every recipient over one SMTP session.
+    
+    The message is written straight to the connection, base64-encoding
+    the file a block at a time, so memory use does not grow with the
+    backup. All recipients receive the same upload. Files larger than
+    ATTACHMENT_PART_SIZE are sent as numbered parts, one email each.
     
+    Args:
+        backup_file_path (str): File to attach
+        recipients (list): Addresses; empty entries are skipped
+        description (str): Extra line for the email body
+    
+    Returns:
+        list: Recipients that accepted every part
+    """
+    recipients = [recipient for recipient in recipients if recipient]
+    if not recipients:
+        raise ValueError("no backup email recipients configured")
+    size = os.path.getsize(backup_file_path)
+    parts = max(1, -(-size // ATTACHMENT_PART_SIZE))
     now = datetime.datetime.now()
-    for filename in os.listdir(backup_dir):
-        file_path = os.path.join(backup_dir, filename)
-        if os.path.isfile(file_path):
-            file_time = datetime.datetime.fromtimestamp(os.path.getmtime(file_path))
-            if (now - file_time).days > days:
-                os.remove(file_path)
-                print(f"Deleted old backup: {filename}")
+    
+    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=60) as server:
+        if SMTP_STARTTLS:
+            server.starttls()
+        if EMAIL_PASS:
+            server.login(EMAIL_USER, EMAIL_PASS)
+        delivered = set(recipients)
+        for part in range(1, parts + 1):
+            offset = (part - 1) * ATTACHMENT_PART_SIZE
+            lines = _backup_message(backup_file_path, recipients, part, parts, offset,
+                                    min(ATTACHMENT_PART_SIZE, size - offset), now, description)
+            delivered &= set(_send_streamed(server, EMAIL_USER, recipients, lines))
+    
+    print(f"Backup sent successfully to {', '.join(sorted(delivered))}")
+    return [recipient for recipient in recipients if recipient in delivered]
+
+def cleanup_old_backups(daily=KEEP_DAILY, weekly=KEEP_WEEKLY, monthly=KEEP_MONTHLY):
+    """Drop snapshots outside the daily/weekly/monthly tiers and the pages only they used."""
+    removed, deleted = apply_retention(BACKUP_STORE, daily, weekly, monthly)
+    for name in removed:
+        print(f"Deleted old backup: {name}")
+    if deleted:
+        print(f"Deleted {deleted} unused pack files")
 
 def send_to_telegram_bot(msg: str) -> None:
     """
@@ -147,7 +356,53 @@ def send_to_telegram_bot(msg: str) -> None:
     except Exception as e:
         print(f"[ERROR] Failed to send Telegram message: {str(e)}")
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Back up the gym database.')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('run', help='snapshot, email and apply retention (default)')
+    commands.add_parser('list', help='list snapshots in the store')
+    verify = commands.add_parser('verify', help='check snapshots for missing or damaged pages')
+    verify.add_argument('name', nargs='?', help='snapshot to check; all by default')
+    restore = commands.add_parser('restore', help='rebuild a snapshot as a database file')
+    restore.add_argument('name')
+    restore.add_argument('destination')
+    delta = commands.add_parser('apply-delta', help='rebuild a database from a full backup and an emailed delta')
+    delta.add_argument('base', help='the full backup the delta was made against (gunzipped)')
+    delta.add_argument('delta')
+    delta.add_argument('destination')
+    args = parser.parse_args(argv)
+    
+    if args.command in (None, 'run'):
+        send_db_backup()
+        cleanup_old_backups()
+    elif args.command == 'list':
+        for name, created, size in list_snapshots(BACKUP_STORE):
+            print(f"{name}  {created}  {size / 1024:.2f} KB")
+    elif args.command == 'verify':
+        failed = 0
+        for name in [args.name] if args.name else [row[0] for row in list_snapshots(BACKUP_STORE)]:
+            try:
+                verify_snapshot(BACKUP_STORE, name)
+                print(f"{name}  ok")
+            except BackupStoreError as e:
+                failed += 1
+                print(f"{name}  FAILED: {e}")
+        return 1 if failed else 0
+    elif args.command == 'restore':
+        try:
+            restore_snapshot(BACKUP_STORE, args.name, args.destination)
+        except BackupStoreError as e:
+            print(f"Restore failed: {e}")
+            return 1
+        print(f"Restored {args.name} to {args.destination}")
+    elif args.command == 'apply-delta':
+        try:
+            name = apply_delta(args.base, args.delta, args.destination)
+        except (BackupStoreError, sqlite3.Error, KeyError) as e:
+            print(f"Rebuild failed: {e}")
+            return 1
+        print(f"Rebuilt snapshot {name} at {args.destination}")
+    return 0
+
 if __name__ == "__main__":
-    # backup
-    send_db_backup()
-    cleanup_old_backups(7)
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,476 @@
+import datetime
+import hashlib
+import os
+import sqlite3
+import zlib
+from array import array
+
+COMPRESSION_LEVEL = 6
+
+# Snapshot names; a second snapshot within the same second gets a
+# counter suffix ('20261018-033000.1') that still sorts in order
+SNAPSHOT_FORMAT = '%Y%m%d-%H%M%S'
+
+# A pack is rewritten by apply_retention once less than this share of it is
+# still used by a kept snapshot
+REPACK_BELOW = 0.5
+
+class BackupStoreError(Exception):
+    """A snapshot is missing, damaged or does not restore to a valid database."""
+
+def open_store(store_dir):
+    """
+    Open (creating if needed) the index of a backup store.
+
+    The store keeps every distinct database page once, zlib-compressed, in
+    append-only pack files under packs/. index.db maps each page's SHA-256
+    to its place in a pack, and records each snapshot as the list of page
+    ids it is made of.
+    """
+    os.makedirs(os.path.join(store_dir, 'packs'), exist_ok=True)
+    # Generous timeout: a concurrent write_snapshot holds the lock while it reads a whole database
+    conn = sqlite3.connect(os.path.join(store_dir, 'index.db'), timeout=300)
+    conn.execute('''CREATE TABLE IF NOT EXISTS packs
+                 (id INTEGER PRIMARY KEY,
+                  size INTEGER NOT NULL DEFAULT 0)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS chunks
+                 (id INTEGER PRIMARY KEY,
+                  digest BLOB NOT NULL UNIQUE,
+                  pack INTEGER NOT NULL REFERENCES packs(id),
+                  offset INTEGER NOT NULL,
+                  length INTEGER NOT NULL)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_pack ON chunks(pack)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS snapshots
+                 (name TEXT PRIMARY KEY,
+                  created TEXT NOT NULL,
+                  size INTEGER NOT NULL,
+                  page_size INTEGER NOT NULL,
+                  sha256 TEXT NOT NULL,
+                  pages BLOB NOT NULL,
+                  full_sent INTEGER NOT NULL DEFAULT 0)''')
+    # Migrate stores created before full copies were tracked
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(snapshots)')]
+    if 'full_sent' not in columns:
+        conn.execute('ALTER TABLE snapshots ADD COLUMN full_sent INTEGER NOT NULL DEFAULT 0')
+    conn.commit()
+    return conn
+
+def _pack_path(store_dir, pack):
+    return os.path.join(store_dir, 'packs', f'{pack:08d}.pack')
+
+def _page_ids(pages):
+    ids = array('I')
+    ids.frombytes(zlib.decompress(pages))
+    return ids
+
+def _page_size(db_file):
+    """Page size from the SQLite header (bytes 16-17, where 1 means 65536)."""
+    with open(db_file, 'rb') as file:
+        header = file.read(100)
+    if len(header) < 100 or not header.startswith(b'SQLite format 3\x00'):
+        raise BackupStoreError(f"'{db_file}' is not an SQLite database")
+    size = int.from_bytes(header[16:18], 'big')
+    return 65536 if size == 1 else size
+
+def list_snapshots(store_dir):
+    """(name, created, size) of every snapshot, oldest first."""
+    conn = open_store(store_dir)
+    try:
+        return conn.execute('SELECT name, created, size FROM snapshots ORDER BY name').fetchall()
+    finally:
+        conn.close()
+
+def write_snapshot(store_dir, db_file, now=None):
+    """
+    Add a database file to the store as a new snapshot.
+
+    The file is read one page at a time. Pages already in the store, from
+    this or any earlier snapshot, are only referenced; new ones are
+    compressed and appended to a fresh pack file, which is synced before
+    the index records the snapshot. A day of check-ins changes a few
+    hundred pages, so that is all a daily snapshot stores.
+
+    Args:
+        store_dir (str): Store directory, created if missing
+        db_file (str): Consistent copy of the database (see backup_database)
+        now (datetime): Snapshot time, for the name (suffixed with a
+            counter if a snapshot already has that name)
+
+    Returns:
+        dict: name, size, pages, new_pages and stored_bytes (compressed size
+            of the new pages)
+    """
+    now = now or datetime.datetime.now()
+    page_size = _page_size(db_file)
+    conn = open_store(store_dir)
+    pack = None
+    try:
+        # The INSERT takes the index's write lock until commit, so the name
+        # chosen here cannot be taken by a concurrent write_snapshot
+        pack = conn.execute('INSERT INTO packs DEFAULT VALUES').lastrowid
+        name = _free_name(conn, now.strftime(SNAPSHOT_FORMAT))
+        ids = array('I')
+        whole = hashlib.sha256()
+        size = 0
+        offset = 0
+        new_pages = 0
+        with open(db_file, 'rb') as file, open(_pack_path(store_dir, pack), 'wb') as pack_file:
+            while True:
+                data = file.read(page_size)
+                if not data:
+                    break
+                whole.update(data)
+                size += len(data)
+                digest = hashlib.sha256(data).digest()
+                row = conn.execute('SELECT id FROM chunks WHERE digest = ?', (digest,)).fetchone()
+                if row is None:
+                    compressed = zlib.compress(data, COMPRESSION_LEVEL)
+                    pack_file.write(compressed)
+                    row = (conn.execute('''INSERT INTO chunks (digest, pack, offset, length)
+                                           VALUES (?, ?, ?, ?)''',
+                                        (digest, pack, offset, len(compressed))).lastrowid,)
+                    offset += len(compressed)
+                    new_pages += 1
+                ids.append(row[0])
+            pack_file.flush()
+            os.fsync(pack_file.fileno())
+
+        if offset:
+            conn.execute('UPDATE packs SET size = ? WHERE id = ?', (offset, pack))
+        else:
+            conn.execute('DELETE FROM packs WHERE id = ?', (pack,))
+            os.remove(_pack_path(store_dir, pack))
+        conn.execute('''INSERT INTO snapshots (name, created, size, page_size, sha256, pages)
+                        VALUES (?, ?, ?, ?, ?, ?)''',
+                     (name, now.isoformat(timespec='seconds'), size, page_size,
+                      whole.hexdigest(), zlib.compress(ids.tobytes())))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        if pack is not None and os.path.exists(_pack_path(store_dir, pack)):
+            os.remove(_pack_path(store_dir, pack))
+        raise
+    finally:
+        conn.close()
+    return {'name': name, 'size': size, 'pages': len(ids),
+            'new_pages': new_pages, 'stored_bytes': offset}
+
+def _free_name(conn, name):
+    """name, or name.1, name.2, ... if snapshots already use it."""
+    candidate, counter = name, 0
+    while conn.execute('SELECT 1 FROM snapshots WHERE name = ?', (candidate,)).fetchone():
+        counter += 1
+        candidate = f'{name}.{counter}'
+    return candidate
+
+def _snapshot_time(name):
+    return datetime.datetime.strptime(name.split('.')[0], SNAPSHOT_FORMAT)
+
+def _snapshot_ids(conn, name):
+    row = conn.execute('SELECT pages FROM snapshots WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        raise BackupStoreError(f"snapshot '{name}' not found")
+    return _page_ids(row[0])
+
+def _read_chunk(store_dir, conn, packs, name, chunk):
+    """
+    One stored page as (compressed bytes, decompressed bytes), checking its
+    hash. packs caches open pack files; the caller closes them.
+    """
+    location = conn.execute('SELECT digest, pack, offset, length FROM chunks WHERE id = ?',
+                            (chunk,)).fetchone()
+    if location is None:
+        raise BackupStoreError(f"snapshot '{name}' refers to missing page {chunk}")
+    digest, pack, offset, length = location
+    if pack not in packs:
+        try:
+            packs[pack] = open(_pack_path(store_dir, pack), 'rb')
+        except FileNotFoundError:
+            raise BackupStoreError(f"snapshot '{name}' needs missing pack {pack:08d}")
+    packs[pack].seek(offset)
+    compressed = packs[pack].read(length)
+    try:
+        data = zlib.decompress(compressed)
+    except zlib.error:
+        data = None
+    if data is None or hashlib.sha256(data).digest() != digest:
+        raise BackupStoreError(f"page {chunk} of snapshot '{name}' is corrupt (pack {pack:08d})")
+    return compressed, data
+
+def _snapshot_pages(store_dir, conn, name):
+    """Yield a snapshot's pages decompressed, checking each one's hash."""
+    packs = {}
+    try:
+        for chunk in _snapshot_ids(conn, name):
+            yield _read_chunk(store_dir, conn, packs, name, chunk)[1]
+    finally:
+        for file in packs.values():
+            file.close()
+
+def verify_snapshot(store_dir, name):
+    """
+    Check that every page of a snapshot is present and intact and that
+    together they match the snapshot's SHA-256. Raises BackupStoreError.
+    """
+    conn = open_store(store_dir)
+    try:
+        expected = conn.execute('SELECT sha256 FROM snapshots WHERE name = ?', (name,)).fetchone()
+        whole = hashlib.sha256()
+        for data in _snapshot_pages(store_dir, conn, name):
+            whole.update(data)
+        if whole.hexdigest() != expected[0]:
+            raise BackupStoreError(f"snapshot '{name}' does not match its checksum")
+    finally:
+        conn.close()
+
+def restore_snapshot(store_dir, name, destination):
+    """
+    Rebuild the database file of a snapshot at destination.
+
+    The file is reassembled next to destination, checked against the
+    snapshot's SHA-256 and with PRAGMA integrity_check, and only then moved
+    into place, so a failed restore never leaves a half-written database.
+    Stop the app before restoring over its live database.
+    """
+    partial = destination + '.part'
+    conn = open_store(store_dir)
+    try:
+        whole = hashlib.sha256()
+        with open(partial, 'wb') as file:
+            for data in _snapshot_pages(store_dir, conn, name):
+                whole.update(data)
+                file.write(data)
+        expected = conn.execute('SELECT sha256 FROM snapshots WHERE name = ?', (name,)).fetchone()[0]
+        if whole.hexdigest() != expected:
+            raise BackupStoreError(f"snapshot '{name}' does not match its checksum")
+        restored = sqlite3.connect(partial)
+        try:
+            problems = [row[0] for row in restored.execute('PRAGMA integrity_check')]
+        finally:
+            restored.close()
+        if problems != ['ok']:
+            raise BackupStoreError(f"restored database failed integrity check: {'; '.join(problems[:5])}")
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        conn.close()
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(destination + suffix):
+            os.remove(destination + suffix)
+    os.replace(partial, destination)
+
+def last_full_sent(store_dir):
+    """(name, created) of the newest snapshot mailed as a full copy, or None."""
+    conn = open_store(store_dir)
+    try:
+        return conn.execute('''SELECT name, created FROM snapshots WHERE full_sent
+                                ORDER BY name DESC LIMIT 1''').fetchone()
+    finally:
+        conn.close()
+
+def mark_full_sent(store_dir, name):
+    """Record that snapshot name went out as a full copy, the base for later deltas."""
+    conn = open_store(store_dir)
+    try:
+        conn.execute('UPDATE snapshots SET full_sent = 1 WHERE name = ?', (name,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def export_delta(store_dir, base, name, destination):
+    """
+    Write the pages of snapshot name that differ from snapshot base to a
+    small SQLite file, which apply_delta turns back into the full database
+    given base's file.
+
+    Pages are copied as stored (zlib-compressed), so the delta costs about
+    what the snapshots between base and name added to the store.
+
+    Returns:
+        int: Number of pages in the delta
+    """
+    conn = open_store(store_dir)
+    packs = {}
+    partial = destination + '.part'
+    if os.path.exists(partial):
+        os.remove(partial)
+    delta = sqlite3.connect(partial)
+    try:
+        meta = {}
+        for key, snapshot in (('base', base), ('target', name)):
+            row = conn.execute('SELECT size, page_size, sha256 FROM snapshots WHERE name = ?',
+                               (snapshot,)).fetchone()
+            if row is None:
+                raise BackupStoreError(f"snapshot '{snapshot}' not found")
+            meta.update({f'{key}_name': snapshot, f'{key}_size': row[0],
+                         f'{key}_page_size': row[1], f'{key}_sha256': row[2]})
+        if meta['base_page_size'] != meta['target_page_size']:
+            raise BackupStoreError(f"snapshots '{base}' and '{name}' have different page sizes")
+
+        delta.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value)')
+        delta.execute('CREATE TABLE pages (number INTEGER PRIMARY KEY, data BLOB NOT NULL)')
+        delta.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', meta.items())
+        base_ids = _snapshot_ids(conn, base)
+        count = 0
+        for number, chunk in enumerate(_snapshot_ids(conn, name)):
+            if number < len(base_ids) and base_ids[number] == chunk:
+                continue
+            compressed = _read_chunk(store_dir, conn, packs, name, chunk)[0]
+            delta.execute('INSERT INTO pages (number, data) VALUES (?, ?)', (number, compressed))
+            count += 1
+        delta.commit()
+    except BaseException:
+        delta.close()
+        os.remove(partial)
+        raise
+    finally:
+        delta.close()
+        for file in packs.values():
+            file.close()
+        conn.close()
+    os.replace(partial, destination)
+    return count
+
+def apply_delta(base_file, delta_file, destination):
+    """
+    Rebuild a snapshot's database from its base's file and an export_delta
+    file. The result is checked against the snapshot's SHA-256 and with
+    PRAGMA integrity_check before it is moved to destination.
+    """
+    delta = sqlite3.connect(delta_file)
+    partial = destination + '.part'
+    try:
+        meta = dict(delta.execute('SELECT key, value FROM meta'))
+        base_hash = hashlib.sha256()
+        with open(base_file, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                base_hash.update(block)
+        if base_hash.hexdigest() != meta['base_sha256']:
+            raise BackupStoreError(f"'{base_file}' is not the snapshot {meta['base_name']} this delta needs")
+
+        page_size = meta['target_page_size']
+        with open(base_file, 'rb') as src, open(partial, 'wb') as dst:
+            for block in iter(lambda: src.read(1024 * 1024), b''):
+                dst.write(block)
+            for number, data in delta.execute('SELECT number, data FROM pages ORDER BY number'):
+                dst.seek(number * page_size)
+                dst.write(zlib.decompress(data))
+            dst.truncate(meta['target_size'])
+
+        whole = hashlib.sha256()
+        with open(partial, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                whole.update(block)
+        if whole.hexdigest() != meta['target_sha256']:
+            raise BackupStoreError(f"rebuilt snapshot {meta['target_name']} does not match its checksum")
+        restored = sqlite3.connect(partial)
+        try:
+            problems = [row[0] for row in restored.execute('PRAGMA integrity_check')]
+        finally:
+            restored.close()
+        if problems != ['ok']:
+            raise BackupStoreError(f"rebuilt database failed integrity check: {'; '.join(problems[:5])}")
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        delta.close()
+    os.replace(partial, destination)
+    return meta['target_name']
+
+def snapshots_to_keep(names, daily=7, weekly=4, monthly=12):
+    """
+    Grandfather-father-son selection of snapshot names (oldest first).
+
+    Keeps the newest snapshot of each of the last `daily` days, `weekly`
+    ISO weeks and `monthly` months that have snapshots, plus the newest
+    snapshot overall.
+    """
+    keep = set(names[-1:])
+    tiers = ((daily, lambda moment: moment.date()),
+             (weekly, lambda moment: moment.isocalendar()[:2]),
+             (monthly, lambda moment: (moment.year, moment.month)))
+    for count, period in tiers:
+        seen = []
+        for name in reversed(names):
+            key = period(_snapshot_time(name))
+            if key in seen:
+                continue
+            if len(seen) == count:
+                break
+            seen.append(key)
+            keep.add(name)
+    return keep
+
+def apply_retention(store_dir, daily=7, weekly=4, monthly=12):
+    """
+    Delete snapshots outside the retention tiers and reclaim their pages.
+    The newest snapshot mailed as a full copy is always kept, as the base
+    of the deltas mailed after it.
+
+    Pages no kept snapshot uses are dropped from the index; pack files left
+    with no used pages are deleted, and packs less than REPACK_BELOW used
+    have their live pages copied into a new pack first. Pack files the
+    index does not know (left by an interrupted write_snapshot) are removed.
+    Must not run while write_snapshot is adding to the same store.
+
+    Returns:
+        tuple: (removed snapshot names, number of pack files deleted)
+    """
+    conn = open_store(store_dir)
+    try:
+        names = [row[0] for row in conn.execute('SELECT name FROM snapshots ORDER BY name')]
+        keep = snapshots_to_keep(names, daily, weekly, monthly)
+        keep.update(row[0] for row in conn.execute('''SELECT name FROM snapshots WHERE full_sent
+                                                      ORDER BY name DESC LIMIT 1'''))
+        removed = [name for name in names if name not in keep]
+        conn.executemany('DELETE FROM snapshots WHERE name = ?', [(name,) for name in removed])
+
+        conn.execute('CREATE TEMP TABLE used_chunks (id INTEGER PRIMARY KEY)')
+        for (pages,) in conn.execute('SELECT pages FROM snapshots').fetchall():
+            conn.executemany('INSERT OR IGNORE INTO used_chunks (id) VALUES (?)',
+                             ((chunk,) for chunk in _page_ids(pages)))
+        conn.execute('DELETE FROM chunks WHERE id NOT IN (SELECT id FROM used_chunks)')
+        conn.execute('DROP TABLE used_chunks')
+
+        packs = conn.execute('''SELECT p.id, p.size, COALESCE(SUM(c.length), 0)
+                                FROM packs p LEFT JOIN chunks c ON c.pack = p.id
+                                GROUP BY p.id''').fetchall()
+        sparse = [pack for pack, size, live in packs if 0 < live < size * REPACK_BELOW]
+        if sparse:
+            _repack(store_dir, conn, sparse)
+        emptied = [pack for pack, size, live in packs if live == 0] + sparse
+        conn.executemany('DELETE FROM packs WHERE id = ?', [(pack,) for pack in emptied])
+        conn.commit()
+
+        known = {f'{row[0]:08d}.pack' for row in conn.execute('SELECT id FROM packs')}
+        deleted = 0
+        for filename in os.listdir(os.path.join(store_dir, 'packs')):
+            if filename not in known:
+                os.remove(os.path.join(store_dir, 'packs', filename))
+                deleted += 1
+        return removed, deleted
+    finally:
+        conn.close()
+
+def _repack(store_dir, conn, sparse):
+    """Copy the live pages of the sparse packs into one new pack."""
+    pack = conn.execute('INSERT INTO packs DEFAULT VALUES').lastrowid
+    offset = 0
+    moved = []
+    with open(_pack_path(store_dir, pack), 'wb') as pack_file:
+        for old in sparse:
+            with open(_pack_path(store_dir, old), 'rb') as old_file:
+                for chunk, old_offset, length in conn.execute(
+                        'SELECT id, offset, length FROM chunks WHERE pack = ? ORDER BY offset', (old,)).fetchall():
+                    old_file.seek(old_offset)
+                    pack_file.write(old_file.read(length))
+                    moved.append((pack, offset, chunk))
+                    offset += length
+        pack_file.flush()
+        os.fsync(pack_file.fileno())
+    conn.executemany('UPDATE chunks SET pack = ?, offset = ? WHERE id = ?', moved)
+    conn.execute('UPDATE packs SET size = ? WHERE id = ?', (offset, pack))
@@ -0,0 +1,107 @@
+"""
+Deterministic synthetic gym data.
+
+Fills a database created by app.init_db() with athletes of both genders,
+attendance for the last few months and the matching activity_log history.
+The same seed always produces the same rows (relative to `today`).
+"""
+import random
+from datetime import datetime, timedelta
+
+from attendance_summary import rebuild_attendance_daily
+
+FIRST_NAMES = ('علی', 'رضا', 'محمد', 'حسین', 'مهدی', 'امیر', 'سعید', 'حمید',
+               'زهرا', 'مریم', 'فاطمه', 'سارا', 'نگار', 'مینا', 'لیلا', 'الهام')
+LAST_NAMES = ('محمدی', 'رضایی', 'حسینی', 'احمدی', 'کریمی', 'موسوی', 'جعفری',
+              'رحیمی', 'کاظمی', 'قاسمی', 'صادقی', 'نوری', 'یزدانی', 'طاهری')
+# Membership lengths in days and how often members pick them
+DURATIONS = (30, 30, 30, 60, 90, 90, 180, 365)
+
+FIRST_ID = 1000
+
+def generate_athletes(conn, count, rng, today):
+    """Insert `count` athletes; returns [(id, gender, start, end, registered)]."""
+    rows = []
+    memberships = []
+    for offset in range(count):
+        athlete_id = FIRST_ID + offset
+        gender = 'male' if rng.random() < 0.55 else 'female'
+        days = rng.choice(DURATIONS)
+        start = today - timedelta(days=rng.randint(0, 730))
+        registered = start - timedelta(days=rng.randint(0, 3), minutes=rng.randint(0, 1439))
+        birth = datetime(1970, 1, 1) + timedelta(days=rng.randint(0, 38 * 365))
+        rows.append((athlete_id, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), gender,
+                     f'0912{athlete_id:07d}', f'0935{athlete_id:07d}', rng.choice(FIRST_NAMES),
+                     birth.strftime('%Y-%m-%d'), registered.strftime('%Y-%m-%d %H:%M:%S'),
+                     start.strftime('%Y-%m-%d'), days))
+        memberships.append((athlete_id, gender, start, start + timedelta(days=days), registered))
+
+    conn.executemany('''INSERT INTO athletes
+                        (id, first_name, last_name, gender, phone, emergency_phone, father_name,
+                         birth_date, registration_date, start_date, original_days)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    conn.executemany('''INSERT INTO activity_log (timestamp, action, details, athlete_id)
+                        VALUES (?, 'REGISTRATION', ?, ?)''',
+                     [(registered.strftime('%Y-%m-%d %H:%M:%S'),
+                       f"Registered new athlete: {row[1]} {row[2]} (ID: {row[0]}) for {row[10]} days",
+                       row[0])
+                      for row, (_, _, _, _, registered) in zip(rows, memberships)])
+    return memberships
+
+def generate_attendance(conn, memberships, months, rng, today, visit_rate=0.35):
+    """
+    One row per visit for every day of the last `months` months on which the
+    athlete's membership was running; today's visits after the current time
+    are left open (checked in, not out).
+    """
+    first_day = today - timedelta(days=30 * months)
+    attendance = []
+    activity = []
+    for athlete_id, _, start, end, _ in memberships:
+        day = max(first_day, start)
+        last_day = min(today, end)
+        while day <= last_day:
+            if rng.random() < visit_rate:
+                check_in = day + timedelta(hours=rng.randint(6, 21), minutes=rng.randint(0, 59))
+                check_out = check_in + timedelta(minutes=rng.randint(40, 150))
+                check_in_text = check_in.strftime('%Y-%m-%d %H:%M:%S')
+                check_out_text = None if day == today else check_out.strftime('%Y-%m-%d %H:%M:%S')
+                attendance.append((athlete_id, check_in_text, check_out_text, day.strftime('%Y-%m-%d')))
+                activity.append((check_in_text, 'CHECK_IN', f"Athlete {athlete_id} checked in", athlete_id))
+                if check_out_text:
+                    activity.append((check_out_text, 'CHECK_OUT', f"Athlete {athlete_id} checked out", athlete_id))
+            day += timedelta(days=1)
+
+    attendance.sort(key=lambda row: row[1])
+    activity.sort(key=lambda row: row[0])
+    conn.executemany('''INSERT INTO attendance (athlete_id, check_in_time, check_out_time, date)
+                        VALUES (?, ?, ?, ?)''', attendance)
+    conn.executemany('''INSERT INTO activity_log (timestamp, action, details, athlete_id)
+                        VALUES (?, ?, ?, ?)''', activity)
+    return len(attendance)
+
+def generate(conn, athletes=1000, months=3, seed=0, today=None):
+    """
+    Populate an initialised, empty database.
+
+    Args:
+        conn: sqlite3 connection to a database created by app.init_db()
+        athletes (int): Number of athletes across both genders
+        months (int): Months of attendance history
+        seed (int): Random seed
+        today (datetime): Reference date, defaults to today at midnight
+
+    Returns:
+        dict: Row counts per table
+    """
+    rng = random.Random(seed)
+    today = today or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    memberships = generate_athletes(conn, athletes, rng, today)
+    visits = generate_attendance(conn, memberships, months, rng, today)
+    rebuild_attendance_daily(conn)
+    conn.commit()
+    return {
+        'athletes': athletes,
+        'attendance': visits,
+        'activity_log': conn.execute('SELECT COUNT(*) FROM activity_log').fetchone()[0],
+    }
@@ -0,0 +1,48 @@
+"""
+Micro-benchmark for the home dashboard statistics.
+
+Seeds a scratch database with N athletes per size and times
+get_dashboard_stats(), which backs the '/' route.
+
+Usage (from the repository root):
+    python -m benchmarks.home_dashboard
+    python -m benchmarks.home_dashboard 1000 10000
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import generator
+
+SIZES = (1_000, 10_000, 100_000)
+REPEAT = 20
+
+def run(sizes=SIZES):
+    workdir = tempfile.mkdtemp(prefix='gym-bench-')
+    os.chdir(workdir)  # app.py initialises ./database.db on import
+    import app as gym
+
+    print(f"{'athletes':>10} {'mean ms':>10} {'min ms':>10}")
+    for size in sizes:
+        gym.app.config['DATABASE'] = os.path.join(workdir, f'home_{size}.db')
+        gym.init_db()
+        conn = gym.open_db_connection()
+        generator.generate_athletes(conn, size, random.Random(size), datetime.now())
+        conn.commit()
+        conn.close()
+
+        with gym.app.app_context():
+            gym.get_dashboard_stats('male')  # warm the page cache
+            timings = []
+            for _ in range(REPEAT):
+                started = time.perf_counter()
+                gym.get_dashboard_stats('male')
+                timings.append((time.perf_counter() - started) * 1000)
+        print(f'{size:>10} {sum(timings) / len(timings):>10.2f} {min(timings):>10.2f}')
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    run([int(arg) for arg in sys.argv[1:]] or SIZES)
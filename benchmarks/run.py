@@ -0,0 +1,177 @@
+"""
+Timed scenarios against the real Flask routes.
+
+Builds a scratch database with benchmarks.generator, drives the app with
+Flask's test client and prints (or writes) JSON so results can be diffed
+between commits.
+
+Usage (from the repository root):
+    python -m benchmarks.run
+    python -m benchmarks.run --athletes 10000 --months 6 --repeat 20 --output bench.json
+    python -m benchmarks.run --scenario home --scenario history
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import generator
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENDER = 'male'
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def timed(func, repeat):
+    func()  # warm-up, not recorded
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'repeat': repeat,
+        'mean_ms': round(statistics.mean(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'min_ms': round(timings[0], 3),
+    }
+
+def build_scenarios(gym, reminders, client, conn):
+    """Return {name: callable}; each callable performs one request/job."""
+    def get(url):
+        def run():
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+        return run
+
+    active_ids = [row[0] for row in conn.execute(
+        'SELECT id FROM athletes WHERE gender = ? AND end_date >= ? ORDER BY id LIMIT 200',
+        (GENDER, gym.active_end_date_floor()))]
+    sample = conn.execute('SELECT id, last_name FROM athletes WHERE gender = ? ORDER BY id LIMIT 1',
+                          (GENDER,)).fetchone()
+    actions = itertools.cycle(itertools.product(('check_in', 'check_out'), active_ids or [0]))
+
+    def attendance_post():
+        action, athlete_id = next(actions)
+        response = client.post('/attendance', data={'athlete_id': athlete_id, 'action': action})
+        assert response.status_code == 302, response.status_code
+
+    return {
+        'home': get('/'),
+        'athletes': get('/athletes'),
+        'athletes_search_name': get(f'/athletes?search={sample[1]}'),
+        'athletes_search_id': get(f'/athletes?search={sample[0]}'),
+        'attendance_get': get('/attendance'),
+        'attendance_post': attendance_post,
+        'history': get('/history'),
+        'history_search': get(f'/history?search={sample[0]}&action_type=CHECK_IN'),
+        'reminder_birthday': quiet(reminders.get_athletes_with_birthday_today),
+        'reminder_end_date': quiet(reminders.send_reminder_to_ending_period),
+    }
+
+def query_plans(conn, reminders):
+    """EXPLAIN QUERY PLAN of the reminder queries, so a lost index shows up in the diff."""
+    queries = {
+        'reminder_birthday': (reminders.BIRTHDAY_QUERY, (json.dumps(reminders.birthday_month_days()),)),
+        'reminder_end_date': (reminders.END_DATE_QUERY, (datetime.now().strftime('%Y-%m-%d'),)),
+    }
+    return {name: [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+            for name, (query, params) in queries.items()}
+
+def quiet(func):
+    """Keep a job's progress prints out of the JSON on stdout."""
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+    return run
+
+def run(athletes, months, repeat, seed, selected=None):
+    workdir = tempfile.mkdtemp(prefix='gym-bench-')
+    os.chdir(workdir)  # app.py and the reminder job use ./database.db
+    sys.path.insert(0, REPO_ROOT)
+
+    import app as gym
+    import birthday_enddate_reminder as reminders
+    import sms
+    from sms_stub import start_stub_gateway
+
+    gym.app.config.update(TESTING=True, ACTIVITY_LOG_WRITE_BEHIND=False, SMS_DISPATCH=False)
+    gateway = start_stub_gateway()
+    sms.BASE_URL = gateway.base_url
+    reminders.send_to_telegram_bot = lambda msg: None
+
+    conn = gym.open_db_connection()
+    started = time.perf_counter()
+    counts = generator.generate(conn, athletes=athletes, months=months, seed=seed)
+    conn.execute('ANALYZE')
+    generate_seconds = time.perf_counter() - started
+
+    client = gym.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+        session['username'] = 'bench'
+        session['gender'] = GENDER
+
+    plans = query_plans(conn, reminders)
+    scenarios = build_scenarios(gym, reminders, client, conn)
+    results = {}
+    for name, func in scenarios.items():
+        if selected and name not in selected:
+            continue
+        results[name] = timed(func, repeat)
+    gateway.shutdown()
+    conn.close()
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'seed': seed,
+            'months': months,
+            'rows': counts,
+            'generate_seconds': round(generate_seconds, 3),
+            'query_plans': plans,
+        },
+        'scenarios': results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--athletes', type=int, default=1000)
+    parser.add_argument('--months', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', action='append', help='run only this scenario (repeatable)')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    results = run(args.athletes, args.months, args.repeat, args.seed, args.scenario)
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
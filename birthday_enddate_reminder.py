@@ -1,10 +1,12 @@
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import time
 import os
-import shutil
 import threading
-from sms import birthdate_msg, end_date_reminder_msg
+import json
+import jdatetime
+from backup import connect_readonly
+from sms import birthdate_bulk, end_date_reminder_bulk
 from requests import post
 from dotenv import load_dotenv
 
@@ -12,6 +14,23 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 CHAT_ID = os.getenv('CHAT_ID')
+# 'jalali' (members celebrate by the Persian calendar) or 'gregorian'
+BIRTHDAY_CALENDAR = os.getenv('BIRTHDAY_CALENDAR', 'jalali')
+
+# Both queries are answered from an index: (gender, birth_month_day) and
+# (gender, end_date), generated columns created by app.init_db
+BIRTHDAY_QUERY = """
+        SELECT first_name, phone, birth_date 
+        FROM athletes 
+        WHERE gender = 'male' 
+        AND birth_month_day IN (SELECT value FROM json_each(?))
+        """
+END_DATE_QUERY = """
+        SELECT first_name, phone 
+        FROM athletes 
+        WHERE gender = 'male' 
+        AND end_date = ?
+        """
 
 def add(txt):
     try:
@@ -40,66 +59,91 @@ def log(text):
     except Exception as e:
         print(f"Error writing to file: {str(e)}")
 
-def create_database_backup():
+def _birthday_dates(today, calendar):
+    """(month, day) pairs, in calendar, whose birthday is celebrated today."""
+    if calendar == 'jalali':
+        today = jdatetime.date.fromgregorian(date=today)
+        days = [(today.month, today.day)]
+        # Born on 30 Esfand: celebrate on the 29th when the year has no 30th
+        if (today.month, today.day) == (12, 29) and not today.isleap():
+            days.append((12, 30))
+    else:
+        days = [(today.month, today.day)]
+        # Born on 29 February: celebrate on the 28th in common years
+        if (today.month, today.day) == (2, 28) and (date(today.year, 3, 1) - timedelta(days=1)).day == 28:
+            days.append((2, 29))
+    return days
+
+def birthday_month_days(today=None, calendar=None):
     """
-    Create a backup copy of the database before operations.
+    Gregorian 'MM-DD' values (birth_month_day) of athletes whose birthday is today.
+    
+    For Jalali birthdays the Gregorian date of a Jalali day moves by a day
+    or two between years, so this returns every Gregorian month-day that
+    today's Jalali month-day fell on for a birth year in the last 120
+    years; is_birthday() then drops the few rows that matched in a
+    different year.
     """
-    original_db = 'database.db'
-    backup_db = 'database_backup.db'
+    today = today or date.today()
+    calendar = calendar or BIRTHDAY_CALENDAR
+    if calendar != 'jalali':
+        return sorted(f"{month:02d}-{day:02d}" for month, day in _birthday_dates(today, calendar))
     
-    try:
-        # Check if original database exists
-        if os.path.exists(original_db):
-            # Create backup (overwrite if exists)
-            shutil.copy2(original_db, backup_db)
-            add(f"[BD-END] Database backup created: {backup_db}")
-            return backup_db
-        else:
-            add(f"[BD-END] Original database '{original_db}' not found.")
-            return original_db
-    except Exception as e:
-        add(f"[BD-END] [ERROR] Failed to create database backup: {str(e)}")
-        return original_db
+    this_year = jdatetime.date.fromgregorian(date=today).year
+    month_days = set()
+    for month, day in _birthday_dates(today, calendar):
+        for year in range(this_year - 120, this_year + 1):
+            try:
+                month_days.add(jdatetime.date(year, month, day).togregorian().strftime('%m-%d'))
+            except ValueError:
+                # 30 Esfand only exists in leap years
+                continue
+    return sorted(month_days)
+
+def is_birthday(birth_date, today=None, calendar=None):
+    """Whether someone born on birth_date (Gregorian 'YYYY-MM-DD') has a birthday today."""
+    today = today or date.today()
+    calendar = calendar or BIRTHDAY_CALENDAR
+    born = datetime.strptime(birth_date, '%Y-%m-%d').date()
+    if calendar == 'jalali':
+        born = jdatetime.date.fromgregorian(date=born)
+    return (born.month, born.day) in _birthday_dates(today, calendar)
 
 def get_athletes_with_birthday_today():
-    db_path = create_database_backup()
-    
+    conn = None
     try:
-        # Connect to the backup database
-        conn = sqlite3.connect(db_path)
+        # Read the live database; the connection cannot write to it
+        conn = connect_readonly()
         cursor = conn.cursor()
         
-        # Get today's date in MM-DD format (month-day)
-        today = datetime.now().strftime('%m-%d')
-        
-        # Query to retrieve data
-        query = """
-        SELECT first_name, phone 
-        FROM athletes 
-        WHERE gender = 'male' 
-        AND strftime('%m-%d', birth_date) = ?
-        """
+        # Gregorian month-days today's birthdays can be stored under
+        today = date.today()
+        month_days = birthday_month_days(today)
         
         # Execute the query
-        cursor.execute(query, (today,))
+        cursor.execute(BIRTHDAY_QUERY, (json.dumps(month_days),))
         
-        # Fetch results
-        results = cursor.fetchall()
+        # Fetch results, keeping only those born on today's (Jalali) date
+        results = [(name, phone) for name, phone, birth_date in cursor.fetchall()
+                   if is_birthday(birth_date, today)]
         
         # Print results
         if results:
             add("[BD-END] Male athletes with birthday today:")
             add("-" * 40)
-            for row in results:
-                birthdate_msg(name=row[0], number=row[1])
-                add(f"Name: {row[0]}")
-                add(f"Phone: {row[1]}")
+            sent = birthdate_bulk([(phone, name) for name, phone in results])
+            for result in sent:
+                add(f"Name: {result['name']}")
+                add(f"Phone: {result['phone']}")
+                if not result['ok']:
+                    add(f"[ERROR] {result['error']}")
                 add("-" * 20)
         else:
             add("[BD-END] No male athletes found with birthday today.")
             
     except sqlite3.Error as e:
         add(f"[BD-END] Database connection error: {e}")
+        raise
         
     finally:
         # Close connection
@@ -107,40 +151,34 @@ def get_athletes_with_birthday_today():
             conn.close()
 
 def send_reminder_to_ending_period():
-    db_path = create_database_backup()
-    
+    conn = None
     try:
-        # Connect to the backup database
-        conn = sqlite3.connect(db_path)
+        # Read the live database; the connection cannot write to it
+        conn = connect_readonly()
         cursor = conn.cursor()
         
         # Calculate the target date (3 days from now)
         target_date = (datetime.now() + timedelta(days=3)).strftime('%Y-%m-%d')
         
-        # Query to find athletes whose period ends in exactly 3 days
-        query = """
-        SELECT first_name, phone 
-        FROM athletes 
-        WHERE gender = 'male' 
-        AND date(start_date, '+' || original_days || ' days') = ?
-        """
-        
-        # Execute the query
-        cursor.execute(query, (target_date,))
+        # Find athletes whose period ends in exactly 3 days
+        cursor.execute(END_DATE_QUERY, (target_date,))
         
         # Fetch results
         results = cursor.fetchall()
         
-        # Send message to each athlete
-        for row in results:
-            name, phone = row
-            end_date_reminder_msg(name=name, number=phone)
-            print(name+" "+phone)
+        # Send messages in bulk
+        sent = end_date_reminder_bulk([(phone, name) for name, phone in results])
+        for result in sent:
+            print(result['name']+" "+result['phone'])
+        failed = [result for result in sent if not result['ok']]
+        if failed:
+            add(f"[BD-END] [ERROR] {len(failed)} reminders failed: {failed[0]['error']}")
             
-        add(f"[BD-END] Sent reminders to {len(results)} athletes")
+        add(f"[BD-END] Sent reminders to {len(sent) - len(failed)} athletes")
             
     except sqlite3.Error as e:
         add(f"[BD-END] Database connection error: {e}")
+        raise
         
     finally:
         # Close connection
@@ -169,33 +207,16 @@ def send_to_telegram_bot(msg: str) -> None:
     except Exception as e:
         print(f"[ERROR] Failed to send Telegram message: {str(e)}")
 
-def cleanup_backup():
-    """
-    Remove the backup database file after operations.
-    """
-    backup_db = 'database_backup.db'
-    try:
-        if os.path.exists(backup_db):
-            os.remove(backup_db)
-            print(f"[BD-END] Backup database cleaned up: {backup_db}")
-    except Exception as e:
-        print(f"[BD-END] [WARNING] Could not remove backup database: {str(e)}")
-
 def run_scheduler():
     try:
 
         get_athletes_with_birthday_today()
         send_reminder_to_ending_period()
-        cleanup_backup()  # Cleanup after each cycle
-   
         
     except KeyboardInterrupt:
         print("[BD-END] Program interrupted by user")
     except Exception as e:
         print(f"[BD-END] [ERROR] An error occurred: {str(e)}")
-    finally:
-        # Ensure cleanup happens even if there's an error
-        cleanup_backup()
 
 if __name__ == "__main__":
     run_scheduler()
\ No newline at end of file
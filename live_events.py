@@ -0,0 +1,70 @@
+import json
+import queue
+import threading
+
+class EventBroker:
+    """
+    In-process publish/subscribe for Server-Sent Events.
+
+    Every subscriber gets its own bounded queue on a channel (e.g. a
+    gender). publish() never blocks: a subscriber that stops reading and
+    fills its queue is dropped; EventSource reconnects on its own and
+    static/js/attendance.js reloads the page once it has, since the
+    events it missed are gone.
+
+    Args:
+        max_queue (int): Events buffered per subscriber
+        keepalive (float): Seconds between comment lines on an idle stream
+    """
+
+    def __init__(self, max_queue=100, keepalive=15):
+        self.max_queue = max_queue
+        self.keepalive = keepalive
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        with self._lock:
+            subscribers = self._channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._channels[channel]
+
+    def publish(self, channel, event, data):
+        """Send an event to every subscriber of channel."""
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # Too slow: drop the backlog and tell stream() to end
+                self.unsubscribe(channel, subscriber)
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(None)
+
+    def stream(self, channel):
+        """Generator of SSE text for one client; ends when the client goes away."""
+        subscriber = self.subscribe(channel)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = subscriber.get(timeout=self.keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(channel, subscriber)
@@ -0,0 +1,474 @@
+"""
+Resident scheduler for the gym's periodic jobs.
+
+Runs the reminder SMS, database backups, the attendance summary refresh,
+archiving and a sweep of the SMS outbox in one long-lived process, on
+cron-like schedules:
+
+    python scheduler.py              # run until SIGINT/SIGTERM
+    python scheduler.py status       # schedules, next runs, last outcomes
+    python scheduler.py run backup   # run one job now
+
+Each job's schedule is read from SCHEDULE_<JOB> (e.g. SCHEDULE_BACKUP='30 3 * * *',
+or 'off' to disable). The last slot each job ran for is kept in the
+scheduled_jobs table of the main database, so a restart neither repeats a
+run nor forgets one: a slot missed while the scheduler was down is run
+once on start-up if it is still within the job's catch-up window.
+
+A running job holds a lease on its row (owner plus a heartbeat refreshed
+while it runs), so several schedulers may share one database: none starts
+a job another is still running, and only a run whose heartbeat has
+stopped is marked interrupted.
+"""
+import argparse
+import contextlib
+import os
+import random
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+import app as gym
+import backup
+import birthday_enddate_reminder as reminders
+from backup import add, log
+
+SLOT_FORMAT = '%Y-%m-%d %H:%M'
+
+# Longest wait between checks, so edits to the clock or a suspended
+# machine are noticed within a minute
+MAX_SLEEP = 60
+
+# A running job refreshes its heartbeat this often; a heartbeat older than
+# LEASE_TIMEOUT means the process running it is gone
+HEARTBEAT_INTERVAL = 30
+LEASE_TIMEOUT = 300
+
+class CronSchedule:
+    """
+    Five-field cron expression: minute hour day-of-month month day-of-week.
+
+    Fields accept *, numbers, lists (1,15), ranges (1-5) and steps (*/10,
+    8-18/2). Day-of-week is 0-6 from Sunday (7 is Sunday too). As in cron,
+    when both day fields are restricted a day matching either one counts.
+    """
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron expression needs 5 fields, got '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(part, low, high) for part, (low, high) in zip(parts, self.FIELDS))
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for item in field.split(','):
+            spec, _, step = item.partition('/')
+            step = int(step) if step else 1
+            if spec == '*':
+                start, end = low, high
+            elif '-' in spec:
+                start, end = (int(value) for value in spec.split('-', 1))
+            else:
+                start = end = int(spec)
+                if step > 1:
+                    end = high
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"invalid cron field '{field}'")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        in_month = moment.day in self.days
+        in_week = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def previous(self, now):
+        """Latest matching minute at or before now, or None within five years."""
+        moment = now.replace(second=0, microsecond=0)
+        limit = moment - timedelta(days=5 * 366)
+        while moment > limit:
+            if moment.month not in self.months or not self._day_matches(moment):
+                moment = moment.replace(hour=23, minute=59) - timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=59) - timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment -= timedelta(minutes=1)
+            else:
+                return moment
+        return None
+
+    def next(self, now):
+        """Earliest matching minute after now, or None within five years."""
+        moment = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=5 * 366)
+        while moment < limit:
+            if moment.month not in self.months or not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        return None
+
+class Job:
+    """
+    A periodic job.
+
+    Args:
+        name (str): Key in scheduled_jobs and suffix of SCHEDULE_<NAME>
+        func: Callable run in its own thread; raising marks the run failed
+        schedule (str): Default cron expression
+        jitter (int): Up to this many seconds of random delay after a slot
+        catch_up (int): Seconds after a slot it may still run, e.g. after
+            downtime; older slots are recorded as missed
+        once_per_day (bool): Never run twice on one calendar day, even if
+            the schedule has several slots that day
+    """
+
+    def __init__(self, name, func, schedule, jitter=0, catch_up=3600, once_per_day=False):
+        self.name = name
+        self.func = func
+        expression = os.getenv(f"SCHEDULE_{name.upper().replace('-', '_')}", schedule)
+        self.schedule = None if expression.strip().lower() == 'off' else CronSchedule(expression)
+        self.jitter = jitter
+        self.catch_up = timedelta(seconds=catch_up)
+        self.once_per_day = once_per_day
+
+def init_scheduler(conn):
+    """Create the scheduled_jobs table on an open connection."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS scheduled_jobs
+                 (job TEXT PRIMARY KEY,
+                  last_slot TEXT,
+                  status TEXT,
+                  started_at TEXT,
+                  finished_at TEXT,
+                  error TEXT,
+                  owner TEXT,
+                  heartbeat_at TEXT)''')
+    # Migrate tables created before leases existed
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(scheduled_jobs)')]
+    if 'owner' not in columns:
+        conn.execute('ALTER TABLE scheduled_jobs ADD COLUMN owner TEXT')
+        conn.execute('ALTER TABLE scheduled_jobs ADD COLUMN heartbeat_at TEXT')
+    conn.commit()
+
+def process_owner():
+    """Lease owner name for this process."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _timestamp(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def expire_leases(conn, now=None):
+    """
+    Mark runs whose heartbeat stopped (a crash or kill) as interrupted.
+
+    Returns:
+        list: Names of the jobs marked
+    """
+    stale = _timestamp((now or datetime.now()) - timedelta(seconds=LEASE_TIMEOUT))
+    jobs = [row[0] for row in conn.execute('''SELECT job FROM scheduled_jobs
+                                               WHERE status = 'running'
+                                                 AND (heartbeat_at IS NULL OR heartbeat_at < ?)''', (stale,))]
+    for job in jobs:
+        conn.execute("UPDATE scheduled_jobs SET status = 'interrupted' WHERE job = ? AND status = 'running'",
+                     (job,))
+    conn.commit()
+    return jobs
+
+def claim_slot(conn, job, slot, status='running', owner=None):
+    """
+    Record slot as job's latest run, unless it (or, for once_per_day jobs,
+    another slot that day) already ran or a run of the job still holds its
+    lease. The check and the write are one UPDATE, so two scheduler
+    processes can never both claim a slot.
+
+    Returns:
+        bool: Whether this caller claimed the slot
+    """
+    slot = slot.strftime(SLOT_FORMAT)
+    # Slots compare as text; once_per_day jobs compare only the date part
+    earlier = 'date(last_slot) < date(:slot)' if job.once_per_day else 'last_slot < :slot'
+    now = datetime.now()
+    conn.execute('INSERT OR IGNORE INTO scheduled_jobs (job) VALUES (?)', (job.name,))
+    claimed = conn.execute(f'''UPDATE scheduled_jobs
+                               SET last_slot = :slot, status = :status, started_at = :now,
+                                   finished_at = NULL, error = NULL,
+                                   owner = :owner, heartbeat_at = :now
+                               WHERE job = :job AND (last_slot IS NULL OR {earlier})
+                                 AND (status IS NOT 'running' OR heartbeat_at IS NULL
+                                      OR heartbeat_at < :stale)''',
+                           {'slot': slot, 'status': status, 'job': job.name,
+                            'owner': owner or process_owner(), 'now': _timestamp(now),
+                            'stale': _timestamp(now - timedelta(seconds=LEASE_TIMEOUT))}).rowcount
+    conn.commit()
+    return claimed == 1
+
+def finish_run(conn, job, error=None, owner=None):
+    """Record the outcome of owner's run, unless its lease was taken over meanwhile."""
+    conn.execute('''UPDATE scheduled_jobs SET status = ?, finished_at = ?, error = ?
+                    WHERE job = ? AND owner = ?''',
+                 ('failed' if error else 'ok', _timestamp(datetime.now()), error, job.name,
+                  owner or process_owner()))
+    conn.commit()
+
+@contextlib.contextmanager
+def holding_lease(connect, job, owner=None):
+    """Refresh job's heartbeat every HEARTBEAT_INTERVAL seconds while the block runs."""
+    owner = owner or process_owner()
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(HEARTBEAT_INTERVAL):
+            conn = connect()
+            try:
+                conn.execute('''UPDATE scheduled_jobs SET heartbeat_at = ?
+                                WHERE job = ? AND owner = ? AND status = 'running' ''',
+                             (_timestamp(datetime.now()), job.name, owner))
+                conn.commit()
+            except Exception as e:
+                add(f"[SCHEDULER] {job.name}: heartbeat failed: {e}")
+            finally:
+                conn.close()
+
+    thread = threading.Thread(target=beat, name=f'lease-{job.name}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+class Scheduler:
+    """
+    Start each job's due slot in a worker thread.
+
+    A slot is due once its jitter has passed and it is newer than the job's
+    last_slot. A job whose previous run is still going, here or in another
+    process holding its lease, is not started again until that run ends
+    (no overlap); if that takes it past the catch-up window the slot is
+    recorded as missed.
+
+    Args:
+        jobs (list): Job objects
+        connect: Callable returning a new connection to the main database
+        rng: random.Random-like object for jitter
+    """
+
+    def __init__(self, jobs, connect, rng=random):
+        self.jobs = [job for job in jobs if job.schedule is not None]
+        self.connect = connect
+        self.rng = rng
+        self.owner = process_owner()
+        self._delays = {}
+        self._running = {}
+        self._stopping = False
+        # Set to cut the wait in run_forever short: on stop() and when a job ends
+        self._wake = threading.Event()
+        conn = connect()
+        try:
+            init_scheduler(conn)
+        finally:
+            conn.close()
+
+    def _last_slots(self, conn):
+        return dict(conn.execute('SELECT job, last_slot FROM scheduled_jobs').fetchall())
+
+    def tick(self, now=None):
+        """
+        Start every job that is due at now.
+
+        Returns:
+            datetime: When the next check is needed
+        """
+        now = now or datetime.now()
+        wake = now + timedelta(seconds=MAX_SLEEP)
+        conn = self.connect()
+        try:
+            # A run cut short by a crash or kill will not be resumed
+            for name in expire_leases(conn, now):
+                add(f"[SCHEDULER] {name}: previous run was interrupted")
+            last_slots = self._last_slots(conn)
+            for job in self.jobs:
+                slot = job.schedule.previous(now)
+                last = last_slots.get(job.name)
+                if slot is not None and (last is None or slot.strftime(SLOT_FORMAT) > last):
+                    delay = self._delays.setdefault((job.name, slot),
+                                                    timedelta(seconds=self.rng.uniform(0, job.jitter)))
+                    if now - slot > job.catch_up:
+                        if claim_slot(conn, job, slot, status='missed', owner=self.owner):
+                            add(f"[SCHEDULER] {job.name}: missed the run due {slot:%Y-%m-%d %H:%M}")
+                    elif now < slot + delay:
+                        wake = min(wake, slot + delay)
+                    elif job.name not in self._running and claim_slot(conn, job, slot, owner=self.owner):
+                        self._start(job, slot)
+                upcoming = job.schedule.next(now)
+                if upcoming is not None:
+                    wake = min(wake, upcoming)
+        finally:
+            conn.close()
+        self._delays = {key: delay for key, delay in self._delays.items() if key[1] > now - timedelta(days=2)}
+        return wake
+
+    def _start(self, job, slot):
+        thread = threading.Thread(target=self._run, args=(job, slot), name=f'job-{job.name}', daemon=True)
+        self._running[job.name] = thread
+        thread.start()
+
+    def _run(self, job, slot):
+        log(f"[SCHEDULER] {job.name}: started (slot {slot:%Y-%m-%d %H:%M})")
+        error = None
+        try:
+            with holding_lease(self.connect, job, self.owner):
+                job.func()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            add(f"[SCHEDULER] {job.name}: failed: {error}")
+            traceback.print_exc()
+        conn = self.connect()
+        try:
+            finish_run(conn, job, error, self.owner)
+        finally:
+            conn.close()
+            del self._running[job.name]
+            self._wake.set()
+        if error is None:
+            log(f"[SCHEDULER] {job.name}: finished")
+
+    def run_forever(self):
+        """Check for due jobs until stop(); waits for running jobs to finish."""
+        while not self._stopping:
+            wake = self.tick()
+            self._wake.clear()
+            self._wake.wait(max(1, (wake - datetime.now()).total_seconds()))
+        for thread in list(self._running.values()):
+            thread.join()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+def run_reminders():
+    """Send both reminder kinds; if either fails the run is marked failed."""
+    errors = []
+    for send in (reminders.get_athletes_with_birthday_today, reminders.send_reminder_to_ending_period):
+        try:
+            send()
+        except sqlite3.Error as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
+
+def run_backup():
+    if not backup.send_db_backup():
+        raise RuntimeError("backup failed, see applog.txt")
+    backup.cleanup_old_backups()
+
+def run_attendance_summary():
+    """Re-derive yesterday's and today's attendance_daily rows from raw attendance."""
+    with gym.app.app_context():
+        gym.refresh_attendance_daily((datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d'))
+        gym.get_db_connection().execute('PRAGMA optimize')
+
+def run_sms_outbox():
+    """Send outbox messages that are due, in case no web process is draining them."""
+    if not gym.app.config['SMS_DISPATCH']:
+        return
+    sent = gym.sms_dispatcher.drain()
+    if sent:
+        log(f"[SCHEDULER] sms-outbox: attempted {sent} queued messages")
+
+def run_archive():
+    with gym.app.app_context():
+        moved, before = gym.archive_old_data()
+    log(f"[SCHEDULER] archive: moved {moved['activity_log']} activity log and "
+        f"{moved['attendance']} attendance rows older than {before}")
+
+JOBS = [
+    # Reminder SMS go out once a day; a late start still sends them that day
+    Job('reminders', run_reminders, '0 9 * * *', jitter=300, catch_up=12 * 3600, once_per_day=True),
+    Job('backup', run_backup, '30 3 * * *', jitter=600, catch_up=24 * 3600),
+    Job('attendance-summary', run_attendance_summary, '15 0 * * *', jitter=120, catch_up=24 * 3600),
+    # Catches messages queued while no web process was running, e.g. by import-athletes
+    Job('sms-outbox', run_sms_outbox, '*/5 * * * *', catch_up=300),
+    # Friday night, when the gym is closed
+    Job('archive', run_archive, '0 4 * * 5', jitter=900, catch_up=3 * 24 * 3600),
+]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the gym\'s periodic jobs.')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('serve', help='run jobs on schedule until stopped (default)')
+    commands.add_parser('status', help='show schedules and last runs')
+    run = commands.add_parser('run', help='run one job now, outside its schedule')
+    run.add_argument('job', choices=[job.name for job in JOBS])
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        conn = gym.open_db_connection()
+        try:
+            init_scheduler(conn)
+            rows = {row['job']: row for row in conn.execute('SELECT * FROM scheduled_jobs')}
+        finally:
+            conn.close()
+        now = datetime.now()
+        for job in JOBS:
+            row = rows.get(job.name)
+            schedule = job.schedule.expression if job.schedule else 'off'
+            upcoming = job.schedule.next(now) if job.schedule else None
+            print(f"{job.name:20} {schedule:15} next {upcoming:%Y-%m-%d %H:%M}" if upcoming else
+                  f"{job.name:20} {schedule:15} next -", end='')
+            if row is not None and row['last_slot']:
+                print(f"  last {row['last_slot']} {row['status']}" + (f" ({row['error']})" if row['error'] else ''))
+            else:
+                print("  never run")
+        return 0
+
+    if args.command == 'run':
+        job = next(job for job in JOBS if job.name == args.job)
+        conn = gym.open_db_connection()
+        try:
+            init_scheduler(conn)
+            # Counts as this minute's run, so a once-a-day job is not repeated
+            if not claim_slot(conn, job, datetime.now()):
+                print(f"{job.name} already ran today or is running elsewhere")
+                return 1
+            error = None
+            try:
+                with holding_lease(gym.open_db_connection, job):
+                    job.func()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                finish_run(conn, job, error)
+        finally:
+            conn.close()
+        return 0
+
+    scheduler = Scheduler(JOBS, gym.open_db_connection)
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: scheduler.stop())
+    log(f"[SCHEDULER] started: {', '.join(f'{job.name} ({job.schedule.expression})' for job in scheduler.jobs)}")
+    scheduler.run_forever()
+    log("[SCHEDULER] stopped")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
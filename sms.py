@@ -1,8 +1,13 @@
 from requests import get, post
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv, find_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import os
 import requests
+import sqlite3
 import threading
+import time
 from time import sleep
 
 
@@ -11,7 +16,7 @@ load_dotenv(find_dotenv())
 API_KEY = os.getenv('API_KEY')
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 CHAT_ID = os.getenv('CHAT_ID')
-BASE_URL = "https://edge.ippanel.com/v1"  
+BASE_URL = os.getenv('SMS_BASE_URL', "https://edge.ippanel.com/v1")  # point at sms_stub.py for tests
 FROM_NUMBER = "+983000505"
 WELCOME_PATTERN_ID = os.getenv('WELCOME_PATTERN_ID')
 END_DATE_PATTERN_ID = os.getenv('END_DATE_PATTERN_ID')
@@ -56,12 +61,41 @@ def send_to_telegram_bot(message):
     except Exception as e:
         print(f"[ERROR] Failed to send Telegram message: {str(e)}")
 
-def msg_sender(phone_number, name, pattern_code):
+SEND_TIMEOUT = 30
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 30  # seconds before the first retry, doubled after each failure
+# A 'sending' claim older than this belongs to a worker that died mid-send;
+# well above SEND_TIMEOUT so a slow but live send is never taken over
+CLAIM_TIMEOUT = 300
+
+# One keep-alive session for every gateway call
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_maxsize=8))
+_session.mount('http://', HTTPAdapter(pool_maxsize=8))
+
+class SmsError(Exception):
+    """The gateway rejected a message or could not be reached."""
+
+def send_pattern(phone_number, name, pattern_code):
+    """
+    Send one pattern message through the gateway.
+    
+    Args:
+        phone_number (str|list): A phone number, or several that receive
+            the same message in one call
+    
+    Returns:
+        dict: Gateway response
+    
+    Raises:
+        SmsError: On a non-200 response or a connection error
+    """
+    phone_numbers = phone_number if isinstance(phone_number, (list, tuple)) else [phone_number]
     payload = {
         "sending_type": "pattern",
         "from_number": FROM_NUMBER,
         "code" : pattern_code,
-        "recipients": [f"+98{str(phone_number)[1:]}"],
+        "recipients": [f"+98{str(number)[1:]}" for number in phone_numbers],
         "params": {
     "name": name
         }
@@ -74,24 +108,319 @@ def msg_sender(phone_number, name, pattern_code):
     }
     
     try:
-        response = requests.post(
+        response = _session.post(
             f"{BASE_URL}/api/send",
             json=payload,
             headers=headers,
-            timeout=30
+            timeout=SEND_TIMEOUT
         )
+    except requests.exceptions.RequestException as e:
+        raise SmsError(f"Error Connecting to server: {e}")
+    
+    if response.status_code != 200:
+        raise SmsError(f"Error status code: {response.status_code} response: {response.text}")
+    return response.json()
+
+def msg_sender(phone_number, name, pattern_code):
+    try:
+        result = send_pattern(phone_number, name, pattern_code)
+        add("Send successfully for welcome")
+        return result
+    except SmsError as e:
+        add(str(e))
+        return None
+
+# Outbound queue
+def init_outbox(conn):
+    """Create the sms_outbox table on an open connection."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS sms_outbox
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  phone TEXT NOT NULL,
+                  name TEXT NOT NULL,
+                  pattern_code TEXT,
+                  status TEXT NOT NULL DEFAULT 'pending',
+                  attempts INTEGER NOT NULL DEFAULT 0,
+                  next_attempt_at TEXT NOT NULL,
+                  last_error TEXT,
+                  created_at TEXT NOT NULL,
+                  sent_at TEXT,
+                  claimed_at TEXT)''')
+    # Migrate outboxes created before claimed_at existed
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(sms_outbox)')]
+    if 'claimed_at' not in columns:
+        conn.execute('ALTER TABLE sms_outbox ADD COLUMN claimed_at TEXT')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sms_outbox_status_next_attempt 
+        ON sms_outbox(status, next_attempt_at)
+    ''')
+
+def queue_msg(conn, number, name, pattern_code):
+    """
+    Add a message to sms_outbox in the caller's transaction.
+    
+    It is sent by an SmsDispatcher once the transaction commits.
+    """
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute('''INSERT INTO sms_outbox (phone, name, pattern_code, next_attempt_at, created_at)
+                    VALUES (?, ?, ?, ?, ?)''',
+                 (str(number), name, pattern_code, now, now))
+
+def queue_welcome_msg(conn, number, name):
+    queue_msg(conn, number, name, WELCOME_PATTERN_ID)
+
+def queue_welcome_msgs(conn, recipients):
+    """queue_welcome_msg for many (phone, name) pairs with one executemany."""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.executemany('''INSERT INTO sms_outbox (phone, name, pattern_code, next_attempt_at, created_at)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     [(str(number), name, WELCOME_PATTERN_ID, now, now) for number, name in recipients])
+
+def _is_busy(error):
+    """Whether an OperationalError is lock contention worth retrying."""
+    message = str(error)
+    return 'database is locked' in message or 'database is busy' in message
+
+class SmsDispatcher:
+    """
+    Bounded pool of worker threads draining sms_outbox.
+    
+    Each worker claims one due message at a time, sends it with
+    send_pattern and records the outcome: 'sent', or back to 'pending'
+    with exponential backoff, or 'failed' after MAX_ATTEMPTS. A claim
+    ('sending' with claimed_at) older than CLAIM_TIMEOUT is taken over, so
+    a message whose worker died mid-send is retried without disturbing
+    live workers in other processes.
+    
+    Args:
+        connect (callable): Returns a new sqlite3 connection
+        workers (int): Number of sending threads
+        send (callable): send_pattern replacement, e.g. for tests
+        poll_interval (float): Seconds between checks for due retries
+    """
+    
+    def __init__(self, connect, workers=2, send=None, poll_interval=5):
+        self.connect = connect
+        self.workers = workers
+        self.send = send or send_pattern
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+    
+    def start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'sms-worker-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+    
+    def wake(self):
+        """Start the pool if needed and tell idle workers new messages are queued."""
+        self.start()
+        self._wakeup.set()
+    
+    def drain(self):
+        """
+        Send every message that is due now in the calling thread.
+        
+        For processes that do not run the worker pool, e.g. the scheduler
+        picking up messages queued by the import-athletes command.
         
-        if response.status_code == 200:
-            add("Send successfully for welcome")
-            return response.json()
+        Returns:
+            int: Number of messages attempted
+        """
+        conn = self.connect()
+        try:
+            count = 0
+            while not self._stopping.is_set():
+                message = self._claim(conn)
+                if message is None:
+                    break
+                self._deliver(conn, message)
+                count += 1
+            return count
+        finally:
+            conn.close()
+    
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+    
+    def _run(self):
+        conn = self.connect()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    message = self._claim(conn)
+                    if message is None:
+                        self._wakeup.wait(self.poll_interval)
+                        self._wakeup.clear()
+                        continue
+                    self._deliver(conn, message)
+                except sqlite3.Error as e:
+                    # Leave no transaction open, or every later BEGIN fails
+                    conn.rollback()
+                    add(f"SMS worker database error: {e}")
+                    self._stopping.wait(self.poll_interval)
+        finally:
+            conn.close()
+    
+    def _claim(self, conn):
+        now = datetime.now()
+        stale = (now - timedelta(seconds=CLAIM_TIMEOUT)).strftime('%Y-%m-%d %H:%M:%S')
+        now = now.strftime('%Y-%m-%d %H:%M:%S')
+        while True:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                break
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e):
+                    raise
+                if self._stopping.is_set():
+                    return None
+                sleep(0.1)
+        try:
+            # Messages claimed by a worker that died mid-send come first
+            message = conn.execute('''SELECT id, phone, name, pattern_code, attempts FROM sms_outbox
+                                      WHERE status = 'sending' AND (claimed_at IS NULL OR claimed_at < ?)
+                                      ORDER BY claimed_at LIMIT 1''', (stale,)).fetchone()
+            if message is None:
+                message = conn.execute('''SELECT id, phone, name, pattern_code, attempts FROM sms_outbox
+                                          WHERE status = 'pending' AND next_attempt_at <= ?
+                                          ORDER BY next_attempt_at LIMIT 1''', (now,)).fetchone()
+            if message is not None:
+                conn.execute("UPDATE sms_outbox SET status = 'sending', claimed_at = ? WHERE id = ?",
+                             (now, message[0]))
+            conn.commit()
+            return message
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def _deliver(self, conn, message):
+        message_id, phone, name, pattern_code, attempts = message
+        attempts += 1
+        now = datetime.now()
+        try:
+            self.send(phone, name, pattern_code)
+        except Exception as e:
+            if attempts >= MAX_ATTEMPTS:
+                status, next_attempt = 'failed', now
+                add(f"SMS to {phone} failed after {attempts} attempts: {e}")
+            else:
+                status = 'pending'
+                next_attempt = now + timedelta(seconds=RETRY_BACKOFF * 2 ** (attempts - 1))
+            self._record(conn, '''UPDATE sms_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+                                  WHERE id = ?''',
+                         (status, attempts, next_attempt.strftime('%Y-%m-%d %H:%M:%S'), str(e), message_id))
         else:
-            add(f"Error status code: {response.status_code}")
-            add(f"response: {response.text}")
+            self._record(conn, '''UPDATE sms_outbox SET status = 'sent', attempts = ?, sent_at = ?, last_error = NULL
+                                  WHERE id = ?''',
+                         (attempts, now.strftime('%Y-%m-%d %H:%M:%S'), message_id))
+    
+    def _record(self, conn, query, params):
+        """
+        Write a send outcome, retrying while the database is busy.
+        
+        The SMS has already gone out; giving up would leave the message
+        'sending' and it would be sent again once its claim goes stale.
+        """
+        while True:
+            try:
+                conn.execute(query, params)
+                conn.commit()
+                return
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                if not _is_busy(e) or self._stopping.is_set():
+                    raise
+                sleep(0.1)
+
+# Bulk sending
+BULK_WORKERS = 8
+BULK_RATE_LIMIT = 10        # gateway calls per second
+BULK_MAX_RECIPIENTS = 100   # recipients per gateway call
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart, across threads."""
+    
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            sleep(slot - now)
+
+def send_pattern_bulk(recipients, pattern_code, workers=BULK_WORKERS, rate_limit=BULK_RATE_LIMIT):
+    """
+    Send one pattern to many recipients with as few gateway calls as possible.
+    
+    A pattern call carries one set of params for all of its recipients, so
+    recipients sharing a name are grouped into a single call (up to
+    BULK_MAX_RECIPIENTS); the calls then run concurrently on a small pool,
+    rate limited to stay within the provider's limits.
+    
+    Args:
+        recipients (list): (phone, name) tuples
+        pattern_code (str): Gateway pattern code
+    
+    Returns:
+        list: One dict per recipient, in input order:
+            {'phone', 'name', 'ok', 'error'}
+    """
+    groups = {}
+    for phone, name in recipients:
+        groups.setdefault(name, []).append(phone)
+    
+    calls = []
+    for name, phones in groups.items():
+        for start in range(0, len(phones), BULK_MAX_RECIPIENTS):
+            calls.append((name, phones[start:start + BULK_MAX_RECIPIENTS]))
+    
+    limiter = RateLimiter(rate_limit)
+    
+    def send_call(call):
+        name, phones = call
+        limiter.wait()
+        try:
+            send_pattern(phones, name, pattern_code)
             return None
-            
-    except requests.exceptions.RequestException as e:
-        add(f"Error Connecting to server: {e}")
-        return None
+        except SmsError as e:
+            return str(e)
+    
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (name, phones), error in zip(calls, executor.map(send_call, calls)):
+            for phone in phones:
+                outcomes[(phone, name)] = error
+    
+    results = []
+    for phone, name in recipients:
+        error = outcomes[(phone, name)]
+        results.append({'phone': phone, 'name': name, 'ok': error is None, 'error': error})
+    return results
+
+def end_date_reminder_bulk(recipients):
+    return send_pattern_bulk(recipients, END_DATE_PATTERN_ID)
+
+def birthdate_bulk(recipients):
+    return send_pattern_bulk(recipients, BIRTHDATE_PATTERN_ID)
 
 def welcome_msg(number, name):
     msg_sender(number, name, WELCOME_PATTERN_ID)
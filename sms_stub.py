@@ -0,0 +1,63 @@
+"""
+Local stand-in for the SMS gateway, for tests and development.
+
+Accepts the same POST /api/send calls as the real gateway and answers
+200 with a JSON body, optionally after a delay or with a forced error.
+
+Usage:
+    python sms_stub.py [port] [delay_seconds]
+    SMS_BASE_URL=http://127.0.0.1:8025 python app.py
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubGatewayHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        server = self.server
+        server.received.append(payload)
+        if server.delay:
+            time.sleep(server.delay)
+
+        status = server.fail_status or 200
+        body = json.dumps({'status': 'OK' if status == 200 else 'ERROR',
+                           'data': {'message_outbox_ids': [len(server.received)]}}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_gateway(port=0, delay=0, fail_status=None):
+    """
+    Serve the stub in a background thread.
+
+    Returns:
+        ThreadingHTTPServer: Call .shutdown() when done. Its base_url
+            attribute is the value for SMS_BASE_URL and .received
+            lists the payloads it got.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubGatewayHandler)
+    server.delay = delay
+    server.fail_status = fail_status
+    server.received = []
+    server.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8025
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubGatewayHandler)
+    server.delay = delay
+    server.fail_status = None
+    server.received = []
+    print(f"Stub SMS gateway on http://127.0.0.1:{port}")
+    server.serve_forever()
@@ -88,6 +88,72 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // Live updates for today's board
+    const liveTable = document.querySelector('.attendance-table-container[data-live-url]');
+    if (liveTable && window.EventSource) {
+        const events = new EventSource(liveTable.dataset.liveUrl);
+        events.addEventListener('check_in', e => applyCheckIn(JSON.parse(e.data)));
+        events.addEventListener('check_out', e => applyCheckOut(JSON.parse(e.data)));
+
+        // Events sent while the connection was down are lost, so once it
+        // is back reload the page to pick up the current board
+        let disconnected = false;
+        events.addEventListener('error', () => {
+            disconnected = true;
+            if (events.readyState === EventSource.CLOSED) {
+                // The browser gave up (e.g. the server answered an error); retry ourselves
+                setTimeout(() => window.location.reload(), 5000);
+            }
+        });
+        events.addEventListener('open', () => {
+            if (disconnected) {
+                window.location.reload();
+            }
+        });
+    }
+
+    function adjustStat(key, delta) {
+        const stat = document.getElementById(`stat-${key}`);
+        if (stat) {
+            stat.textContent = Math.max(0, parseInt(stat.textContent, 10) + delta);
+        }
+    }
+
+    function applyCheckIn(event) {
+        if (event.first_visit) {
+            adjustStat('present', 1);
+            adjustStat('absent', -1);
+        }
+        adjustStat('active', 1);
+
+        const row = liveTable.querySelector(`tr[data-athlete-id="${event.athlete_id}"]`);
+        if (!row) return;  // filtered out by the search box
+        row.classList.add('active-session');
+        row.querySelector('.check-in-cell').textContent = event.check_in;
+        row.querySelector('.check-out-cell').innerHTML = '<span class="active-badge">Active</span>';
+        row.querySelector('.duration-cell').innerHTML = '';
+        row.querySelector('.status-cell').innerHTML = `
+            <span class="status-badge in-progress">
+                <i class="fas fa-running"></i> In Progress
+            </span>`;
+    }
+
+    function applyCheckOut(event) {
+        adjustStat('active', -1);
+
+        const row = liveTable.querySelector(`tr[data-athlete-id="${event.athlete_id}"]`);
+        if (!row) return;
+        row.classList.remove('active-session');
+        row.querySelector('.check-in-cell').textContent = event.check_in;
+        row.querySelector('.check-out-cell').textContent = event.check_out;
+        row.querySelector('.duration-cell').innerHTML =
+            `<span class="duration-badge">${event.duration}</span>`;
+        row.querySelector('.status-cell').innerHTML = `
+            <span class="status-badge completed">
+                <i class="fas fa-check-circle"></i> Present
+            </span>`;
+    }
+
     // Initialize any other UI components
     initCustomSelect();
     
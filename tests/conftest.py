@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# app.py creates its database on import; keep that out of the working tree
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(prefix='gym-test-'), 'database.db'))
+
+import app as gym  # noqa: E402
+
+@pytest.fixture
+def app(tmp_path):
+    gym.app.config.update(TESTING=True,
+                          DATABASE=str(tmp_path / 'database.db'),
+                          ARCHIVE_DIR=str(tmp_path / 'archive'),
+                          ACTIVITY_LOG_WRITE_BEHIND=False,
+                          SMS_DISPATCH=False)
+    gym.init_db()
+    yield gym.app
+
+@pytest.fixture
+def conn(app):
+    conn = gym.open_db_connection()
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+        session['username'] = 'test'
+        session['gender'] = 'male'
+    return client
+
+def add_athlete(conn, athlete_id, first_name='Ali', last_name='Rezaei', gender='male',
+                start_date='2026-01-01', days=30):
+    conn.execute('''INSERT INTO athletes (id, first_name, last_name, gender, phone, registration_date,
+                                          start_date, original_days)
+                    VALUES (?, ?, ?, ?, '09120000000', ?, ?, ?)''',
+                 (athlete_id, first_name, last_name, gender, start_date + ' 10:00:00', start_date, days))
@@ -0,0 +1,50 @@
+import sqlite3
+
+import app as gym
+from activity_log import ActivityLogWriter
+from conftest import add_athlete
+
+def activity_actions(conn):
+    return [row['action'] for row in conn.execute('SELECT action FROM activity_log ORDER BY id')]
+
+def test_write_behind_logs_only_committed_actions(app, conn, client, monkeypatch):
+    app.config['ACTIVITY_LOG_WRITE_BEHIND'] = True
+    add_athlete(conn, 1001, start_date='2026-10-01')
+    add_athlete(conn, 1002, start_date='2026-10-01')
+    conn.commit()
+
+    response = client.post('/api/attendance', json={'action': 'check_in', 'athlete_id': 1001})
+    assert response.status_code == 200
+
+    def busy(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(gym, 'record_checkout', busy)
+    # The batch checks 1002 in (and logs it) before the check-out fails
+    response = client.post('/api/attendance/batch', json={'items': [
+        {'action': 'check_in', 'athlete_id': 1002},
+        {'action': 'check_out', 'athlete_id': 1001},
+    ]})
+    assert response.status_code == 503
+
+    gym.activity_writer.flush()
+    assert activity_actions(conn) == ['CHECK_IN']
+    assert conn.execute('SELECT COUNT(*) FROM attendance').fetchone()[0] == 1
+
+def test_writer_retries_failed_batch(app, conn):
+    attempts = []
+
+    class FlakyConnection(sqlite3.Connection):
+        def executemany(self, sql, rows):
+            attempts.append(len(rows))
+            if len(attempts) == 1:
+                raise sqlite3.OperationalError('database is locked')
+            return super().executemany(sql, rows)
+
+    writer = ActivityLogWriter(lambda: sqlite3.connect(app.config['DATABASE'], factory=FlakyConnection),
+                               retry_delay=0.01)
+    writer.submit(('2026-10-18 10:00:00', 'LOGIN', 'User test logged in', None))
+    writer.submit(('2026-10-18 10:00:01', 'LOGIN', 'User test logged in', None))
+    writer.close()
+
+    assert attempts == [2, 2]
+    assert activity_actions(conn) == ['LOGIN', 'LOGIN']
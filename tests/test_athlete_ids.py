@@ -0,0 +1,85 @@
+import random
+import sqlite3
+import threading
+
+import app as gym
+import athlete_ids
+from athlete_ids import allocate_athlete_ids, init_athlete_ids
+from conftest import add_athlete
+
+def memory_db():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE athletes (id INTEGER PRIMARY KEY)')
+    init_athlete_ids(conn)
+    conn.commit()
+    return conn
+
+def test_ids_are_unique_and_skip_taken_ones():
+    conn = memory_db()
+    conn.executemany('INSERT INTO athletes (id) VALUES (?)', [(1000,), (1234,)])
+    ids = allocate_athlete_ids(conn, 500, rng=random.Random(1))
+    ids += [allocate_athlete_ids(conn)[0] for _ in range(500)]
+    assert len(set(ids)) == 1000
+    assert all(1000 <= athlete_id <= 9999 for athlete_id in ids)
+    assert 1000 not in ids and 1234 not in ids
+
+def test_refill_widens_only_after_four_digits_run_out(monkeypatch):
+    monkeypatch.setattr(athlete_ids, 'BLOCK_SIZE', 2000)
+    conn = memory_db()
+    ids = allocate_athlete_ids(conn, 9000, rng=random.Random(2))
+    assert sorted(ids) == list(range(1000, 10000))
+    wider = allocate_athlete_ids(conn, 3)
+    assert all(10000 <= athlete_id < 12000 for athlete_id in wider)
+
+def test_pooled_id_taken_by_explicit_insert_is_not_issued():
+    conn = memory_db()
+    first = allocate_athlete_ids(conn, 1, rng=random.Random(3))[0]
+    conn.rollback()  # returns it to the pool
+    conn.execute('INSERT INTO athletes (id) VALUES (?)', (first,))
+    assert allocate_athlete_ids(conn)[0] != first
+    assert conn.execute('SELECT COUNT(*) FROM athlete_id_pool WHERE id = ?', (first,)).fetchone()[0] == 0
+
+def test_concurrent_allocations_never_collide(app):
+    results, errors = [], []
+
+    def register(count):
+        conn = gym.open_db_connection()
+        try:
+            for _ in range(count):
+                conn.execute('BEGIN IMMEDIATE')
+                athlete_id = allocate_athlete_ids(conn)[0]
+                add_athlete(conn, athlete_id)
+                conn.commit()
+                results.append(athlete_id)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=register, args=(25,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(set(results)) == 100
+
+def test_register_skips_taken_ids_and_reports_card_conflicts(conn, client):
+    # The pool's next ID is taken by an athlete inserted with an explicit id
+    taken = allocate_athlete_ids(conn)[0]
+    conn.execute('INSERT INTO athlete_id_pool (slot, id) VALUES (0, ?)', (taken,))
+    add_athlete(conn, taken, first_name='Explicit')
+    add_athlete(conn, 4321 if taken != 4321 else 4322, first_name='Card')
+    conn.execute("UPDATE athletes SET card_code = 'C-1' WHERE first_name = 'Card'")
+    conn.commit()
+
+    form = {'first_name': 'Sara', 'last_name': 'Ahmadi', 'phone': '09120000000',
+            'days': '30', 'start_date': '1405/07/01', 'birth_date': '1380/01/01'}
+    response = client.post('/register', data=dict(form, card_code='C-1'), follow_redirects=True)
+    assert 'already assigned' in response.get_data(as_text=True)
+    assert conn.execute("SELECT COUNT(*) FROM athletes WHERE first_name = 'Sara'").fetchone()[0] == 0
+
+    response = client.post('/register', data=form, follow_redirects=True)
+    assert response.status_code == 200
+    row = conn.execute("SELECT id FROM athletes WHERE first_name = 'Sara'").fetchone()
+    assert row is not None and row[0] != taken
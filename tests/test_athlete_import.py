@@ -0,0 +1,81 @@
+import io
+
+import app as gym
+from athlete_import import parse_athletes_csv
+from conftest import add_athlete
+
+HEADER = 'first_name,last_name,phone,days,birth_date,start_date,card_code\n'
+
+def parse(rows, taken=()):
+    return parse_athletes_csv(io.StringIO(HEADER + rows), today='2026-10-18', taken_card_codes=taken)
+
+def upload(client, text):
+    data = {'file': (io.BytesIO(text.encode('utf-8')), 'athletes.csv')}
+    return client.post('/athletes/import', data=data, content_type='multipart/form-data')
+
+def count(conn, table):
+    return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+def test_persian_digits_and_jalali_dates():
+    athletes, errors = parse('علی,رضایی,۰۹۱۲-۳۴۵ ۶۷۸۹,۳۰,۱۳۸۰/۰۱/۰۱,1405-07-26,\n'
+                             'Sara,Ahmadi,09121111111,90,,,C-2\n')
+    assert errors == []
+    assert athletes[0]['phone'] == '09123456789'
+    assert athletes[0]['original_days'] == 30
+    assert athletes[0]['birth_date'] == '2001-03-21'
+    assert athletes[0]['start_date'] == '2026-10-18'
+    assert athletes[0]['card_code'] is None
+    assert athletes[1]['birth_date'] is None
+    assert athletes[1]['start_date'] == '2026-10-18'
+    assert athletes[1]['card_code'] == 'C-2'
+
+def test_invalid_values_are_reported_by_line():
+    athletes, errors = parse('Ali,Rezaei,0912abc,30,,,\n'
+                             'Ali,Rezaei,09120000000,-3,,,\n'
+                             'Ali,Rezaei,09120000000,30,1404/13/01,,\n'
+                             ',Rezaei,09120000000,30,,,\n')
+    assert [line for line, message in errors] == [2, 3, 4, 5]
+    assert 'Jalali' in errors[2][1] and 'first_name' in errors[3][1]
+    _, errors = parse_athletes_csv(io.StringIO('first_name,phone\nAli,0912\n'))
+    assert errors == [(1, 'missing column(s): last_name, days')]
+
+def test_duplicate_card_codes():
+    _, errors = parse('Ali,Rezaei,09120000000,30,,,C-1\n'
+                      'Reza,Karimi,09120000001,30,,,C-1\n')
+    assert errors == [(3, "card code 'C-1' is already in use")]
+    _, errors = parse('Ali,Rezaei,09120000000,30,,,C-9\n', taken={'C-9'})
+    assert errors == [(2, "card code 'C-9' is already in use")]
+
+def test_bad_row_rejects_whole_file(conn, client):
+    add_athlete(conn, 1001)
+    conn.execute("UPDATE athletes SET card_code = 'C-1' WHERE id = 1001")
+    conn.commit()
+    response = upload(client, HEADER + 'Sara,Ahmadi,09121111111,30,,,\n'
+                                       'Reza,Karimi,09120000001,30,,,C-1\n')
+    assert response.status_code == 200
+    assert "card code &#39;C-1&#39; is already in use" in response.get_data(as_text=True)
+    assert count(conn, 'athletes') == 1
+    assert count(conn, 'sms_outbox') == 0
+
+def test_import_writes_athletes_and_queues_welcome_messages(conn, client):
+    response = upload(client, HEADER + 'Sara,Ahmadi,09121111111,30,1380/01/01,1405/07/01,C-1\n'
+                                       'Reza,Karimi,۰۹۱۲۰۰۰۰۰۰۱,60,,,\n')
+    assert response.status_code == 302
+    # IDs come from a shuffled pool, so rows are matched by name rather than order
+    rows = {row['first_name']: tuple(row) for row in conn.execute(
+        'SELECT first_name, phone, gender, start_date, original_days, card_code FROM athletes')}
+    assert rows['Sara'] == ('Sara', '09121111111', 'male', '2026-09-23', 30, 'C-1')
+    assert rows['Reza'][:3] == ('Reza', '09120000001', 'male')
+    assert rows['Reza'][4:] == (60, None)
+    outbox = conn.execute('SELECT phone, name, status FROM sms_outbox ORDER BY id').fetchall()
+    assert [tuple(row) for row in outbox] == [
+        ('09121111111', 'Sara', 'pending'), ('09120000001', 'Reza', 'pending')]
+    assert count(conn, 'activity_log') == 2
+
+def test_import_athletes_uses_callers_transaction(conn):
+    athletes, _ = parse('Sara,Ahmadi,09121111111,30,,,\n')
+    ids = gym.import_athletes(conn, athletes, 'female')
+    conn.rollback()
+    assert len(ids) == 1
+    assert count(conn, 'athletes') == 0
+    assert count(conn, 'sms_outbox') == 0
@@ -0,0 +1,20 @@
+import app as gym
+from conftest import add_athlete
+
+# base64 of '[{},1]': the right length, but an object as a key value
+BAD_CURSOR = 'W3t9LDFd'
+
+def test_decode_cursor_rejects_unbindable_values():
+    assert gym.decode_cursor(gym.encode_cursor(['2026-01-01', 1001]), 2) == ['2026-01-01', 1001]
+    assert gym.decode_cursor(gym.encode_cursor([None, 1.5]), 2) == [None, 1.5]
+    assert gym.decode_cursor(BAD_CURSOR, 2) is None
+    assert gym.decode_cursor(gym.encode_cursor([['a'], 1]), 2) is None
+    assert gym.decode_cursor('not a cursor', 2) is None
+
+def test_athletes_page_ignores_bad_cursor(conn, client):
+    add_athlete(conn, 1001)
+    conn.commit()
+    for param in ('after', 'before'):
+        response = client.get(f'/athletes?{param}={BAD_CURSOR}')
+        assert response.status_code == 200
+        assert 'Rezaei' in response.get_data(as_text=True)
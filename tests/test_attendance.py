@@ -0,0 +1,43 @@
+import app as gym
+from conftest import add_athlete
+
+def add_visit(conn, athlete_id, date, check_in='10:00:00', check_out='11:30:00'):
+    conn.execute('INSERT INTO attendance (athlete_id, check_in_time, check_out_time, date) VALUES (?, ?, ?, ?)',
+                 (athlete_id, f'{date} {check_in}', f'{date} {check_out}', date))
+
+def test_past_day_reads_stats_from_summary_and_rows_on_request(app, conn, client, monkeypatch):
+    add_athlete(conn, 1001, first_name='Ali', start_date='2026-10-01')
+    add_athlete(conn, 1002, first_name='Reza', start_date='2026-10-01')
+    add_visit(conn, 1001, '2026-10-10')
+    conn.commit()
+    with app.app_context():
+        gym.refresh_attendance_daily()
+
+    snapshot = gym.get_attendance_snapshot
+    calls = []
+    monkeypatch.setattr(gym, 'get_attendance_snapshot', lambda *args: calls.append(args) or snapshot(*args))
+
+    page = client.get('/attendance?date=2026-10-10').get_data(as_text=True)
+    assert calls == []
+    assert 'id="stat-present">1<' in page and 'id="stat-absent">1<' in page
+    assert 'records=1' in page
+    assert '(ID: 1002)' in page  # the check-in form still lists active athletes
+
+    page = client.get('/attendance?date=2026-10-10&records=1').get_data(as_text=True)
+    assert len(calls) == 1
+    assert '2026-10-10 10:00:00' in page
+    assert 'id="stat-present">1<' in page
+
+def test_malformed_dates_are_rejected(client):
+    for url in ('/history?from=1abc', '/history?to=1404/13/01', '/export/history.csv?from=1abc',
+                '/export/attendance.csv?from=1abc', '/attendance?date=1abc'):
+        assert client.get(url).status_code == 400, url
+
+def test_attendance_export_takes_jalali_dates(conn, client):
+    add_athlete(conn, 1001, start_date='2026-10-01')
+    add_visit(conn, 1001, '2026-10-10')
+    add_visit(conn, 1001, '2026-10-11')
+    conn.commit()
+    # 1405/07/18 is 2026-10-10
+    body = client.get('/export/attendance.csv?from=1405/07/18&to=1405/07/18').get_data(as_text=True)
+    assert '1405/07/18' in body and '1405/07/19' not in body
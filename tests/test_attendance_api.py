@@ -0,0 +1,81 @@
+import app as gym
+from conftest import add_athlete
+
+def setup_athletes(conn):
+    add_athlete(conn, 1001, first_name='Ali', start_date='2026-10-01')
+    add_athlete(conn, 1002, first_name='Reza', start_date='2026-10-01')
+    add_athlete(conn, 2001, first_name='Sara', gender='female', start_date='2026-10-01')
+    conn.execute("UPDATE athletes SET card_code = 'CARD-1' WHERE id = 1001")
+    conn.execute("UPDATE athletes SET card_code = 'CARD-F' WHERE id = 2001")
+    conn.commit()
+
+def post(client, **body):
+    response = client.post('/api/attendance', json=body)
+    return response.status_code, response.get_json()
+
+def test_check_in_and_out_by_card(conn, client):
+    setup_athletes(conn)
+    status, body = post(client, action='check_in', card_code='CARD-1')
+    assert status == 200 and body['ok'] and body['athlete_id'] == 1001 and body['first_visit']
+    status, body = post(client, action='check_out', card_code='CARD-1')
+    assert status == 200 and body['ok'] and 'duration' in body
+
+def test_error_contract(conn, client):
+    setup_athletes(conn)
+    # Unknown card, and an athlete of the other gender, are not found
+    assert post(client, action='check_in', card_code='NO-SUCH-CARD') == \
+        (404, {'ok': False, 'error': 'Athlete not found or inactive!'})
+    assert post(client, action='check_in', card_code='CARD-F')[0] == 404
+    assert post(client, action='check_in', athlete_id=2001)[0] == 404
+    # Double check-in and check-out without an open session conflict
+    assert post(client, action='check_in', athlete_id=1002)[0] == 200
+    status, body = post(client, action='check_in', athlete_id=1002)
+    assert status == 409 and body == {'ok': False, 'error': 'Athlete is already checked in today!'}
+    status, body = post(client, action='check_out', athlete_id=1001)
+    assert status == 409 and body['error'] == 'No active check-in found for this athlete today!'
+    # Malformed requests
+    assert post(client, action='check_in')[0] == 400
+    assert post(client, action='check_in', athlete_id=1001, card_code='CARD-1')[0] == 400
+    assert post(client, action='jump', athlete_id=1001)[0] == 400
+    assert client.post('/api/attendance', data='not json').status_code == 400
+    assert conn.execute('SELECT COUNT(*) FROM attendance').fetchone()[0] == 1
+
+def test_requires_login(app):
+    response = app.test_client().post('/api/attendance', json={'action': 'check_in', 'athlete_id': 1})
+    assert response.status_code == 401 and response.get_json()['ok'] is False
+
+def test_batch_with_mixed_items(conn, client):
+    setup_athletes(conn)
+    response = client.post('/api/attendance/batch', json={'action': 'check_in', 'items': [
+        {'athlete_id': 1001},
+        {'card_code': 'NO-SUCH-CARD'},
+        {'athlete_id': 1001},
+        {'athlete_id': 1002, 'action': 'check_out'},
+        'not an object',
+        {'card_code': 'CARD-F'},
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['ok'] is False
+    assert [(result['ok'], result.get('status')) for result in body['results']] == [
+        (True, None), (False, 404), (False, 409), (False, 409), (False, 400), (False, 404)]
+    assert body['results'][0]['athlete_id'] == 1001
+    # The good item is committed
+    assert [row[0] for row in conn.execute('SELECT athlete_id FROM attendance')] == [1001]
+
+def test_batch_rejects_bad_envelopes(client):
+    assert client.post('/api/attendance/batch', json={'items': []}).status_code == 400
+    assert client.post('/api/attendance/batch', json=[1, 2]).status_code == 400
+    items = [{'athlete_id': 1}] * (gym.ATTENDANCE_BATCH_LIMIT + 1)
+    assert client.post('/api/attendance/batch', json={'items': items}).status_code == 400
+
+def test_edit_reports_card_conflict_only_for_card_codes(conn, client):
+    setup_athletes(conn)
+    form = {'first_name': 'Reza', 'last_name': 'Rezaei', 'phone': '09120000000',
+            'birth_date': '1380/01/01', 'card_code': 'CARD-1'}
+    response = client.post('/athlete/1002/edit', data=form)
+    assert response.status_code == 302 and response.location.endswith('/athlete/1002/edit')
+    with client.session_transaction() as session:
+        assert session['_flashes'] == [
+            ('danger', 'This membership card is already assigned to another athlete!')]
+    assert conn.execute('SELECT card_code FROM athletes WHERE id = 1002').fetchone()[0] is None
@@ -0,0 +1,99 @@
+import datetime
+import gzip
+import os
+import shutil
+import sqlite3
+
+import backup
+import backup_store
+
+def make_database(path, rows=2000):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE visits (id INTEGER PRIMARY KEY, note TEXT)')
+    conn.executemany('INSERT INTO visits (note) VALUES (?)', [(f'visit {n} ' * 5,) for n in range(rows)])
+    conn.commit()
+    conn.close()
+
+def test_delta_rebuilds_snapshot_from_full_copy(tmp_path):
+    store = str(tmp_path / 'store')
+    db = str(tmp_path / 'gym.db')
+    make_database(db)
+    base = backup_store.write_snapshot(store, db, datetime.datetime(2026, 10, 1, 3, 30))
+    backup_store.mark_full_sent(store, base['name'])
+    shutil.copy(db, tmp_path / 'full.db')
+
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE visits SET note = 'changed' WHERE id = 5")
+    conn.executemany('INSERT INTO visits (note) VALUES (?)', [('new',)] * 50)
+    conn.commit()
+    conn.close()
+    target = backup_store.write_snapshot(store, db, datetime.datetime(2026, 10, 2, 3, 30))
+
+    delta = str(tmp_path / 'delta.db')
+    pages = backup_store.export_delta(store, base['name'], target['name'], delta)
+    assert 0 < pages < target['pages'] // 4
+
+    rebuilt = str(tmp_path / 'rebuilt.db')
+    assert backup_store.apply_delta(str(tmp_path / 'full.db'), delta, rebuilt) == target['name']
+    with open(rebuilt, 'rb') as left, open(db, 'rb') as right:
+        assert left.read() == right.read()
+
+    # Retention never drops the base later deltas are made against
+    removed, _ = backup_store.apply_retention(store, daily=1, weekly=0, monthly=0)
+    assert removed == []
+
+def test_send_db_backup_mails_full_copy_then_changes(tmp_path, monkeypatch):
+    db = str(tmp_path / 'gym.db')
+    make_database(db)
+    monkeypatch.chdir(tmp_path)  # add() appends to ./applog.txt
+    monkeypatch.setattr(backup, 'DB_PATH', db)
+    monkeypatch.setattr(backup, 'BACKUP_DIR', str(tmp_path / 'backups'))
+    monkeypatch.setattr(backup, 'BACKUP_STORE', str(tmp_path / 'backups' / 'store'))
+    monkeypatch.setattr(backup, 'send_to_telegram_bot', lambda message: None)
+    sent = []
+
+    def send_backup_email(path, recipients, description=''):
+        sent.append((os.path.basename(path), os.path.getsize(path)))
+        if path.endswith('.gz'):
+            with gzip.open(path) as src, open(tmp_path / 'full.db', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            shutil.copy(path, tmp_path / 'delta.db')
+    monkeypatch.setattr(backup, 'send_backup_email', send_backup_email)
+
+    assert backup.send_db_backup()
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE visits SET note = 'changed' WHERE id = 5")
+    conn.commit()
+    conn.close()
+    assert backup.send_db_backup()
+
+    assert sent[0][0].endswith('.db.gz') and sent[1][0].endswith('.delta.db')
+    assert backup.main(['apply-delta', str(tmp_path / 'full.db'), str(tmp_path / 'delta.db'),
+                        str(tmp_path / 'rebuilt.db')]) == 0
+    rebuilt = sqlite3.connect(str(tmp_path / 'rebuilt.db'))
+    assert rebuilt.execute('SELECT note FROM visits WHERE id = 5').fetchone()[0] == 'changed'
+    rebuilt.close()
+
+def test_snapshots_in_the_same_second_get_distinct_names(tmp_path):
+    store = str(tmp_path / 'store')
+    db = str(tmp_path / 'gym.db')
+    make_database(db)
+    now = datetime.datetime(2026, 10, 18, 3, 30)
+    first = backup_store.write_snapshot(store, db, now)
+    second = backup_store.write_snapshot(store, db, now)
+    third = backup_store.write_snapshot(store, db, now)
+    later = backup_store.write_snapshot(store, db, now + datetime.timedelta(seconds=1))
+
+    assert [first['name'], second['name'], third['name']] == \
+        ['20261018-033000', '20261018-033000.1', '20261018-033000.2']
+    names = [row[0] for row in backup_store.list_snapshots(store)]
+    assert names == [first['name'], second['name'], third['name'], later['name']]
+    backup_store.verify_snapshot(store, second['name'])
+    # Every pack file is known to the index
+    conn = backup_store.open_store(store)
+    known = {f'{row[0]:08d}.pack' for row in conn.execute('SELECT id FROM packs')}
+    conn.close()
+    assert set(os.listdir(os.path.join(store, 'packs'))) == known
+    removed, _ = backup_store.apply_retention(store, daily=1, weekly=0, monthly=0)
+    assert removed == names[:3]
@@ -0,0 +1,102 @@
+import email
+import gzip
+import os
+import socketserver
+import threading
+
+import pytest
+
+import backup
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Minimal SMTP server recording each session's envelope and raw DATA."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SmtpSession)
+        self.sessions = []
+
+class SmtpSession(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        session = {'recipients': [], 'messages': []}
+        self.server.sessions.append(session)
+        self.reply('220 sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.reply('250 sink')
+            elif command == b'RCPT':
+                session['recipients'].append(line.split(b':', 1)[1].strip(b' <>\r\n').decode())
+                self.reply('250 ok')
+            elif command == b'DATA':
+                self.reply('354 go ahead')
+                raw = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line == b'.\r\n':
+                        break
+                    raw.append(data_line)
+                session['messages'].append(b''.join(raw))
+                self.reply('250 queued')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+def unstuff(raw):
+    return b''.join(line[1:] if line.startswith(b'..') else line for line in raw.splitlines(keepends=True))
+
+@pytest.fixture
+def sink(monkeypatch):
+    server = SmtpSink()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(backup, 'SMTP_SERVER', '127.0.0.1')
+    monkeypatch.setattr(backup, 'SMTP_PORT', server.server_address[1])
+    monkeypatch.setattr(backup, 'SMTP_STARTTLS', False)
+    monkeypatch.setattr(backup, 'EMAIL_PASS', None)
+    monkeypatch.setattr(backup, 'EMAIL_USER', 'gym@example.com')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_backup_email_streams_parts_to_all_recipients_in_one_session(sink, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, 'ATTACHMENT_PART_SIZE', 20000)
+    attachment = str(tmp_path / 'database_backup.db.gz')
+    with gzip.open(attachment, 'wb') as file:
+        file.write(os.urandom(30000) + b'x' * 20000)
+    with open(attachment, 'rb') as file:
+        original = file.read()
+    assert len(original) > 20000
+
+    delivered = backup.send_backup_email(attachment, ['a@example.com', '', 'b@example.com'],
+                                         'Full backup\n.line starting with a dot')
+
+    assert delivered == ['a@example.com', 'b@example.com']
+    assert len(sink.sessions) == 1
+    session = sink.sessions[0]
+    parts = -(-len(original) // 20000)
+    assert len(session['messages']) == parts > 1
+    assert session['recipients'] == ['a@example.com', 'b@example.com'] * parts
+
+    pieces = []
+    for number, raw in enumerate(session['messages'], 1):
+        # The dot line went over the wire stuffed and comes back intact
+        assert b'\r\n..line starting with a dot\r\n' in raw
+        message = email.message_from_bytes(unstuff(raw))
+        assert f'part {number} of {parts}' in message['Subject']
+        text, attached = message.get_payload()
+        assert '.line starting with a dot' in text.get_payload()
+        assert attached.get_filename() == f'database_backup.db.gz.{number:03d}'
+        data = attached.get_payload(decode=True)
+        assert len(data) <= 20000
+        pieces.append(data)
+    assert b''.join(pieces) == original
@@ -0,0 +1,56 @@
+import csv
+import io
+from datetime import datetime
+
+import app as gym
+from conftest import add_athlete
+
+def add_activity(conn, timestamp, athlete_id, action='CHECK_IN'):
+    conn.execute(gym.INSERT_ACTIVITY, (timestamp, action, f'Athlete {athlete_id} checked in', athlete_id))
+
+def export_rows(client, query=''):
+    response = client.get('/export/history.csv' + query)
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True).lstrip('\ufeff'))))
+    return rows[0], rows[1:]
+
+def test_export_history_without_archives(client, conn):
+    add_athlete(conn, 1001)
+    add_activity(conn, '2026-03-01 10:00:00', 1001)
+    add_activity(conn, '2026-03-01 10:00:00', None)
+    add_activity(conn, '2026-03-02 09:00:00', 1001)
+    conn.commit()
+
+    header, rows = export_rows(client)
+    assert header[0] == 'Time'
+    assert len(rows) == 3
+    # Newest first, ties broken by id
+    assert [row[3] for row in rows] == ['1001', '', '1001']
+
+def test_export_history_with_archived_range(client, conn):
+    add_athlete(conn, 1001)
+    add_activity(conn, '2024-05-01 10:00:00', 1001)
+    add_activity(conn, '2024-06-01 10:00:00', 1001)
+    add_activity(conn, '2026-03-01 10:00:00', 1001)
+    conn.commit()
+    with gym.app.app_context():
+        moved, _ = gym.archive_old_data(days=365)
+    assert moved['activity_log'] == 2
+
+    # 1403/01/01 is 2024-03-20, so the range reaches into the archived year
+    _, rows = export_rows(client, '?from=1403/01/01')
+    assert len(rows) == 3
+    assert rows[0][0] > rows[1][0] > rows[2][0]
+
+    _, rows = export_rows(client)
+    assert len(rows) == 1
+
+def test_history_page_ignores_bad_cursor(client, conn):
+    add_athlete(conn, 1001)
+    add_activity(conn, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 1001)
+    conn.commit()
+    # base64 of '[{},1]': the right length, but an object as a key value
+    for param in ('after', 'before'):
+        response = client.get(f'/history?{param}=W3t9LDFd')
+        assert response.status_code == 200
+        assert 'Athlete 1001 checked in' in response.get_data(as_text=True)
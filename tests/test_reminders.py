@@ -0,0 +1,38 @@
+import json
+from datetime import date
+
+import birthday_enddate_reminder as reminders
+from birthday_enddate_reminder import birthday_month_days, is_birthday
+
+def plan(conn, query, params):
+    return ' | '.join(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params))
+
+def test_reminder_queries_search_their_indexes(conn):
+    birthday = plan(conn, reminders.BIRTHDAY_QUERY, (json.dumps(birthday_month_days(date(2026, 10, 18))),))
+    assert 'SEARCH athletes USING INDEX idx_athletes_gender_birth_month_day' in birthday
+    end_date = plan(conn, reminders.END_DATE_QUERY, ('2026-10-21',))
+    assert 'SEARCH athletes USING INDEX idx_athletes_gender_end_date' in end_date
+
+def test_esfand_30_is_celebrated_on_the_29th_in_common_years():
+    born_esfand_30 = '2021-03-20'  # 1399/12/30
+    # 1404 has no 30 Esfand: 2026-03-20 is 1404/12/29
+    assert is_birthday(born_esfand_30, date(2026, 3, 20), 'jalali')
+    assert is_birthday('2002-03-20', date(2026, 3, 20), 'jalali')  # 1380/12/29
+    # 1403 is leap: the 29th is not their day, the 30th is
+    assert not is_birthday(born_esfand_30, date(2025, 3, 19), 'jalali')
+    assert is_birthday(born_esfand_30, date(2025, 3, 20), 'jalali')
+
+def test_year_boundary_uses_the_jalali_day_not_the_gregorian_one():
+    born_farvardin_1 = '1996-03-20'  # 1375/01/01
+    # Same Gregorian month-day, but 2026-03-20 is still 29 Esfand
+    assert not is_birthday(born_farvardin_1, date(2026, 3, 20), 'jalali')
+    assert is_birthday(born_farvardin_1, date(2026, 3, 21), 'jalali')  # 1405/01/01
+    assert not is_birthday('2021-03-20', date(2026, 3, 21), 'jalali')
+
+def test_month_days_cover_every_matching_birth_date():
+    for today, born in ((date(2026, 3, 20), '2021-03-20'), (date(2026, 3, 21), '1996-03-20'),
+                        (date(2026, 3, 21), '1991-03-21'), (date(2026, 10, 18), '1990-10-18')):
+        assert is_birthday(born, today, 'jalali')
+        assert born[5:] in birthday_month_days(today, 'jalali')
+    assert birthday_month_days(date(2026, 2, 28), 'gregorian') == ['02-28', '02-29']
+    assert birthday_month_days(date(2028, 2, 28), 'gregorian') == ['02-28']
@@ -0,0 +1,46 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import app as gym
+import birthday_enddate_reminder as reminders
+import scheduler
+from scheduler import LEASE_TIMEOUT, Job, Scheduler, claim_slot, expire_leases
+
+def job_row(conn, name):
+    return conn.execute('SELECT status, owner FROM scheduled_jobs WHERE job = ?', (name,)).fetchone()
+
+def test_run_reminders_fails_when_a_reminder_query_fails(app, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)  # reminders append to ./applog.txt
+    def broken():
+        raise sqlite3.OperationalError('unable to open database file')
+    sent = []
+    monkeypatch.setattr(reminders, 'connect_readonly', broken)
+    monkeypatch.setattr(reminders, 'send_reminder_to_ending_period', lambda: sent.append('end'))
+
+    try:
+        scheduler.run_reminders()
+    except sqlite3.OperationalError:
+        pass
+    else:
+        raise AssertionError('run_reminders() swallowed the database error')
+    assert sent == ['end']
+
+def test_lease_keeps_other_schedulers_off_a_live_run(app, conn):
+    job = Job('backup', lambda: None, '30 3 * * *')
+    scheduler.init_scheduler(conn)
+    slot = datetime.now().replace(second=0, microsecond=0) - timedelta(minutes=1)
+    assert claim_slot(conn, job, slot, owner='other-host:1')
+
+    # A scheduler starting elsewhere leaves the live run alone
+    Scheduler([job], gym.open_db_connection)
+    assert job_row(conn, 'backup')['status'] == 'running'
+    assert not claim_slot(conn, job, slot + timedelta(minutes=1), owner='this-host:2')
+    assert expire_leases(conn) == []
+
+    # Once its heartbeat is older than LEASE_TIMEOUT the run counts as interrupted
+    conn.execute('UPDATE scheduled_jobs SET heartbeat_at = ?',
+                 ((datetime.now() - timedelta(seconds=LEASE_TIMEOUT + 1)).strftime('%Y-%m-%d %H:%M:%S'),))
+    conn.commit()
+    assert expire_leases(conn) == ['backup']
+    assert claim_slot(conn, job, slot + timedelta(minutes=1), owner='this-host:2')
+    assert tuple(job_row(conn, 'backup')) == ('running', 'this-host:2')
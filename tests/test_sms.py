@@ -0,0 +1,61 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import app as gym
+from sms import CLAIM_TIMEOUT, SmsDispatcher, queue_msg
+
+def stamp(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def test_drain_sends_due_messages_and_reclaims_only_stale_claims(app, conn):
+    for phone in ('09120000001', '09120000002', '09120000003'):
+        queue_msg(conn, phone, 'Ali', 'welcome')
+    now = datetime.now()
+    # 2 was claimed by a worker that died; 3 is being sent by a live one
+    conn.execute("UPDATE sms_outbox SET status = 'sending', claimed_at = ? WHERE phone = '09120000002'",
+                 (stamp(now - timedelta(seconds=CLAIM_TIMEOUT + 60)),))
+    conn.execute("UPDATE sms_outbox SET status = 'sending', claimed_at = ? WHERE phone = '09120000003'",
+                 (stamp(now),))
+    conn.commit()
+
+    sent = []
+    dispatcher = SmsDispatcher(gym.open_db_connection, send=lambda phone, name, pattern: sent.append(phone))
+    assert dispatcher.drain() == 2
+
+    assert sorted(sent) == ['09120000001', '09120000002']
+    statuses = dict(conn.execute('SELECT phone, status FROM sms_outbox'))
+    assert statuses == {'09120000001': 'sent', '09120000002': 'sent', '09120000003': 'sending'}
+
+def test_outcome_update_is_retried_after_lock_error(app, conn):
+    queue_msg(conn, '09120000001', 'Ali', 'welcome')
+    conn.commit()
+    failures = []
+
+    class LockedOnce(sqlite3.Connection):
+        def execute(self, sql, *args):
+            if "status = 'sent'" in sql and not failures:
+                failures.append(sql)
+                raise sqlite3.OperationalError('database is locked')
+            return super().execute(sql, *args)
+
+    sent = []
+    dispatcher = SmsDispatcher(lambda: sqlite3.connect(app.config['DATABASE'], factory=LockedOnce),
+                               send=lambda phone, name, pattern: sent.append(phone))
+    assert dispatcher.drain() == 1
+    assert dispatcher.drain() == 0
+
+    assert failures and sent == ['09120000001']
+    assert conn.execute('SELECT status FROM sms_outbox').fetchone()[0] == 'sent'
+
+def test_claim_does_not_retry_non_busy_errors(app):
+    dispatcher = SmsDispatcher(gym.open_db_connection)
+    worker_conn = gym.open_db_connection()
+    worker_conn.execute('BEGIN')  # a transaction left open by a failed statement
+    try:
+        dispatcher._claim(worker_conn)
+    except sqlite3.OperationalError as e:
+        assert 'within a transaction' in str(e)
+    else:
+        raise AssertionError('_claim() swallowed a non-busy error')
+    finally:
+        worker_conn.close()